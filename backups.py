@@ -0,0 +1,147 @@
+import gzip
+import logging
+import os
+import re
+import shutil
+import sqlite3
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from settings import (BACKUP_DIR, BACKUP_PAGES, BACKUP_SLEEP, BACKUP_KEEP_HOURLY, BACKUP_KEEP_DAILY,
+                      BACKUP_KEEP_WEEKLY)
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMP_FORMAT = "%Y-%m-%d_%H-%M-%S"
+
+# Таблицы загрузок, которые до перехода на файловое хранилище создавались для каждого пользователя
+LEGACY_UPLOAD_TABLE = re.compile(r"^\d+(box_capacity_id|items_to_ship_id|boxes_id)$")
+
+
+def keep_by_retention(timestamps: Iterable[datetime], hourly: int, daily: int, weekly: int) -> Set[datetime]:
+    """
+    Снимки, которые остаются по политике хранения.
+
+    Для последних hourly часов, daily дней и weekly недель, в которые делались снимки,
+    сохраняется самый свежий снимок каждого периода.
+    """
+    periods: Dict[str, Callable[[datetime], tuple]] = {
+        'hourly': lambda t: (t.date(), t.hour),
+        'daily': lambda t: (t.date(),),
+        'weekly': lambda t: tuple(t.isocalendar()[:2]),
+    }
+    limits = {'hourly': hourly, 'daily': daily, 'weekly': weekly}
+
+    newest_first = sorted(set(timestamps), reverse=True)
+    kept = set()
+    for name, period in periods.items():
+        seen = set()
+        for timestamp in newest_first:
+            key = period(timestamp)
+            if key in seen:
+                continue
+            if len(seen) >= limits[name]:
+                break
+            seen.add(key)
+            kept.add(timestamp)
+    return kept
+
+
+class BackupManager:
+    """
+    Резервные копии базы через online backup API SQLite.
+
+    Копирование идет порциями по pages страниц с паузой sleep секунд между ними, поэтому
+    не блокирует запись из бота. В регулярные снимки не попадают таблицы загрузок пользователей
+    (старые таблицы вида <user_id>box_capacity_id; новые загрузки лежат в файлах хранилища
+    и в базу не входят), копия перед миграцией схемы сохраняет все таблицы. Снимки сжимаются
+    gzip, старые удаляются по политике хранения.
+    """
+
+    def __init__(self, db_file: str, backup_dir: str = BACKUP_DIR, pages: int = BACKUP_PAGES,
+                 sleep: float = BACKUP_SLEEP) -> None:
+        self.db_file = db_file
+        self.backup_dir = backup_dir
+        self.pages = pages
+        self.sleep = sleep
+        self.name = os.path.splitext(os.path.basename(db_file))[0]
+        self._pattern = re.compile(rf"^{re.escape(self.name)}_(\d{{4}}-\d\d-\d\d_\d\d-\d\d-\d\d)\.db\.gz$")
+
+    def create_backup(self, keep_uploads: bool = False) -> str:
+        """
+        Создает сжатый снимок базы и возвращает путь к нему.
+
+        :param keep_uploads: Сохранить в снимке таблицы загрузок. Нужно для копии перед миграцией:
+                             из нее должна восстанавливаться база целиком.
+        """
+        os.makedirs(self.backup_dir, exist_ok=True)
+        timestamp = datetime.now().strftime(TIMESTAMP_FORMAT)
+        snapshot_path = os.path.join(self.backup_dir, f"{self.name}_{timestamp}.db.tmp")
+        backup_path = os.path.join(self.backup_dir, f"{self.name}_{timestamp}.db.gz")
+
+        try:
+            source = sqlite3.connect(self.db_file, timeout=30)
+            target = sqlite3.connect(snapshot_path)
+            try:
+                source.backup(target, pages=self.pages, sleep=self.sleep)
+                if not keep_uploads:
+                    self._drop_upload_tables(target)
+            finally:
+                target.close()
+                source.close()
+
+            with open(snapshot_path, 'rb') as snapshot, gzip.open(backup_path + '.tmp', 'wb') as compressed:
+                shutil.copyfileobj(snapshot, compressed, length=1024 * 1024)
+            os.replace(backup_path + '.tmp', backup_path)
+        finally:
+            for path in (snapshot_path, backup_path + '.tmp'):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        logger.info("Backup created at %s (%d bytes)", backup_path, os.path.getsize(backup_path))
+        return backup_path
+
+    @staticmethod
+    def _drop_upload_tables(connection: sqlite3.Connection) -> None:
+        tables = [row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+        upload_tables = [table for table in tables if LEGACY_UPLOAD_TABLE.match(table)]
+        if not upload_tables:
+            return
+        with connection:
+            for table in upload_tables:
+                connection.execute(f'DROP TABLE "{table}"')
+        # Освобожденные страницы убираем из снимка, иначе он не станет меньше
+        connection.execute("VACUUM")
+
+    def list_backups(self) -> Dict[datetime, str]:
+        """Снимки в каталоге резервных копий по времени создания."""
+        if not os.path.isdir(self.backup_dir):
+            return {}
+        backups = {}
+        for file_name in os.listdir(self.backup_dir):
+            match = self._pattern.match(file_name)
+            if match:
+                backups[datetime.strptime(match.group(1), TIMESTAMP_FORMAT)] = os.path.join(self.backup_dir, file_name)
+        return backups
+
+    def apply_retention(self, hourly: int = BACKUP_KEEP_HOURLY, daily: int = BACKUP_KEEP_DAILY,
+                        weekly: int = BACKUP_KEEP_WEEKLY) -> List[str]:
+        """Удаляет снимки, не попавшие в политику хранения, и возвращает их пути."""
+        backups = self.list_backups()
+        kept = keep_by_retention(backups, hourly, daily, weekly)
+        removed = [path for timestamp, path in sorted(backups.items()) if timestamp not in kept]
+        for path in removed:
+            os.remove(path)
+        if removed:
+            logger.info("Removed %d old backups", len(removed))
+        return removed
+
+    def run(self) -> Optional[str]:
+        """Снимок и очистка старых снимков. Ошибки записываются в лог: бот продолжает работу."""
+        try:
+            backup_path = self.create_backup()
+            self.apply_retention()
+            return backup_path
+        except Exception:
+            logger.exception("Backup failed")
+            return None
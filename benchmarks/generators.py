@@ -0,0 +1,78 @@
+"""Генераторы синтетических отгрузок для бенчмарков. Одинаковый seed дает одинаковые таблицы."""
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# Кратности, которые встречаются в реальных таблицах вместимости
+COMMON_MULTIPLICITIES = np.array([1, 2, 3, 4, 5, 6, 8, 10, 12, 15, 16, 20, 24, 30, 36, 40, 48, 50, 60, 100])
+
+# Взаимно простые кратности: худший случай для общего НОК коробки
+PRIME_MULTIPLICITIES = np.array([7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47])
+
+SIZES = np.array(['XS', 'S', 'M', 'L', 'XL', 'XXL', '42', '44', '46', '48', '50', '0'])
+
+DISTRIBUTIONS = ('uniform', 'skewed', 'primes')
+
+
+def multiplicities(n: int, distribution: str, rng: np.random.Generator) -> np.ndarray:
+    if distribution == 'uniform':
+        return rng.choice(COMMON_MULTIPLICITIES, n)
+    if distribution == 'skewed':
+        # Закон Ципфа: большинство товаров с несколькими популярными кратностями, длинный хвост редких
+        weights = 1 / np.arange(1, len(COMMON_MULTIPLICITIES) + 1) ** 1.5
+        return rng.choice(COMMON_MULTIPLICITIES, n, p=weights / weights.sum())
+    if distribution == 'primes':
+        return rng.choice(PRIME_MULTIPLICITIES, n)
+    raise ValueError(f"Unknown distribution: {distribution}")
+
+
+def box_capacity(n: int, distribution: str = 'uniform', seed: int = 0) -> pd.DataFrame:
+    """Таблица вместимости товаров в коробку на n баркодов."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'Артикул продавца': [f'ART-{i // 4:06d}' for i in range(n)],
+        'Размер': rng.choice(SIZES, n),
+        'Баркод': 2_000_000_000_000 + np.arange(n, dtype='int64'),
+        'Кратность': multiplicities(n, distribution, rng),
+    })
+
+
+def items_to_ship(capacity: pd.DataFrame, n: Optional[int] = None, seed: int = 0) -> pd.DataFrame:
+    """
+    Таблица количества товаров: n баркодов из таблицы вместимости.
+
+    Количество подобрано так, чтобы у большинства товаров были и полные коробки, и остаток.
+    """
+    rng = np.random.default_rng(seed + 1)
+    n = len(capacity) if n is None else min(n, len(capacity))
+    rows = capacity.iloc[rng.choice(len(capacity), n, replace=False)]
+    boxes = rng.lognormal(mean=0.5, sigma=1.0, size=n)
+    quantities = np.maximum(1, (boxes * rows['Кратность'].to_numpy()).astype('int64'))
+    return pd.DataFrame({'Баркод': rows['Баркод'].to_numpy(), 'Количество': quantities})
+
+
+def changed_items(items: pd.DataFrame, share: float = 0.01, seed: int = 0) -> pd.DataFrame:
+    """Та же отгрузка, в которой у доли share товаров изменено количество (повторная загрузка)."""
+    rng = np.random.default_rng(seed + 3)
+    changed = items.copy()
+    rows = rng.choice(len(items), max(1, int(len(items) * share)), replace=False)
+    changed.iloc[rows, 1] = changed.iloc[rows, 1].to_numpy() + rng.integers(1, 10, len(rows))
+    return changed
+
+
+def boxes_id(total_boxes: int, seed: int = 0) -> pd.DataFrame:
+    """Сгенерированные WB названия коробок в формате выгрузки из личного кабинета."""
+    rng = np.random.default_rng(seed + 2)
+    return pd.DataFrame({
+        'баркод товара': '',
+        'кол-во товаров': '',
+        'шк короба': [f'WB_{code}' for code in rng.integers(10 ** 9, 10 ** 10, total_boxes)],
+        'срок годности': '',
+    })
+
+
+def shipment(n: int, distribution: str = 'uniform', seed: int = 0):
+    """Таблицы вместимости и количества для отгрузки из n строк."""
+    capacity = box_capacity(n, distribution, seed)
+    return capacity, items_to_ship(capacity, seed=seed)
@@ -0,0 +1,211 @@
+"""
+Бенчмарки этапов обработки: разбор файлов, распознавание листов, упаковка, отчет и работа с БД.
+
+Запуск из корня проекта:
+    python -m benchmarks.run_benchmarks --sizes 10 1000 100000 --output bench.json
+    python -m benchmarks.run_benchmarks --compare bench.json --output bench_new.json
+
+Для каждого этапа записывается медиана и минимум времени по нескольким повторам и пиковая
+память (tracemalloc, отдельный прогон). При --compare выводится отношение ко времени из
+прошлого файла и возвращается код 1, если какой-то этап замедлился сильнее порога.
+"""
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+import pandas as pd
+
+import main
+from benchmarks import generators
+
+STAGES = ('parse_xlsx', 'parse_csv', 'classify', 'pack', 'pack_optimized', 'repack', 'pack_rows', 'report',
+          'db_roundtrip')
+DEFAULT_SIZES = (10, 100, 1000, 10000, 100000)
+
+
+def to_xlsx(sheets: Dict[str, pd.DataFrame]) -> bytes:
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        for name, df in sheets.items():
+            df.to_excel(writer, sheet_name=name, index=False)
+    return output.getvalue()
+
+
+def unrelated_sheet(n: int) -> pd.DataFrame:
+    """Лист с посторонними данными, какие бывают в выгрузках WB и 1С."""
+    return pd.DataFrame({f'Показатель {i}': range(n) for i in range(10)})
+
+
+def prepare_stage(stage: str, capacity: pd.DataFrame, items: pd.DataFrame, workdir: str) -> Tuple[Callable, Callable]:
+    """Возвращает (setup, function): setup готовит свежие аргументы, function выполняет этап."""
+    def copies():
+        return capacity.copy(), items.copy()
+
+    # Бот разбирает скачанный во временный файл документ по пути
+    if stage == 'parse_xlsx':
+        path = os.path.join(workdir, 'upload.xlsx')
+        with open(path, 'wb') as file:
+            file.write(to_xlsx({'Вместимость': capacity, 'Посторонние данные': unrelated_sheet(len(items)),
+                                'Отгрузка': items}))
+        return lambda: (path,), main.open_excel
+
+    if stage == 'parse_csv':
+        path = os.path.join(workdir, 'upload.csv')
+        with open(path, 'wb') as file:
+            file.write(items.to_csv(index=False, sep=';').encode('cp1251'))
+        return lambda: (path,), main.open_excel
+
+    if stage == 'classify':
+        return copies, lambda c, i: (main.is_box_capacity(c), main.is_items_to_ship(i))
+
+    if stage == 'pack':
+        def pack(c, i):
+            main.packing_cache.clear()
+            return main.count_boxes(c, i)
+        return copies, pack
+
+    if stage == 'pack_optimized':
+        return copies, lambda c, i: main.plan_packing(c, i, optimize=True)
+
+    if stage == 'repack':
+        # Повторная загрузка с изменением 1% товаров поверх сохраненной раскладки
+        layout = main.plan_packing(capacity.copy(), items.copy()).to_layout()
+        changed = generators.changed_items(items)
+        return lambda: (capacity.copy(), changed.copy()), lambda c, i: main.plan_packing(c, i, layout=layout)
+
+    if stage == 'pack_rows':
+        return copies, main.pack_boxes
+
+    if stage == 'report':
+        total_boxes = main.count_boxes(capacity.copy(), items.copy())
+        boxes_id = generators.boxes_id(total_boxes)
+        # План упаковки уже в кэше, как после нажатия «Посчитать коробки»
+        return lambda: (capacity.copy(), items.copy(), boxes_id), main.generate_report
+
+    if stage == 'db_roundtrip':
+        from db import Database
+
+        database = Database(os.path.join(workdir, 'bench.db'), uploads_dir=os.path.join(workdir, 'uploads'))
+        database.connection.execute("CREATE TABLE IF NOT EXISTS files "
+                                    "(user_id INTEGER PRIMARY KEY, box_capacity_id TEXT, items_to_ship_id TEXT, "
+                                    "boxes_id TEXT)")
+        database.connection.execute("INSERT OR IGNORE INTO files (user_id) VALUES (1)")
+
+        def roundtrip(c, i):
+            database.save_dataframe(1, 'box_capacity_id', c)
+            database.save_dataframe(1, 'items_to_ship_id', i)
+            return database.get_data_from_db(1)
+        return copies, roundtrip
+
+    raise ValueError(f"Unknown stage: {stage}")
+
+
+def measure(setup: Callable, function: Callable, repeat: int) -> Dict[str, float]:
+    times = []
+    for _ in range(repeat):
+        args = setup()
+        gc.collect()
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+
+    # Пиковую память меряем отдельным прогоном: tracemalloc заметно замедляет выполнение
+    args = setup()
+    gc.collect()
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'seconds_median': statistics.median(times), 'seconds_min': min(times), 'peak_bytes': peak}
+
+
+def run(sizes: List[int], distributions: List[str], stages: List[str], repeat: int, seed: int) -> List[Dict]:
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for distribution in distributions:
+            for size in sizes:
+                capacity, items = generators.shipment(size, distribution, seed)
+                total_boxes = main.count_boxes(capacity.copy(), items.copy())
+                for stage in stages:
+                    setup, function = prepare_stage(stage, capacity, items, workdir)
+                    result = {'stage': stage, 'size': size, 'distribution': distribution,
+                              'rows': len(items), 'skus': int(items['Баркод'].nunique()), 'boxes': total_boxes}
+                    result.update(measure(setup, function, repeat))
+                    results.append(result)
+                    print(f"{stage:>13} {distribution:>8} {size:>7}: {result['seconds_median'] * 1000:10.2f} ms  "
+                          f"{result['peak_bytes'] / 2 ** 20:8.1f} MiB", flush=True)
+    return results
+
+
+def result_key(result: Dict) -> Tuple:
+    return result['stage'], result['distribution'], result['size']
+
+
+def compare(previous: List[Dict], current: List[Dict], threshold: float) -> List[Dict]:
+    """Сравнивает медианы времени и возвращает этапы, замедлившиеся больше чем в threshold раз."""
+    baseline = {result_key(result): result for result in previous}
+    regressions = []
+    for result in current:
+        old = baseline.get(result_key(result))
+        if old is None or not old['seconds_median']:
+            continue
+        ratio = result['seconds_median'] / old['seconds_median']
+        marker = ''
+        if ratio > threshold:
+            marker = '  <-- REGRESSION'
+            regressions.append(dict(result, ratio=ratio))
+        print(f"{result['stage']:>13} {result['distribution']:>8} {result['size']:>7}: x{ratio:6.2f}{marker}")
+    return regressions
+
+
+def main_cli(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES))
+    parser.add_argument('--distributions', nargs='+', default=list(generators.DISTRIBUTIONS),
+                        choices=generators.DISTRIBUTIONS)
+    parser.add_argument('--stages', nargs='+', default=list(STAGES), choices=STAGES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help="JSON с результатами прошлого запуска")
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help="Во сколько раз этап может замедлиться, прежде чем это считается регрессией")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.distributions, args.stages, args.repeat, args.seed)
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'seed': args.seed,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)['results']
+        if compare(previous, results, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
@@ -0,0 +1,97 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """
+    Ограниченный по числу записей LRU-кэш со счетчиками попаданий и промахов.
+
+    При переполнении вытесняется запись, к которой дольше всего не обращались.
+    Дополнительно можно ограничить время жизни записей (ttl, секунды) и их суммарный
+    размер (max_bytes): размер записи считает функция sizeof.
+    """
+
+    def __init__(self, maxsize: int = 128, ttl: Optional[float] = None, max_bytes: Optional[int] = None,
+                 sizeof: Optional[Callable[[Any], int]] = None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.nbytes = 0
+        self._data = OrderedDict()  # ключ -> (значение, время истечения, размер)
+        self._lock = Lock()
+
+    def _expired(self, entry) -> bool:
+        return entry[1] is not None and entry[1] <= time.monotonic()
+
+    def _remove(self, key: Hashable):
+        value, _, size = self._data.pop(key)
+        self.nbytes -= size
+        return value
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if self._expired(entry):
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        size = self.sizeof(value) if self.sizeof is not None else 0
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            # Запись больше всего бюджета памяти не кэшируем, чтобы не вытеснять ради нее остальные
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._data[key] = (value, expires, size)
+            self.nbytes += size
+            while len(self._data) > self.maxsize or (self.max_bytes is not None and self.nbytes > self.max_bytes):
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            return self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and not self._expired(entry)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "bytes": self.nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
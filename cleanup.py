@@ -0,0 +1,147 @@
+import logging
+import os
+import sqlite3
+import time
+from typing import Dict, List, Set
+
+from backups import LEGACY_UPLOAD_TABLE
+from settings import UPLOADS_DIR, GC_BATCH, GC_GRACE, GC_PAUSE, GC_VACUUM_PAGES
+
+logger = logging.getLogger(__name__)
+
+# Столбцы, в которых хранятся ссылки на загрузки: путь к файлу или имя старой таблицы
+REFERENCE_COLUMNS = {
+    "files": ("box_capacity_id", "items_to_ship_id", "boxes_id", "packing_id"),
+    "shipments": ("items_to_ship_id",),
+}
+
+
+class UploadCollector:
+    """
+    Сборка мусора загрузок пользователей.
+
+    Удаляет файлы хранилища и старые таблицы <user_id>box_capacity_id (и т.п.), на которые
+    не ссылаются таблицы files и shipments. Таблицы удаляются порциями по batch штук в отдельных
+    транзакциях с паузами, чтобы не задерживать запись из бота. Файл удаляется, только если
+    он остается без ссылок не меньше grace секунд: файл загрузки пишется до коммита, который
+    на него сошлется, а ссылку могут вернуть. Освободившиеся страницы базы возвращаются
+    инкрементальным VACUUM.
+    """
+
+    def __init__(self, db_file: str, uploads_dir: str = UPLOADS_DIR, batch: int = GC_BATCH,
+                 grace: float = GC_GRACE, pause: float = GC_PAUSE, vacuum_pages: int = GC_VACUUM_PAGES) -> None:
+        self.db_file = db_file
+        self.uploads_dir = uploads_dir
+        self.batch = max(1, batch)
+        self.grace = grace
+        self.pause = pause
+        self.vacuum_pages = max(1, vacuum_pages)
+        # Файлы без ссылок и время, когда сборка впервые застала их такими
+        self._unreferenced: Dict[str, float] = {}
+
+    @staticmethod
+    def referenced(connection: sqlite3.Connection) -> Set[str]:
+        """Все ссылки на загрузки из базы. Пути приводятся к нормальному виду."""
+        tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        references = set()
+        for table, columns in REFERENCE_COLUMNS.items():
+            if table not in tables:
+                continue
+            table_columns = {row[1] for row in connection.execute(f"PRAGMA table_info({table})")}
+            for column in columns:
+                if column not in table_columns:
+                    continue
+                for (reference,) in connection.execute(f"SELECT {column} FROM {table} WHERE {column} IS NOT NULL"):
+                    references.add(os.path.normpath(reference))
+        return references
+
+    def _drop_tables(self, connection: sqlite3.Connection, references: Set[str]) -> int:
+        tables = [row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+        orphaned = [table for table in tables if LEGACY_UPLOAD_TABLE.match(table) and table not in references]
+
+        for start in range(0, len(orphaned), self.batch):
+            with connection:
+                for table in orphaned[start:start + self.batch]:
+                    connection.execute(f'DROP TABLE IF EXISTS "{table}"')
+            time.sleep(self.pause)
+        return len(orphaned)
+
+    def _delete_files(self, connection: sqlite3.Connection, references: Set[str]) -> List[int]:
+        """Удаляет файлы, оставшиеся без ссылок на grace секунд. Возвращает [число файлов, байт]."""
+        deleted, freed = 0, 0
+        if not os.path.isdir(self.uploads_dir):
+            self._unreferenced.clear()
+            return [deleted, freed]
+
+        # Отсчет grace идет с первой сборки, которая застала файл без ссылок, а не от записи файла:
+        # файл мог лежать давно, а ссылка на него — пропасть только что
+        now = time.time()
+        unreferenced = {}
+        for directory, _, file_names in os.walk(self.uploads_dir):
+            for file_name in file_names:
+                path = os.path.normpath(os.path.join(directory, file_name))
+                if path not in references:
+                    unreferenced[path] = self._unreferenced.get(path, now)
+        self._unreferenced = unreferenced
+
+        expired = [path for path, since in unreferenced.items() if since <= now - self.grace]
+        if expired:
+            # Пока шли удаление таблиц и обход каталога, бот мог снова сослаться на файл
+            references = self.referenced(connection)
+        for path in expired:
+            del self._unreferenced[path]
+            if path in references:
+                continue
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            deleted += 1
+            freed += size
+
+        # Пустые каталоги пользователей тоже убираем
+        for directory, subdirectories, file_names in os.walk(self.uploads_dir, topdown=False):
+            if directory != self.uploads_dir and not subdirectories and not file_names:
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    pass
+        return [deleted, freed]
+
+    def _vacuum(self, connection: sqlite3.Connection) -> None:
+        if connection.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # Режим включает миграция схемы при запуске бота (Database.initialize_database),
+            # полный VACUUM живой базы здесь не выполняется
+            logger.warning("Database auto_vacuum is not incremental, skipping VACUUM")
+            return
+
+        while connection.execute("PRAGMA freelist_count").fetchone()[0] > 0:
+            connection.execute(f"PRAGMA incremental_vacuum({self.vacuum_pages})").fetchall()
+            time.sleep(self.pause)
+
+    def collect(self) -> Dict[str, int]:
+        """Выполняет сборку мусора и возвращает отчет об освобожденном месте."""
+        connection = sqlite3.connect(self.db_file, timeout=30)
+        try:
+            page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+            pages_before = connection.execute("PRAGMA page_count").fetchone()[0]
+
+            # Новые загрузки без ссылок защищены периодом grace, перед удалением ссылки читаются еще раз
+            references = self.referenced(connection)
+            tables_dropped = self._drop_tables(connection, references)
+            files_deleted, file_bytes = self._delete_files(connection, references)
+            self._vacuum(connection)
+
+            pages_after = connection.execute("PRAGMA page_count").fetchone()[0]
+        finally:
+            connection.close()
+
+        report = {
+            "tables_dropped": tables_dropped,
+            "files_deleted": files_deleted,
+            "file_bytes": file_bytes,
+            "database_bytes": max(pages_before - pages_after, 0) * page_size,
+        }
+        logger.info("Upload GC: %s", report)
+        return report
@@ -1,16 +1,82 @@
 import sqlite3
-import os
-import shutil
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Union, Dict, Any, Optional
+from typing import List, Union, Dict, Any, Optional, Tuple, Callable, Hashable, TYPE_CHECKING
 from aiogram.types import Message
 import random
 import string
 from auth_data import MAX_FREE_USAGE_LIMIT, admins
-import pandas as pd
+from backups import BackupManager
+from cache import LRUCache
+from settings import UPLOADS_DIR, FRAME_CACHE_SIZE, FRAME_CACHE_TTL, FRAME_CACHE_MAX_MB, ROW_CACHE_SIZE
+from storage import UploadStore
+
+# pandas загружается только при первом чтении таблиц, чтобы бот запускался быстрее
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+def frames_size(frames: List[Optional["pd.DataFrame"]]) -> int:
+    """Объем памяти, который занимают таблицы, в байтах."""
+    return sum(int(df.memory_usage(deep=True).sum()) for df in frames if df is not None)
+
+
+def user_key(conditions: Dict[str, Any]) -> Optional[int]:
+    """
+    user_id, если условие выбирает строку пользователя только по нему.
+
+    Приводится к int: SQLite находит строку и по '42', но в кэше это был бы другой ключ.
+    """
+    if len(conditions) == 1 and "user_id" in conditions:
+        try:
+            return int(conditions["user_id"])
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+class UnitOfWork:
+    """
+    Изменения, которые выполняются одной транзакцией через Database.commit.
+
+    Поддерживает изменяющие методы Database (WRITE_METHODS) с теми же аргументами:
+    вызовы не выполняются сразу, а записываются по порядку в operations.
+    """
+
+    def __init__(self) -> None:
+        self.operations: List[Tuple[str, tuple, dict]] = []
+
+    def __getattr__(self, name: str):
+        if name not in Database.WRITE_METHODS:
+            raise AttributeError(f"{name} нельзя выполнить в UnitOfWork")
+
+        def record(*args, **kwargs) -> None:
+            self.operations.append((name, args, kwargs))
+
+        return record
+
+    def __bool__(self) -> bool:
+        return bool(self.operations)
 
 
 class Database:
+    # Методы, которые можно записать в UnitOfWork
+    WRITE_METHODS = {"insert_into_table", "update_table", "save_dataframe", "reset_amount_of_boxes",
+                     "reset_file_ids", "save_packing_layout", "save_shipments", "clear_shipments",
+                     "create_generation"}
+
+    # Таблицы со строкой на пользователя: их строки кэшируются с записью через кэш
+    CACHED_TABLES = ("users", "files")
+
+    # Последняя версия схемы. Базы, созданные до версионирования (user_version = 0),
+    # один раз пересобираются по TABLE_DEFINITIONS, новые — создаются миграциями
     TABLE_DEFINITIONS = {
         "users": [
             ("user_id", "INTEGER PRIMARY KEY"),
@@ -28,66 +94,275 @@ class Database:
             ("box_capacity_id", "TEXT"),
             ("items_to_ship_id", "TEXT"),
             ("boxes_id", "TEXT"),
+            ("packing_id", "TEXT"),
         ],
         "generations": [
             ("generation_id", "INTEGER PRIMARY KEY AUTOINCREMENT"),
             ("user_id", "INTEGER"),
             ("generation_date", "TEXT"),
-        ]
+        ],
+        "shipments": [
+            ("shipment_id", "INTEGER PRIMARY KEY AUTOINCREMENT"),
+            ("user_id", "INTEGER"),
+            ("name", "TEXT"),
+            ("items_to_ship_id", "TEXT"),
+        ],
     }
 
-    def __init__(self, db_file: str) -> None:
-        self.db_file = db_file
-        self.connection = sqlite3.connect(db_file)
-        self.connection.row_factory = sqlite3.Row
-        self.cursor = self.connection.cursor()
-
-    def initialize_database(self) -> None:
-        backup_dir = "backups"
-
-        if not os.path.exists(backup_dir):
-            os.makedirs(backup_dir)
-
-        backup_db_path = os.path.join(
-            backup_dir,
-            f"{os.path.basename(self.db_file[:-3])}_backup_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.db"
-        )
-
-        shutil.copy2(self.db_file, backup_db_path)
-        print(f"Backup created at {backup_db_path}")
-
-        with self.connection:
-            for table, definition in self.TABLE_DEFINITIONS.items():
-                temp_table_name = f"{table}_temp"
+    # Миграции схемы: элемент N переводит базу с версии N на N + 1 (PRAGMA user_version).
+    # Изменение схемы добавляется и сюда, и в TABLE_DEFINITIONS
+    MIGRATIONS = [
+        # 1: исходные таблицы
+        [
+            "CREATE TABLE users (user_id INTEGER PRIMARY KEY, first_name TEXT, last_name TEXT, username TEXT, "
+            "password TEXT, usage_limit INTEGER, is_authorized INTEGER DEFAULT 0, registration_date TEXT, "
+            "amount_of_boxes INTEGER DEFAULT 0)",
+            "CREATE TABLE files (user_id INTEGER PRIMARY KEY, box_capacity_id TEXT, items_to_ship_id TEXT, "
+            "boxes_id TEXT)",
+            "CREATE TABLE generations (generation_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, "
+            "generation_date TEXT)",
+        ],
+        # 2: отгрузки пакетного режима
+        [
+            "CREATE TABLE shipments (shipment_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, name TEXT, "
+            "items_to_ship_id TEXT)",
+        ],
+        # 3: раскладка последнего подсчета коробок
+        [
+            "ALTER TABLE files ADD COLUMN packing_id TEXT",
+        ],
+        # 4: место от удаленных загрузок возвращается инкрементальным VACUUM (cleanup.py).
+        # Режим вступает в силу после полного VACUUM, его выполняет initialize_database
+        [
+            "PRAGMA auto_vacuum = INCREMENTAL",
+        ],
+    ]
+    SCHEMA_VERSION = len(MIGRATIONS)
 
-                # Получаем список всех таблиц
-                self.cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-                all_tables = [row['name'] for row in self.cursor.fetchall()]
+    def __init__(self, db_file: str, uploads_dir: str = UPLOADS_DIR) -> None:
+        self.db_file = db_file
+        self.uploads = UploadStore(uploads_dir)
+        # Соединение для записи. Используется только из одного потока (см. AsyncDatabase)
+        self.connection = self._connect()
+        # Соединения для чтения создаются отдельно для каждого потока
+        self._local = threading.local()
+        # Таблицы пользователей меняются только при загрузке, поэтому повторные чтения берутся из памяти
+        self.frames = LRUCache(maxsize=FRAME_CACHE_SIZE, ttl=FRAME_CACHE_TTL,
+                               max_bytes=int(FRAME_CACHE_MAX_MB * 2 ** 20), sizeof=frames_size)
+        # Строки users и files по (таблица, user_id). Изменения записываются в кэш после коммита
+        self.rows = LRUCache(maxsize=ROW_CACHE_SIZE)
+        # Версия ключа кэша не дает читателю положить в кэш данные, устаревшие за время чтения
+        self._versions: Dict[Hashable, int] = {}
+        self._cache_lock = threading.Lock()
+        # Внутри commit изменения копятся в одной транзакции, а обновления кэшей — до ее завершения
+        self._batching = False
+        self._pending: List[Callable[[], None]] = []
+        # Изменения других процессов бота (см. shards.py), GC и миграций отслеживаются по PRAGMA
+        # data_version. Читатели проверяют его на отдельном соединении _monitor (соединение записи
+        # используется только потоком записи), свои коммиты учитывает _track_commit
+        self._monitor = self._connect()
+        self._data_version = self._read_data_version(self._monitor)
+        self._write_data_version = self._read_data_version(self.connection)
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.db_file, timeout=30, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        # WAL позволяет читать параллельно с записью, NORMAL избавляет от fsync на каждый коммит
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    @property
+    def read_connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+        return connection
+
+    @contextmanager
+    def _write(self):
+        """Транзакция записи. Внутри commit используется общая транзакция UnitOfWork."""
+        if self._batching:
+            yield self.connection
+        else:
+            with self.connection:
+                yield self.connection
+            self._track_commit()
+
+    def _after_write(self, callback: Callable[[], None]) -> None:
+        """Выполняет обновление кэша сразу или, внутри commit, после успешного коммита."""
+        if self._batching:
+            self._pending.append(callback)
+        else:
+            callback()
+
+    def commit(self, unit: UnitOfWork) -> list:
+        """
+        Выполняет изменения UnitOfWork одной транзакцией: либо все, либо ни одного.
 
-                # Если таблица существует, копируем её во временную
-                if table in all_tables:
-                    self.cursor.execute(f"DROP TABLE IF EXISTS {temp_table_name}")
-                    self.cursor.execute(f"CREATE TABLE {temp_table_name} AS SELECT * FROM {table}")
-                    self.cursor.execute(f"DROP TABLE {table}")
+        :return: Результаты операций по порядку.
+        """
+        if not unit:
+            return []
+        self._batching = True
+        try:
+            with self.connection:
+                results = [getattr(self, name)(*args, **kwargs) for name, args, kwargs in unit.operations]
+            self._track_commit()
+            for callback in self._pending:
+                callback()
+            return results
+        finally:
+            self._batching = False
+            self._pending = []
 
-                # Создаем новую таблицу с обновленными определениями
-                columns = ", ".join([f"{col_name} {col_definition}" for col_name, col_definition in definition])
-                self.cursor.execute(f"CREATE TABLE {table} ({columns})")
+    @staticmethod
+    def _read_data_version(connection: sqlite3.Connection) -> int:
+        return connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def _clear_caches(self) -> None:
+        # Вызывается под _cache_lock
+        for key in self._versions:
+            self._versions[key] += 1
+        self.rows.clear()
+        self.frames.clear()
+
+    def _sync_caches(self) -> None:
+        """Сбрасывает кэши, если базу изменило другое соединение с момента прошлой проверки."""
+        with self._cache_lock:
+            data_version = self._read_data_version(self._monitor)
+            if data_version == self._data_version:
+                return
+            self._data_version = data_version
+            self._clear_caches()
+
+    def _track_commit(self) -> None:
+        """
+        Учитывает коммит соединения записи. Вызывается в потоке записи после каждого коммита.
 
-                # Если таблица существовала и была скопирована, копируем данные обратно
-                if table in all_tables:
-                    self.cursor.execute(f"PRAGMA table_info({temp_table_name});")
-                    temp_table_cols = [row["name"] for row in self.cursor.fetchall()]
+        Свой коммит тоже меняет data_version соединения _monitor, поэтому запоминается новое значение.
+        data_version соединения записи меняется только от коммитов других соединений: если он
+        изменился, другой процесс успел что-то записать, и кэши сбрасываются.
+        """
+        with self._cache_lock:
+            self._data_version = self._read_data_version(self._monitor)
+            write_data_version = self._read_data_version(self.connection)
+            if write_data_version != self._write_data_version:
+                self._write_data_version = write_data_version
+                self._clear_caches()
+
+    def _cache_put(self, cache: LRUCache, key: Hashable, version: int, value) -> None:
+        with self._cache_lock:
+            if self._versions.get(key, 0) == version:
+                cache.put(key, value)
+
+    def _cache_invalidate(self, cache: LRUCache, key: Hashable) -> None:
+        with self._cache_lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            cache.pop(key)
+
+    def _write_through(self, table_name: str, values: Dict[str, Any], conditions: Dict[str, Any]) -> None:
+        if table_name not in self.CACHED_TABLES:
+            return
+        user_id = user_key(conditions)
+        if user_id is None:
+            # Изменение по другому условию может затронуть любые строки
+            with self._cache_lock:
+                for key in list(self._versions):
+                    if key[0] == table_name:
+                        self._versions[key] += 1
+                self.rows.clear()
+            return
+        key = (table_name, user_id)
+        with self._cache_lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            row = self.rows.pop(key)
+            if row is not None:
+                self.rows.put(key, {**row, **values})
 
-                    # Получите столбцы для новой таблицы из definition
-                    new_table_cols = [col[0] for col in definition]
+    def initialize_database(self) -> None:
+        """
+        Приводит схему базы к последней версии (SCHEMA_VERSION).
 
-                    # Определите общие столбцы между двумя таблицами
-                    common_cols = ", ".join([col for col in new_table_cols if col in temp_table_cols])
-                    self.cursor.execute(
-                        f"INSERT INTO {table} ({common_cols}) SELECT {common_cols} FROM {temp_table_name}")
-                    self.cursor.execute(f"DROP TABLE {temp_table_name}")
-            print("Database is initialized")
+        Версия хранится в PRAGMA user_version. Если она актуальна, база не изменяется и не копируется.
+        Иначе создается резервная копия и применяются недостающие миграции одной транзакцией.
+        """
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version == self.SCHEMA_VERSION:
+            logger.info("Database schema is up to date (version %d)", version)
+            return
+        if version > self.SCHEMA_VERSION:
+            logger.warning("Database schema version %d is newer than supported %d", version, self.SCHEMA_VERSION)
+            return
+
+        tables = {row['name'] for row in
+                  self.connection.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()}
+        if tables:
+            self._backup_database()
+
+        cursor = self.connection.cursor()
+        # DDL в модуле sqlite3 не открывает транзакцию сам, поэтому начинаем ее явно
+        cursor.execute("BEGIN")
+        try:
+            applied = self.MIGRATIONS[version:]
+            if version == 0 and "users" in tables:
+                # База создана до версионирования схемы: один раз пересобираем таблицы по TABLE_DEFINITIONS
+                self._rebuild_tables(cursor)
+                applied = []
+            for statements in applied:
+                for statement in statements:
+                    cursor.execute(statement)
+            cursor.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+        if self.connection.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # VACUUM нельзя выполнить в транзакции миграций. Он нужен один раз, пока бот еще не принимает
+            # сообщения; пересборка старой базы миграции не применяет, поэтому режим задается и здесь
+            logger.info("Switching database to incremental auto_vacuum")
+            self.connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            self.connection.execute("VACUUM")
+        logger.info("Database schema migrated from version %d to %d", version, self.SCHEMA_VERSION)
+        self.rows.clear()
+        self.frames.clear()
+
+    def _backup_database(self) -> None:
+        # Копия перед миграцией сохраняет и старые таблицы загрузок, чтобы откат не терял данные
+        backup_db_path = BackupManager(self.db_file).create_backup(keep_uploads=True)
+        logger.info("Backup created at %s", backup_db_path)
+
+    def _rebuild_tables(self, cursor: sqlite3.Cursor) -> None:
+        for table, definition in self.TABLE_DEFINITIONS.items():
+            temp_table_name = f"{table}_temp"
+
+            # Получаем список всех таблиц
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
+            all_tables = [row['name'] for row in cursor.fetchall()]
+
+            # Если таблица существует, копируем её во временную
+            if table in all_tables:
+                cursor.execute(f"DROP TABLE IF EXISTS {temp_table_name}")
+                cursor.execute(f"CREATE TABLE {temp_table_name} AS SELECT * FROM {table}")
+                cursor.execute(f"DROP TABLE {table}")
+
+            # Создаем новую таблицу с обновленными определениями
+            columns = ", ".join([f"{col_name} {col_definition}" for col_name, col_definition in definition])
+            cursor.execute(f"CREATE TABLE {table} ({columns})")
+
+            # Если таблица существовала и была скопирована, копируем данные обратно
+            if table in all_tables:
+                cursor.execute(f"PRAGMA table_info({temp_table_name});")
+                temp_table_cols = [row["name"] for row in cursor.fetchall()]
+
+                # Получите столбцы для новой таблицы из definition
+                new_table_cols = [col[0] for col in definition]
+
+                # Определите общие столбцы между двумя таблицами
+                common_cols = ", ".join([col for col in new_table_cols if col in temp_table_cols])
+                cursor.execute(
+                    f"INSERT INTO {table} ({common_cols}) SELECT {common_cols} FROM {temp_table_name}")
+                cursor.execute(f"DROP TABLE {temp_table_name}")
 
     def get_row_as_dict(self,
                         conditions: Dict[str, Any],
@@ -100,26 +375,47 @@ class Database:
         if isinstance(table_names, str):
             table_names = [table_names]
 
+        user_id = user_key(conditions)
         for table_name in table_names:
-            # Формируем строку для WHERE
-            where_str = " AND ".join([f"{col} = ?" for col in conditions.keys()])
-
-            query = f"""
-                    SELECT * 
-                    FROM {table_name}
-                    WHERE {where_str}
-                """
-
-            row = self.cursor.execute(query, tuple(conditions.values())).fetchone()
+            if user_id is not None and table_name in self.CACHED_TABLES:
+                row = self._get_user_row(table_name, user_id)
+            else:
+                row = self._select_row(table_name, conditions)
 
             if row is not None:
-                data.update(dict(row))
+                data.update(row)
 
         return data if data else None
 
+    def _select_row(self, table_name: str, conditions: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        # Формируем строку для WHERE
+        where_str = " AND ".join([f"{col} = ?" for col in conditions.keys()])
+
+        query = f"""
+                SELECT * 
+                FROM {table_name}
+                WHERE {where_str}
+            """
+
+        row = self.read_connection.execute(query, tuple(conditions.values())).fetchone()
+        return None if row is None else dict(row)
+
+    def _get_user_row(self, table_name: str, user_id: int) -> Optional[Dict[str, Any]]:
+        self._sync_caches()
+        key = (table_name, user_id)
+        row = self.rows.get(key)
+        if row is None:
+            version = self._versions.get(key, 0)
+            row = self._select_row(table_name, {"user_id": user_id})
+            if row is None:
+                return None
+            self._cache_put(self.rows, key, version, row)
+        # Копия, чтобы изменения у вызывающего не попадали в кэш
+        return dict(row)
+
     def insert_into_table(self, table_name: str, values: Dict[str, Any]) -> None:
-        with self.connection:
-            cursor = self.connection.cursor()
+        with self._write() as connection:
+            cursor = connection.cursor()
 
             # Формируем строку для колонок и значения
             columns_str = ", ".join(values.keys())
@@ -131,6 +427,12 @@ class Database:
             # Выполняем запрос
             cursor.execute(sql, list(values.values()))
 
+        # Значения по умолчанию задает база, поэтому строка будет прочитана заново
+        user_id = user_key({"user_id": values.get("user_id")})
+        if table_name in self.CACHED_TABLES and user_id is not None:
+            key = (table_name, user_id)
+            self._after_write(lambda: self._cache_invalidate(self.rows, key))
+
     def update_table(self, table_name: str, values: Dict[str, Any],
                      conditions: Dict[str, Any]) -> Union[Dict[str, Any], None]:
         """
@@ -139,9 +441,10 @@ class Database:
         :param table_name: Имя таблицы для обновления.
         :param values: Словарь с новыми значениями { 'column1': new_value1, 'column2': new_value2, ... }.
         :param conditions: Словарь с условиями для WHERE { 'column1': value1, 'column2': value2, ... }.
-        :return: Обновленная строка или None, если строка не найдена.
+        :return: Обновленная строка или None, если строка не найдена. Внутри commit всегда None:
+                 строка станет доступна только после коммита.
         """
-        with self.connection:
+        with self._write() as connection:
             # Формируем строку для SET
             set_str = ", ".join([f"{col} = ?" for col in values.keys()])
 
@@ -152,9 +455,13 @@ class Database:
             sql = f"UPDATE {table_name} SET {set_str} WHERE {where_str}"
 
             # Выполняем запрос
-            self.cursor.execute(sql, list(values.values()) + list(conditions.values()))
+            connection.execute(sql, list(values.values()) + list(conditions.values()))
 
-        # Получаем и возвращаем обновленную строку
+        self._after_write(lambda: self._write_through(table_name, values, conditions))
+        if self._batching:
+            return None
+
+        # Получаем и возвращаем обновленную строку (для строк пользователей — из кэша)
         return self.get_row_as_dict(conditions, table_name)
 
     def create_user(self, message: Message) -> Dict[str, Any]:
@@ -182,9 +489,13 @@ class Database:
         user_data = self.get_row_as_dict({'user_id': user_id})
         user_data["password"] = self.generate_password()
         user_data["is_authorized"] = 1 if user_data["username"] in admins else 0
-        self.update_table("users", {"password": user_data["password"], "is_authorized": user_data["is_authorized"]},
+        # Новый пароль и сброс загрузок, включая отгрузки пакетного режима, — одна транзакция
+        unit = UnitOfWork()
+        unit.update_table("users", {"password": user_data["password"], "is_authorized": user_data["is_authorized"]},
                           {"user_id": user_id})
-        self.reset_file_ids(user_id)
+        unit.reset_file_ids(user_id)
+        unit.clear_shipments(user_id)
+        self.commit(unit)
         return user_data
 
     @staticmethod
@@ -198,7 +509,7 @@ class Database:
         return password
 
     def decrease_usage_limit(self, user_id: int) -> int:
-        with self.connection:
+        with self._write() as connection:
             user_data = self.get_row_as_dict({'user_id': user_id}, 'users')
             if user_data is None:
                 return 0  # Если данные пользователя не найдены, возвращаем 0
@@ -207,8 +518,9 @@ class Database:
                 return user_data['usage_limit']  # Если пользователь авторизован, возвращаем текущий лимит
 
             new_limit = max(user_data['usage_limit'] - 1, 0)  # Уменьшаем лимит на 1, но не меньше 0
-            self.cursor.execute("UPDATE users SET usage_limit=? WHERE user_id=?", (new_limit, user_id))
-            return new_limit
+            connection.execute("UPDATE users SET usage_limit=? WHERE user_id=?", (new_limit, user_id))
+        self._write_through("users", {"usage_limit": new_limit}, {"user_id": user_id})
+        return new_limit
 
     def toggle_authorization(self, user_id: int, authorize: bool = True) -> None:
         user_data = self.get_row_as_dict({'user_id': user_id}, 'users')
@@ -224,27 +536,136 @@ class Database:
         # Используем существующий метод для вставки данных в таблицу
         self.insert_into_table("generations", generation_data)
 
-    def save_dataframe(self, user_id, table_name: str, df: pd.DataFrame):
+    def save_dataframe(self, user_id, table_name: str, df: "pd.DataFrame"):
         if df.empty:
             return False
 
-        # Запись или обновление данных в таблице
+        # Таблица сохраняется в файл хранилища, в files записывается путь к нему
         try:
-            df.to_sql(name=str(user_id) + table_name, con=self.connection, if_exists='replace', index=False)
-            self.update_table('files', {table_name: str(user_id) + table_name}, {'user_id': user_id})
+            path = self.uploads.save(user_id, table_name, df)
+            self.update_table('files', {table_name: path}, {'user_id': user_id})
+            self._after_write(lambda: self.invalidate_frames(user_id))
             return True
-        except Exception as e:
-            print(f"Ошибка при сохранении данных в таблицу {table_name}: {e}")
+        except Exception:
+            if self._batching:
+                # Внутри commit ошибка откатывает весь UnitOfWork, а не теряет одну таблицу
+                raise
+            logger.exception("Failed to save %s of user %s", table_name, user_id)
             return False
 
     def reset_amount_of_boxes(self, user_id):
         return self.update_table("users", {"amount_of_boxes": 0}, {"user_id": user_id})
 
     def reset_file_ids(self, user_id: int, columns: List[str] = None) -> None:
-        columns_to_reset = columns or ["box_capacity_id", "items_to_ship_id", "boxes_id"]
+        columns_to_reset = columns or ["box_capacity_id", "items_to_ship_id", "boxes_id", "packing_id"]
         self.update_table("files", {col: None for col in columns_to_reset}, {"user_id": user_id})
+        self._after_write(lambda: self.invalidate_frames(user_id))
+
+    def invalidate_frames(self, user_id: int) -> None:
+        """Сбрасывает кэш таблиц пользователя. Вызывается после любого изменения его загрузок."""
+        self._cache_invalidate(self.frames, ("frames", user_id))
+
+    def _read_upload(self, reference: Optional[str]) -> Optional["pd.DataFrame"]:
+        if not reference:
+            return None
+        if self.uploads.is_stored(reference):
+            return self.uploads.load(reference)
+        # Загрузки, сделанные до перехода на файловое хранилище, лежат в таблицах SQLite
+        import pandas as pd
+        return pd.read_sql_query(f'SELECT * FROM "{reference}"', self.read_connection)
+
+    def _count_upload_rows(self, reference: Optional[str]) -> int:
+        if not reference:
+            return 0
+        if self.uploads.is_stored(reference):
+            return self.uploads.count_rows(reference)
+        return self.read_connection.execute(f'SELECT COUNT(*) FROM "{reference}"').fetchone()[0]
+
+    def get_upload_rows(self, user_id: int, shipments: bool = False) -> int:
+        """
+        Размер задачи пользователя для очереди (scheduler.py) без загрузки таблиц.
+
+        :param shipments: Считать строки всех отгрузок пакетного режима, а не таблицы количества.
+        """
+        if shipments:
+            rows = self.read_connection.execute("SELECT items_to_ship_id FROM shipments WHERE user_id = ?",
+                                                (user_id,)).fetchall()
+            references = [row['items_to_ship_id'] for row in rows]
+        else:
+            references = [(self.get_row_as_dict({'user_id': user_id}, 'files') or {}).get('items_to_ship_id')]
+        try:
+            return sum(self._count_upload_rows(reference) for reference in references)
+        except Exception:
+            logger.exception("Failed to count upload rows of user %s", user_id)
+            return 0
+
+    def save_packing_layout(self, user_id: int, layout: "pd.DataFrame") -> None:
+        """Сохраняет раскладку последнего подсчета коробок, от нее считается следующая упаковка."""
+        path = self.uploads.save(user_id, 'packing', layout)
+        self.update_table('files', {'packing_id': path}, {'user_id': user_id})
+
+    def save_box_count(self, user_id: int, total_boxes: int, layout: "pd.DataFrame",
+                       uploads: Dict[str, Optional[str]]) -> bool:
+        """
+        Сохраняет результат подсчета коробок, если таблицы, по которым он выполнен, не заменили.
+
+        Проверка и запись выполняются в потоке записи, поэтому между ними другие изменения не попадут.
+
+        :param uploads: Ссылки box_capacity_id и items_to_ship_id на момент чтения таблиц.
+        :return: False, если за время подсчета загрузили новые таблицы и результат устарел.
+        """
+        current = self.get_row_as_dict({'user_id': user_id}, 'files') or {}
+        if any(current.get(column) != reference for column, reference in uploads.items()):
+            return False
+        unit = UnitOfWork()
+        unit.update_table('users', {'amount_of_boxes': total_boxes}, {'user_id': user_id})
+        unit.save_packing_layout(user_id, layout)
+        self.commit(unit)
+        return True
+
+    def get_packing_layout(self, user_id: int) -> Optional["pd.DataFrame"]:
+        user_data = self.get_row_as_dict({'user_id': user_id}, 'files') or {}
+        try:
+            return self._read_upload(user_data.get('packing_id'))
+        except Exception:
+            logger.exception("Failed to read packing layout of user %s", user_id)
+            return None
+
+    def save_shipments(self, user_id: int, shipments: List[Tuple[str, "pd.DataFrame"]]) -> None:
+        """
+        Заменяет отгрузки пакетного режима пользователя на новые (название листа и таблица количества).
+
+        Последняя отгрузка становится и таблицей количества (items_to_ship_id), как если бы листы
+        загружались по одному. Каждый лист записывается в хранилище один раз, на файл ссылаются обе таблицы.
+        """
+        paths = [(name, self.uploads.save(user_id, 'items_to_ship_id', df)) for name, df in shipments]
+        with self._write() as connection:
+            connection.execute("DELETE FROM shipments WHERE user_id = ?", (user_id,))
+            connection.executemany("INSERT INTO shipments (user_id, name, items_to_ship_id) VALUES (?, ?, ?)",
+                                   [(user_id, name, path) for name, path in paths])
+        self.update_table('files', {'items_to_ship_id': paths[-1][1]}, {'user_id': user_id})
+        self._after_write(lambda: self.invalidate_frames(user_id))
+
+    def clear_shipments(self, user_id: int) -> None:
+        with self._write() as connection:
+            connection.execute("DELETE FROM shipments WHERE user_id = ?", (user_id,))
+        self._after_write(lambda: self.invalidate_frames(user_id))
+
+    def get_shipments(self, user_id: int) -> List[Tuple[str, "pd.DataFrame"]]:
+        rows = self.read_connection.execute(
+            "SELECT name, items_to_ship_id FROM shipments WHERE user_id = ? ORDER BY shipment_id", (user_id,)
+        ).fetchall()
+        return [(row['name'], self.uploads.load(row['items_to_ship_id'])) for row in rows]
+
+    def get_data_from_db(self, user_id: int) -> List[Optional["pd.DataFrame"]]:
+        # Возвращаем копии: обработка переименовывает столбцы и меняет типы полученных таблиц
+        self._sync_caches()
+        key = ("frames", user_id)
+        cached = self.frames.get(key)
+        if cached is not None:
+            return [None if df is None else df.copy() for df in cached]
+        version = self._versions.get(key, 0)
 
-    def get_data_from_db(self, user_id: int) -> List[Optional[pd.DataFrame]]:
         # Получаем имена таблиц из базы данных
         user_data = self.get_row_as_dict({'user_id': user_id}, 'files')
         box_capacity_table_name = user_data.get('box_capacity_id')
@@ -254,22 +675,53 @@ class Database:
         box_capacity_df, items_to_ship_df, boxes_id_df = None, None, None
 
         try:
-            if box_capacity_table_name:
-                # Чтение данных о вместимости товаров в коробку из базы данных в датафрейм
-                query_box_capacity = f'SELECT * FROM "{box_capacity_table_name}"'
-                box_capacity_df = pd.read_sql_query(query_box_capacity, self.connection)
+            # Чтение данных о вместимости товаров в коробку
+            box_capacity_df = self._read_upload(box_capacity_table_name)
 
-            if items_to_ship_table_name:
-                # Чтение данных о количестве товаров из базы данных в датафрейм
-                query_items_to_ship = f'SELECT * FROM "{items_to_ship_table_name}"'
-                items_to_ship_df = pd.read_sql_query(query_items_to_ship, self.connection)
+            # Чтение данных о количестве товаров
+            items_to_ship_df = self._read_upload(items_to_ship_table_name)
 
-            if boxes_id_table_name:
-                # Чтение данных о названиях коробок из базы данных в датафрейм
-                query_boxes_id = f'SELECT * FROM "{boxes_id_table_name}"'
-                boxes_id_df = pd.read_sql_query(query_boxes_id, self.connection)
+            # Чтение данных о названиях коробок
+            boxes_id_df = self._read_upload(boxes_id_table_name)
 
         except Exception as e:
             print(f"Ошибка при чтении из базы данных: {e}")
+            return [box_capacity_df, items_to_ship_df, boxes_id_df]
+
+        frames = [box_capacity_df, items_to_ship_df, boxes_id_df]
+        self._cache_put(self.frames, key, version, frames)
+        return [None if df is None else df.copy() for df in frames]
+
+
+class AsyncDatabase:
+    """
+    Асинхронный интерфейс к Database для обработчиков бота.
+
+    Методы те же, что у Database, но возвращают корутины и не блокируют цикл событий.
+    Запись выполняется в одном выделенном потоке (в SQLite всегда один писатель), чтение —
+    в отдельном пуле потоков, у каждого из которых свое соединение.
+    """
+
+    READ_METHODS = {"get_row_as_dict", "get_data_from_db", "get_shipments", "get_packing_layout", "get_upload_rows"}
+
+    def __init__(self, database: Database, readers: int = 4) -> None:
+        self.database = database
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader")
+
+    def __getattr__(self, name: str):
+        method = getattr(self.database, name)
+        if not callable(method):
+            return method
+        executor = self._readers if name in self.READ_METHODS else self._writer
+
+        @functools.wraps(method)
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, functools.partial(method, *args, **kwargs))
+
+        return call
 
-        return [box_capacity_df, items_to_ship_df, boxes_id_df]
+    def close(self) -> None:
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
@@ -0,0 +1,53 @@
+import os
+import tempfile
+from typing import Optional
+
+from aiogram import Bot, types
+
+from settings import MAX_UPLOAD_MB, DOWNLOAD_DIR
+
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadTooLargeError(ValueError):
+    """Файл больше MAX_UPLOAD_MB."""
+
+    def __init__(self, max_bytes: int) -> None:
+        super().__init__(f"файл больше {max_bytes / 2 ** 20:g} МБ")
+
+
+async def download_document(bot: Bot, document: types.Document, max_bytes: Optional[int] = None,
+                            directory: str = DOWNLOAD_DIR) -> str:
+    """
+    Скачивает документ во временный файл по частям и возвращает путь к нему.
+
+    Файл не собирается в памяти целиком. Загрузка прерывается, как только становится ясно,
+    что файл больше max_bytes: по размеру из сообщения, заголовку Content-Length или по числу
+    уже полученных байт. Удалить файл должен вызывающий.
+    """
+    if max_bytes is None:
+        max_bytes = int(MAX_UPLOAD_MB * 2 ** 20)
+    if document.file_size and document.file_size > max_bytes:
+        raise UploadTooLargeError(max_bytes)
+
+    file = await bot.get_file(document.file_id)
+    url = bot.get_file_url(file.file_path)
+    session = await bot.get_session()
+
+    suffix = os.path.splitext(document.file_name or "")[1]
+    descriptor, path = tempfile.mkstemp(prefix="upload_", suffix=suffix, dir=directory or None)
+    try:
+        with os.fdopen(descriptor, "wb") as output:
+            async with session.get(url, proxy=bot.proxy, proxy_auth=bot.proxy_auth, raise_for_status=True) as response:
+                if response.content_length and response.content_length > max_bytes:
+                    raise UploadTooLargeError(max_bytes)
+                received = 0
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    received += len(chunk)
+                    if received > max_bytes:
+                        raise UploadTooLargeError(max_bytes)
+                    output.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
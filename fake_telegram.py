@@ -0,0 +1,135 @@
+"""
+Заглушка Telegram Bot API для локальной проверки режима вебхука.
+
+Запуск (бот и заглушка в разных терминалах):
+    python fake_telegram.py --port 8081 --chats 20 --messages 5
+    TELEGRAM_API_URL=http://127.0.0.1:8081 BOT_MODE=webhook WEBHOOK_URL=http://127.0.0.1:8080 python tg_bot.py
+
+Заглушка отвечает успехом на вызовы API. После setWebhook она отправляет на вебхук /start
+и несколько нажатий «Посчитать коробки» от каждого чата. Затем проверяет, что бот удалял
+сообщения каждого чата (deleteMessage в начале обработчика) в порядке отправки, и печатает
+время обработки.
+"""
+import argparse
+import asyncio
+import itertools
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from aiohttp import ClientConnectionError, ClientSession, web
+
+import markups
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class FakeTelegram:
+    """Принимает вызовы Bot API, записывает их и отправляет обновления на вебхук бота."""
+
+    def __init__(self) -> None:
+        self.webhook_url = None
+        self.secret = None
+        self.webhook_set = asyncio.Event()
+        self.calls: List[Dict] = []
+        self.deleted: Dict[int, List[int]] = defaultdict(list)
+        self._message_ids = itertools.count(1_000_000)
+        self._update_ids = itertools.count(1)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self.handle_method)
+        return app
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        params = dict(await request.post()) if request.can_read_body else {}
+        params.update(request.query)
+        self.calls.append({"method": method, **params})
+
+        if method == "setwebhook":
+            self.webhook_url = params["url"]
+            self.secret = params.get("secret_token")
+            self.webhook_set.set()
+            result = True
+        elif method == "getme":
+            result = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+        elif method in ("sendmessage", "senddocument"):
+            result = {"message_id": next(self._message_ids), "date": int(time.time()),
+                      "chat": {"id": int(params.get("chat_id", 0)), "type": "private"}, "text": params.get("text", "")}
+        elif method == "deletemessage":
+            self.deleted[int(params["chat_id"])].append(int(params["message_id"]))
+            result = True
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    def message_update(self, chat_id: int, message_id: int, text: str) -> Dict:
+        user = {"id": chat_id, "is_bot": False, "first_name": f"User {chat_id}", "username": f"user{chat_id}"}
+        return {
+            "update_id": next(self._update_ids),
+            "message": {"message_id": message_id, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"},
+                        "from": user, "text": text},
+        }
+
+    async def send_updates(self, session: ClientSession, chat_id: int, messages: int) -> None:
+        headers = {SECRET_HEADER: self.secret} if self.secret else {}
+        texts = ["/start"] + [markups.COUNT_BOXES_TEXT] * messages
+        for message_id, text in enumerate(texts, start=1):
+            update = self.message_update(chat_id, message_id, text)
+            # Как и Telegram, повторяем доставку, пока бот не начал слушать или отвечает ошибкой
+            while True:
+                try:
+                    async with session.post(self.webhook_url, json=update, headers=headers) as response:
+                        if response.status < 500:
+                            response.raise_for_status()
+                            break
+                except ClientConnectionError:
+                    pass
+                await asyncio.sleep(0.1)
+
+
+async def run(port: int, chats: int, messages: int, timeout: float) -> int:
+    telegram = FakeTelegram()
+    runner = web.AppRunner(telegram.app())
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    print(f"Fake Bot API on http://127.0.0.1:{port}, waiting for setWebhook...")
+
+    await telegram.webhook_set.wait()
+    print(f"Webhook: {telegram.webhook_url}")
+    chat_ids = list(range(1, chats + 1))
+
+    start = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*(telegram.send_updates(session, chat_id, messages) for chat_id in chat_ids))
+    accepted = time.perf_counter() - start
+
+    # Удаляются только нажатия кнопки, /start не удаляется
+    while sum(len(ids) for ids in telegram.deleted.values()) < chats * messages:
+        if time.perf_counter() - start > timeout:
+            break
+        await asyncio.sleep(0.05)
+    processed = time.perf_counter() - start
+    await runner.cleanup()
+
+    expected = list(range(2, messages + 2))
+    out_of_order = [chat_id for chat_id in chat_ids if telegram.deleted[chat_id] != expected]
+    print(f"Accepted {chats * (messages + 1)} updates in {accepted:.2f} s, processed in {processed:.2f} s")
+    print("Per-chat order: " + ("OK" if not out_of_order else f"violated in chats {out_of_order}"))
+    return 1 if out_of_order else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=5, help="нажатий кнопки на чат после /start")
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args.port, args.chats, args.messages, args.timeout)))
+
+
+if __name__ == "__main__":
+    main()
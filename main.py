@@ -1,41 +1,275 @@
+import numpy as np
 import pandas as pd
-from openpyxl import load_workbook
-from openpyxl.styles import Alignment, Border, Side, PatternFill
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, Side
+from openpyxl.utils import get_column_letter
 import io
+import os
+import csv
+import codecs
 import zipfile
-from typing import Union, Optional, Dict, List
-from openpyxl.worksheet.worksheet import Worksheet
-from functools import reduce
+import shutil
+import tempfile
+import hashlib
+import itertools
+import logging
+from typing import Union, Optional, Dict, List, Tuple, BinaryIO, Iterator
 import math
+import time
+from fractions import Fraction
+from contextlib import contextmanager
 from datetime import datetime
+from cache import LRUCache
+from settings import (PACKING_CACHE_SIZE, OPTIMIZE_PACKING, OPTIMIZE_TIME_BUDGET, MAX_UNPACKED_MB,
+                      MAX_COMPRESSION_RATIO)
+from metrics import stage, cache_event
 
+logger = logging.getLogger(__name__)
+
+INT64_MAX = np.iinfo(np.int64).max
+
+# Результаты упаковки по хэшу содержимого таблиц: подсчет коробок и отчет используют один план
+packing_cache = LRUCache(maxsize=PACKING_CACHE_SIZE)
+
+# Файлы с таблицами, которые читаются из ZIP-архивов
+TABLE_EXTENSIONS = ('.xls', '.xlsx', '.csv', '.parquet')
+
+# Файлы из ZIP-архивов распаковываются в память до этого размера, больше — во временный файл
+SPOOL_MAX_BYTES = 8 * 2 ** 20
+
+# Степень сжатия проверяется только у файлов архива больше этого размера: маленькие файлы безопасны
+COMPRESSION_CHECK_BYTES = 2 ** 20
+
+# Загруженный файл: путь к нему, открытый файл или содержимое
+Source = Union[str, os.PathLike, BinaryIO, bytes]
+
+# Разделители CSV, из которых выбирается подходящий, и размер образца для их определения
+CSV_DELIMITERS = ';,\t|'
+CSV_SNIFF_BYTES = 64 * 1024
+
+# Обязательные столбцы (в нижнем регистре), по которым распознаются загружаемые листы
+SHEET_SCHEMAS = {
+    'box_capacity_id': {'артикул продавца', 'размер', 'баркод', 'кратность'},
+    'items_to_ship_id': {'баркод', 'количество'},
+    'boxes_id': {'баркод товара', 'кол-во товаров', 'шк короба', 'срок годности'},
+}
 
-def open_excel(bytes_file: bytes, header: int = 0) -> Optional[List[Dict[str, pd.DataFrame]]]:
-    dataframes = []
 
-    # Попытка прочитать Excel файл напрямую
+def detect_format(head: bytes) -> Optional[str]:
+    """Определяет формат файла по первым байтам: 'zip' (в т.ч. .xlsx), 'xls' или 'parquet'."""
+    if head.startswith((b'PK\x03\x04', b'PK\x05\x06')):
+        return 'zip'
+    if head.startswith(b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'):
+        return 'xls'
+    if head.startswith(b'PAR1'):
+        return 'parquet'
+    return None
+
+
+def detect_csv_dialect(sample: bytes) -> Tuple[str, str]:
+    """Определяет кодировку (UTF-8 или cp1251) и разделитель CSV по началу файла."""
+    if b'\x00' in sample:
+        raise ValueError("файл не является текстовым")
+
+    try:
+        # Последний символ образца может быть обрезан, поэтому декодируем без final
+        text = codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        encoding = 'utf-8'
+    except UnicodeDecodeError:
+        text = sample.decode('cp1251', errors='replace')
+        encoding = 'cp1251'
+
+    lines = text.splitlines()[:20]
     try:
-        sheets = pd.read_excel(io.BytesIO(bytes_file), sheet_name=None, header=header)
-        for sheet_name, df in sheets.items():
-            dataframes.append({'name': sheet_name, 'df': df})
-    except Exception as e:  # noqa
-        print(f"Ошибка при чтении Excel файла напрямую: {e}")
+        delimiter = csv.Sniffer().sniff("\n".join(lines), delimiters=CSV_DELIMITERS).delimiter
+    except csv.Error:
+        first_line = lines[0] if lines else ''
+        delimiter = max(CSV_DELIMITERS, key=first_line.count)
+    return encoding, delimiter
+
+
+def read_csv(file: BinaryIO, header: int = 0) -> pd.DataFrame:
+    sample = file.read(CSV_SNIFF_BYTES)
+    offset = len(codecs.BOM_UTF8) if sample.startswith(codecs.BOM_UTF8) else 0
+
+    encoding, delimiter = detect_csv_dialect(sample[offset:])
+    file.seek(offset)
+    table = pa_csv.read_csv(file,
+                            read_options=pa_csv.ReadOptions(encoding=encoding, skip_rows=header),
+                            parse_options=pa_csv.ParseOptions(delimiter=delimiter))
+    return table.to_pandas()
+
+
+def is_xlsx_archive(z: zipfile.ZipFile) -> bool:
+    names = set(z.namelist())
+    return '[Content_Types].xml' in names and 'xl/workbook.xml' in names
+
+
+class UnsafeArchiveError(ValueError):
+    """Архив (в том числе книга .xlsx) распаковывается в слишком большой объем."""
+
+
+def check_archive(z: zipfile.ZipFile) -> None:
+    """
+    Защита от ZIP-бомб: проверяет объем и степень сжатия файлов архива до распаковки.
+
+    Заявленным размерам можно доверять: zipfile не отдает больше file_size байт файла.
+    """
+    limit = int(MAX_UNPACKED_MB * 2 ** 20)
+    unpacked = 0
+    for info in z.infolist():
+        unpacked += info.file_size
+        if unpacked > limit:
+            raise UnsafeArchiveError(f"архив распаковывается больше чем в {MAX_UNPACKED_MB:g} МБ")
+        if info.file_size > COMPRESSION_CHECK_BYTES and info.file_size > info.compress_size * MAX_COMPRESSION_RATIO:
+            raise UnsafeArchiveError(f"файл '{info.filename}' в архиве сжат подозрительно сильно")
+
+
+@contextmanager
+def open_source(source: Source) -> Iterator[BinaryIO]:
+    """
+    Загруженный файл как файловый объект для разбора, без копирования содержимого.
+
+    Путь отображается в память (pyarrow.memory_map), bytes оборачиваются в BytesIO,
+    открытый файл используется с начала.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        yield io.BytesIO(source)
+    elif isinstance(source, (str, os.PathLike)):
+        if os.path.getsize(source) == 0:
+            # Пустой файл нельзя отобразить в память
+            yield io.BytesIO()
+            return
+        with pa.memory_map(os.fspath(source)) as file:
+            yield file
+    else:
+        source.seek(0)
+        yield source
+
+
+@contextmanager
+def extract_member(z: zipfile.ZipFile, info: zipfile.ZipInfo) -> Iterator[BinaryIO]:
+    """Распаковывает файл архива по частям: небольшие остаются в памяти, большие пишутся на диск."""
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as spooled, z.open(info) as member:
+        shutil.copyfileobj(member, spooled, length=1024 * 1024)
+        spooled.seek(0)
+        yield spooled
+
 
-    # Попытка прочитать Excel файлы внутри ZIP-архива
+def matches_known_schema(columns: List[str]) -> bool:
+    columns = {column.lower() for column in columns}
+    return any(schema.issubset(columns) for schema in SHEET_SCHEMAS.values())
+
+
+def read_xlsx_sheets(source: BinaryIO, header: int = 0) -> List[Dict[str, pd.DataFrame]]:
+    """
+    Читает книгу .xlsx, полностью загружая только листы с известными заголовками.
+
+    Сначала в режиме read_only читается строка заголовка каждого листа. Листы, заголовок
+    которых не подходит ни под одну схему из SHEET_SCHEMAS, возвращаются пустыми таблицами
+    с теми же столбцами, поэтому проверки is_* их просто не распознают.
+    """
+    # Книга .xlsx — тоже ZIP-архив, и распаковывать ее будет openpyxl
+    with zipfile.ZipFile(source) as z:
+        check_archive(z)
+    source.seek(0)
+
+    headers = {}
+    workbook = load_workbook(source, read_only=True, data_only=True)
     try:
-        with zipfile.ZipFile(io.BytesIO(bytes_file), 'r') as z:
-            for file_name in z.namelist():
-                # Проверяем, что файл является Excel файлом
-                if file_name.endswith(('.xls', '.xlsx')):
-                    with z.open(file_name) as f:
+        for worksheet in workbook.worksheets:
+            row = next(worksheet.iter_rows(min_row=header + 1, max_row=header + 1, values_only=True), ())
+            headers[worksheet.title] = [f"Unnamed: {i}" if value is None else str(value)
+                                        for i, value in enumerate(row)]
+    finally:
+        workbook.close()
+
+    matching = [name for name, columns in headers.items() if matches_known_schema(columns)]
+    sheets = {}
+    if matching:
+        source.seek(0)
+        sheets = pd.read_excel(source, sheet_name=matching, header=header, engine='openpyxl')
+
+    return [{'name': name, 'df': sheets[name] if name in sheets else pd.DataFrame(columns=columns)}
+            for name, columns in headers.items()]
+
+
+def read_tables(file: BinaryIO, header: int = 0) -> List[Dict[str, pd.DataFrame]]:
+    """
+    Читает таблицы из файла .xlsx, .xls, .parquet или .csv.
+
+    Для .xls заголовки заранее не проверяются. Файлы без листов (CSV, Parquet)
+    возвращаются одной таблицей с названием формата.
+    """
+    file_format = detect_format(file.read(8))
+    file.seek(0)
+    if file_format == 'zip':
+        return read_xlsx_sheets(file, header=header)
+    if file_format == 'xls':
+        sheets = pd.read_excel(file, sheet_name=None, header=header)
+        return [{'name': sheet_name, 'df': df} for sheet_name, df in sheets.items()]
+    if file_format == 'parquet':
+        return [{'name': 'Parquet', 'df': pq.read_table(file).to_pandas()}]
+    return [{'name': 'CSV', 'df': read_csv(file, header=header)}]
+
+
+def open_excel(source: Source, header: int = 0) -> Union[List[Dict[str, pd.DataFrame]], str, None]:
+    """
+    Читает таблицы загруженного файла: книги Excel, CSV, Parquet или ZIP-архива с ними.
+
+    :param source: Путь к файлу (читается через memory map), открытый файл или содержимое.
+    :return: Листы с названиями, None, если таблиц не найдено, или строка с ошибкой для
+        архивов, которые распаковываются в слишком большой объем.
+    """
+    with open_source(source) as file:
+        return read_source(file, header=header)
+
+
+def read_source(file: BinaryIO, header: int = 0) -> Union[List[Dict[str, pd.DataFrame]], str, None]:
+    dataframes = []
+    file_format = detect_format(file.read(8))
+    file.seek(0)
+
+    if file_format == 'zip':
+        try:
+            with zipfile.ZipFile(file, 'r') as z:
+                check_archive(z)
+                if is_xlsx_archive(z):
+                    # Файл .xlsx сам является ZIP-архивом, читаем его как книгу
+                    file_format = 'xlsx'
+                else:
+                    # Чтение файлов с таблицами внутри ZIP-архива
+                    for info in z.infolist():
+                        # Проверяем, что файл является таблицей поддерживаемого формата
+                        if not info.filename.lower().endswith(TABLE_EXTENSIONS):
+                            continue
                         try:
-                            sheets = pd.read_excel(f, sheet_name=None, header=header)
-                            for sheet_name, df in sheets.items():
-                                dataframes.append({'name': f"{file_name} | {sheet_name}", 'df': df})
-                        except Exception as e:  # noqa
-                            print(f"Ошибка при чтении Excel файла '{file_name}' из архива: {e}")
-    except Exception as e:  # noqa
-        print(f"Ошибка при чтении ZIP-архива: {e}")
+                            with extract_member(z, info) as member:
+                                for sheet in read_tables(member, header=header):
+                                    dataframes.append({'name': f"{info.filename} | {sheet['name']}",
+                                                       'df': sheet['df']})
+                        except UnsafeArchiveError:
+                            raise
+                        except Exception:  # noqa
+                            logger.exception("Failed to read '%s' from a ZIP archive", info.filename)
+        except UnsafeArchiveError as e:
+            return str(e)
+        except Exception:  # noqa
+            logger.exception("Failed to read a ZIP archive")
+        file.seek(0)
+
+    # Чтение файла напрямую: книга Excel, Parquet или CSV
+    if file_format != 'zip':
+        try:
+            dataframes.extend(read_tables(file, header=header))
+        except UnsafeArchiveError as e:
+            return str(e)
+        except Exception:  # noqa
+            logger.exception("Failed to read an uploaded file")
 
     return dataframes if dataframes else None
 
@@ -43,7 +277,7 @@ def open_excel(bytes_file: bytes, header: int = 0) -> Optional[List[Dict[str, pd
 def is_box_capacity(df: pd.DataFrame, *args) -> Union[bool, str]:
     # Проверяем наличие необходимых столбцов
     df.columns = [col.lower() for col in df.columns]
-    required_columns = {'артикул продавца', 'размер', 'баркод', 'кратность'}
+    required_columns = SHEET_SCHEMAS['box_capacity_id']
     if not required_columns.issubset(set(df.columns)):
         return False
     try:
@@ -62,7 +296,7 @@ def is_box_capacity(df: pd.DataFrame, *args) -> Union[bool, str]:
 
 def is_items_to_ship(df: pd.DataFrame, *args) -> Union[bool, str]:
     df.columns = [col.lower() for col in df.columns]
-    required_columns = {'баркод', 'количество'}
+    required_columns = SHEET_SCHEMAS['items_to_ship_id']
     if not required_columns.issubset(set(df.columns)):
         return False
     try:
@@ -81,7 +315,7 @@ def is_items_to_ship(df: pd.DataFrame, *args) -> Union[bool, str]:
 
 def is_boxes_id(df: pd.DataFrame, user_data) -> Union[bool, str]:
     df.columns = [col.lower() for col in df.columns]
-    required_columns = {'баркод товара', 'кол-во товаров', 'шк короба', 'срок годности'}
+    required_columns = SHEET_SCHEMAS['boxes_id']
     if not required_columns.issubset(set(df.columns)):
         return False
     if df['шк короба'].nunique() != user_data["amount_of_boxes"]:
@@ -94,12 +328,117 @@ def lcm(a, b):
     return abs(a * b) // math.gcd(a, b)
 
 
-def find_lcm_of_series(series):
-    """Функция для нахождения наименьшего общего кратного всех чисел в pandas Series."""
-    return reduce(lcm, series)
+class BoxCapacity:
+    """
+    Вместимость коробки для товаров конкретной отгрузки.
 
+    Единица товара с кратностью m занимает 1/m коробки. Объемы считаются в долях 1/НОК
+    кратностей только отгружаемых товаров: пока НОК помещается в int64, это целые числа,
+    иначе используются точные дроби (Fraction). Точность не теряется ни в одном из случаев.
+    """
 
-def pack_boxes(box_capacity_df, items_to_ship_df):
+    def __init__(self, multiplicities) -> None:
+        unique = sorted({int(m) for m in multiplicities})
+
+        scale = 1
+        for multiplicity in unique:
+            scale = lcm(scale, multiplicity)
+            if scale > INT64_MAX:
+                scale = None
+                break
+
+        if scale is None:
+            self.box_volume = Fraction(1)
+            self.volumes = {m: Fraction(1, m) for m in unique}
+        else:
+            self.box_volume = scale
+            self.volumes = {m: scale // m for m in unique}
+
+    def volume(self, multiplicity) -> Union[int, Fraction]:
+        """Объем, который занимает одна единица товара с указанной кратностью."""
+        return self.volumes[int(multiplicity)]
+
+    def fits(self, free_volume, multiplicity) -> int:
+        """Сколько единиц товара с указанной кратностью помещается в свободный объем."""
+        return int(free_volume // self.volume(multiplicity))
+
+
+class Packing:
+    """
+    План раскладки товаров по коробкам.
+
+    Полные коробки хранятся только количеством на товар, остатки — списком размещений,
+    поэтому общее число коробок известно без построения строк результата.
+    Коробки пронумерованы с 0: по умолчанию сначала полные, затем коробки с остатками.
+    При повторной упаковке (repack) номера полных коробок задаются явно в full_box_ids —
+    по порядку товаров, как в np.repeat(индексы товаров, full_boxes).
+    saved_boxes — на сколько коробок оптимизатор улучшил жадную раскладку остатков.
+    """
+
+    def __init__(self, items: pd.DataFrame, full_boxes: np.ndarray,
+                 leftovers: Tuple[List[int], List[int], List[int]], leftover_boxes: int,
+                 saved_boxes: int = 0, full_box_ids: Optional[np.ndarray] = None) -> None:
+        self.items = items
+        self.full_boxes = full_boxes
+        self.leftovers = leftovers
+        self.total_boxes = int(full_boxes.sum()) + leftover_boxes
+        self.saved_boxes = saved_boxes
+        self.full_box_ids = full_box_ids
+        self._layout: Optional[pd.DataFrame] = None
+
+    def placements(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Индексы товаров, количества, номера коробок и признак полной коробки для каждого размещения."""
+        multiplicities = self.items['multiplicity'].to_numpy(dtype='int64')
+        full_items = np.repeat(np.arange(len(self.items)), self.full_boxes)
+        full_box_ids = np.arange(len(full_items)) if self.full_box_ids is None else self.full_box_ids
+        leftover_items, leftover_quantities, leftover_boxes = self.leftovers
+
+        placed_items = np.concatenate([full_items, np.array(leftover_items, dtype='int64')])
+        quantities = np.concatenate([multiplicities[full_items], np.array(leftover_quantities, dtype='int64')])
+        box_ids = np.concatenate([full_box_ids, np.array(leftover_boxes, dtype='int64')])
+        full = np.arange(len(placed_items)) < len(full_items)
+
+        if self.full_box_ids is not None:
+            # После повторной упаковки номера идут вперемешку, упорядочиваем размещения по коробкам
+            order = np.argsort(box_ids, kind='stable')
+            placed_items, quantities = placed_items[order], quantities[order]
+            box_ids, full = box_ids[order], full[order]
+        return placed_items, quantities, box_ids, full
+
+    def to_frame(self) -> pd.DataFrame:
+        """Строит таблицу размещений с колонками результата pack_boxes."""
+        placed_items, quantities, box_ids, _ = self.placements()
+
+        # Создаем DataFrame результата одним блоком
+        items = self.items.iloc[placed_items]
+        return pd.DataFrame({
+            'barcode': items['barcode'].to_numpy(),
+            'quantity': quantities,
+            'box_id': box_ids,
+            'expiration_date': '',
+            'seller_art': items['seller_art'].to_numpy(),
+            'size': items['size'].to_numpy(),
+        })
+
+    def to_layout(self) -> pd.DataFrame:
+        """Компактная раскладка для сохранения между загрузками: по ней выполняется repack."""
+        if self._layout is None:
+            self._layout = self._build_layout()
+        return self._layout
+
+    def _build_layout(self) -> pd.DataFrame:
+        placed_items, quantities, box_ids, full = self.placements()
+        items = self.items.iloc[placed_items]
+        return pd.DataFrame({
+            'barcode': items['barcode'].to_numpy(),
+            'multiplicity': items['multiplicity'].to_numpy(dtype='int64'),
+            'quantity': quantities,
+            'box_id': box_ids,
+            'full': full,
+        })
+
+
+def prepare_items(box_capacity_df, items_to_ship_df) -> Union[pd.DataFrame, str]:
     # Переименовываем столбцы
     box_capacity_df.columns = ['seller_art', 'size', 'barcode', 'multiplicity']
     items_to_ship_df.columns = ['barcode', 'quantity']
@@ -112,162 +451,405 @@ def pack_boxes(box_capacity_df, items_to_ship_df):
     merged_df = pd.merge(items_to_ship_df, box_capacity_df, on='barcode', how='left')
     if merged_df['multiplicity'].isna().any():
         return "Отсутствуют данные о кратности для одного или нескольких товаров"
+    if (merged_df['multiplicity'] <= 0).any():
+        return "Кратность товара должна быть больше нуля"
+
+    return merged_df.sort_values(by='multiplicity', ascending=True, kind='stable').reset_index(drop=True)
+
+
+def plan_packing(box_capacity_df, items_to_ship_df, optimize=False, time_budget=OPTIMIZE_TIME_BUDGET,
+                 layout: Optional[pd.DataFrame] = None) -> Union[Packing, str]:
+    """
+    Строит план упаковки.
+
+    :param optimize: Искать раскладку остатков с меньшим числом коробок (_optimize_leftovers).
+    :param time_budget: Время на оптимизацию, секунды.
+    :param layout: Прошлая раскладка этого пользователя. Если задана, коробки переупаковываются
+                   только в изменившейся части (repack), а нумерация по возможности сохраняется.
+                   Переупаковка берется, только если коробок в ней не больше, чем в новом плане.
+    """
+    merged_df = prepare_items(box_capacity_df, items_to_ship_df)
+    if isinstance(merged_df, str):
+        return merged_df
+
+    quantities = merged_df['quantity'].to_numpy(dtype='int64').clip(min=0)
+    multiplicities = merged_df['multiplicity'].to_numpy(dtype='int64')
+
+    # Полные коробки считаем арифметически: в каждой ровно "кратность" единиц одного товара
+    full_boxes = quantities // multiplicities
+    leftovers = quantities % multiplicities
+
+    # Остатки раскладываем жадно по неполным коробкам
+    capacity = BoxCapacity(multiplicities[leftovers > 0])
+    first_box_id = int(full_boxes.sum())
+    placed, leftover_boxes = _pack_leftovers(multiplicities.tolist(), leftovers.tolist(), capacity, first_box_id)
+
+    saved_boxes = 0
+    if optimize:
+        optimized, optimized_boxes = _optimize_leftovers(multiplicities.tolist(), leftovers.tolist(), capacity,
+                                                         first_box_id, time_budget)
+        # Результат оптимизатора берем, только если он лучше жадной раскладки
+        if optimized_boxes < leftover_boxes:
+            saved_boxes = leftover_boxes - optimized_boxes
+            placed, leftover_boxes = optimized, optimized_boxes
+
+    packing = Packing(merged_df, full_boxes, placed, leftover_boxes, saved_boxes)
+    if layout is not None:
+        # Прежнюю нумерацию сохраняем, только если переупаковка не требует больше коробок, чем новый план
+        repacked = repack(merged_df, layout)
+        if repacked is not None and repacked.total_boxes <= packing.total_boxes:
+            return repacked
+    return packing
 
-    merged_df = merged_df.sort_values(by='multiplicity', ascending=True).reset_index(drop=True)
 
-    box_volume = find_lcm_of_series(box_capacity_df['multiplicity'])
-    merged_df['volume'] = box_volume / merged_df['multiplicity']
-    merged_df['leftovers'] = merged_df['quantity']
-    merged_df['box'] = 1
+def pack_boxes(box_capacity_df, items_to_ship_df):
+    packing = plan_packing(box_capacity_df, items_to_ship_df)
+    if isinstance(packing, str):
+        return packing
+    return packing.to_frame()
+
+
+def _pack_leftovers(multiplicities, leftovers, capacity: BoxCapacity, first_box_id=0):
+    """
+    Жадная раскладка остатков (меньше одной полной коробки на товар).
+
+    Товар кладется в первую коробку, где есть место, при необходимости открывается новая.
+    Коробки, в которые не поместится даже самая маленькая единица отгрузки, больше не просматриваются.
+
+    :return: Три списка одинаковой длины (индекс товара, количество, номер коробки)
+             и число открытых коробок.
+    """
+    smallest_volume = min(capacity.volumes.values(), default=0)
+    free_volumes = []  # свободный объем коробок
+    open_boxes = []  # коробки, в которые еще может что-то поместиться
+    placed_items, placed_quantities, placed_boxes = [], [], []
+
+    def place(item, box, left, multiplicity, volume):
+        items_to_place = min(left, capacity.fits(free_volumes[box], multiplicity))
+        free_volumes[box] -= items_to_place * volume
+        placed_items.append(item)
+        placed_quantities.append(items_to_place)
+        placed_boxes.append(first_box_id + box)
+        return left - items_to_place
+
+    for item, left in enumerate(leftovers):
+        if left <= 0:
+            continue
+        multiplicity = multiplicities[item]
+        volume = capacity.volume(multiplicity)
+
+        still_open = []
+        for position, box in enumerate(open_boxes):
+            if free_volumes[box] >= volume:
+                left = place(item, box, left, multiplicity, volume)
+            if free_volumes[box] >= smallest_volume:
+                still_open.append(box)
+            if left == 0:
+                still_open.extend(open_boxes[position + 1:])
+                break
+
+        while left > 0:
+            box = len(free_volumes)
+            free_volumes.append(capacity.box_volume)
+            left = place(item, box, left, multiplicity, volume)
+            if free_volumes[box] >= smallest_volume:
+                still_open.append(box)
+        open_boxes = still_open
+
+    return (placed_items, placed_quantities, placed_boxes), len(free_volumes)
+
+
+class FreeSpaceIndex:
+    """
+    Дерево отрезков по свободному объему коробок.
+
+    Первая коробка, в которую помещается заданный объем, находится за O(log n)
+    без просмотра всех коробок подряд. Закрытые коробки хранят объем -1.
+    """
+
+    def __init__(self, free_volumes: list) -> None:
+        self.size = 1
+        while self.size < len(free_volumes):
+            self.size *= 2
+        self.tree = [-1] * (2 * self.size)
+        self.tree[self.size:self.size + len(free_volumes)] = free_volumes
+        for node in range(self.size - 1, 0, -1):
+            self.tree[node] = max(self.tree[2 * node], self.tree[2 * node + 1])
+
+    def __getitem__(self, box):
+        return self.tree[self.size + box]
+
+    def __setitem__(self, box, free_volume) -> None:
+        node = self.size + box
+        self.tree[node] = free_volume
+        node //= 2
+        while node:
+            self.tree[node] = max(self.tree[2 * node], self.tree[2 * node + 1])
+            node //= 2
+
+    def first_fit(self, volume) -> Optional[int]:
+        """Номер первой коробки со свободным объемом не меньше volume или None."""
+        if self.tree[1] < volume:
+            return None
+        node = 1
+        while node < self.size:
+            node = 2 * node if self.tree[2 * node] >= volume else 2 * node + 1
+        return node - self.size
+
+
+def _optimize_leftovers(multiplicities, leftovers, capacity: BoxCapacity, first_box_id=0,
+                        time_budget=OPTIMIZE_TIME_BUDGET):
+    """
+    Раскладка остатков с минимизацией числа коробок.
+
+    Сначала first-fit-decreasing: остаток каждого товара целиком, начиная с самых объемных,
+    кладется в первую коробку, где хватает места. Затем, пока не истечет time_budget секунд,
+    локальный поиск расформировывает наименее заполненные коробки, перекладывая их содержимое
+    (при необходимости по частям) в остальные.
+
+    :return: То же, что _pack_leftovers.
+    """
+    deadline = time.perf_counter() + time_budget
+    items = [item for item, left in enumerate(leftovers) if left > 0]
+    volumes = {item: capacity.volume(multiplicities[item]) for item in items}
+    items.sort(key=lambda item: leftovers[item] * volumes[item], reverse=True)
+
+    # Остаток меньше полной коробки, поэтому коробок заведомо не больше, чем товаров
+    index = FreeSpaceIndex([capacity.box_volume] * len(items))
+    contents: List[Dict[int, int]] = [{} for _ in items]
+    for item in items:
+        size = leftovers[item] * volumes[item]
+        box = index.first_fit(size)
+        index[box] = index[box] - size
+        contents[box][item] = leftovers[item]
+    for box, content in enumerate(contents):
+        if not content:
+            index[box] = -1
+
+    def empty_box(box) -> bool:
+        """Перекладывает содержимое коробки в остальные. Если места не хватило, ничего не меняет."""
+        free_volume = index[box]
+        index[box] = -1
+        moves = []
+        for item, quantity in contents[box].items():
+            volume = volumes[item]
+            while quantity > 0:
+                target = index.first_fit(volume)
+                if target is None:
+                    for target, moved_item, moved in moves:
+                        index[target] = index[target] + moved * volumes[moved_item]
+                    index[box] = free_volume
+                    return False
+                moved = min(quantity, capacity.fits(index[target], multiplicities[item]))
+                index[target] = index[target] - moved * volume
+                moves.append((target, item, moved))
+                quantity -= moved
+
+        for target, item, moved in moves:
+            contents[target][item] = contents[target].get(item, 0) + moved
+        contents[box] = {}
+        return True
 
-    # Расчет количества коробок
-    merged_df['total_boxes'] = merged_df['quantity'] * merged_df['volume'] // box_volume + 1
-    total_boxes = int(merged_df['total_boxes'].sum())
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        # Первыми пробуем расформировать самые пустые коробки
+        candidates = sorted((box for box, content in enumerate(contents) if content),
+                            key=lambda box: index[box], reverse=True)
+        for box in candidates:
+            if time.perf_counter() >= deadline:
+                break
+            if empty_box(box):
+                improved = True
+                break
+
+    placed_items, placed_quantities, placed_boxes = [], [], []
+    box_id = first_box_id
+    for content in contents:
+        if not content:
+            continue
+        for item in sorted(content):
+            placed_items.append(item)
+            placed_quantities.append(content[item])
+            placed_boxes.append(box_id)
+        box_id += 1
+
+    return (placed_items, placed_quantities, placed_boxes), box_id - first_box_id
+
+
+def repack(items: pd.DataFrame, layout: pd.DataFrame) -> Optional[Packing]:
+    """
+    Повторная упаковка с учетом прошлой раскладки (Packing.to_layout).
+
+    Товары с прежней кратностью сохраняют свои полные коробки, а товары, остаток которых
+    не изменился, — места в коробках с остатками. Заново раскладываются только изменившиеся
+    остатки: в свободное место прежних коробок, затем в освободившиеся номера и новые коробки.
+    В конце коробки с наибольшими номерами переносятся в оставшиеся пропуски нумерации.
+
+    :param items: Товары отгрузки после prepare_items.
+    :param layout: Прошлая раскладка.
+    :return: Packing или None, если от прошлой раскладки ничего не сохраняется.
+    """
+    barcodes = pd.Index(items['barcode'])
+    if not barcodes.is_unique or items.empty or layout.empty:
+        return None
+
+    quantities = items['quantity'].to_numpy(dtype='int64').clip(min=0)
+    multiplicities = items['multiplicity'].to_numpy(dtype='int64')
+    full_boxes = quantities // multiplicities
+    leftovers = quantities % multiplicities
+
+    layout_items = barcodes.get_indexer(layout['barcode'].astype(str))
+    layout_multiplicities = layout['multiplicity'].to_numpy(dtype='int64')
+    layout_quantities = layout['quantity'].to_numpy(dtype='int64')
+    layout_boxes = layout['box_id'].to_numpy(dtype='int64')
+    layout_full = layout['full'].to_numpy(dtype=bool)
+    known = layout_items >= 0
+    same_multiplicity = known & (layout_multiplicities == multiplicities[np.where(known, layout_items, 0)])
+
+    # Полные коробки: товар с прежней кратностью сохраняет столько коробок, сколько нужно сейчас
+    full_rows = np.flatnonzero(layout_full & same_multiplicity)
+    rank = pd.Series(layout_items[full_rows]).groupby(layout_items[full_rows]).cumcount().to_numpy()
+    kept_full = full_rows[rank < full_boxes[layout_items[full_rows]]]
+
+    # Остатки: товар остается в прежних коробках, если его остаток не изменился
+    leftover_rows = np.flatnonzero(~layout_full & same_multiplicity)
+    previous_leftovers = np.bincount(layout_items[leftover_rows], weights=layout_quantities[leftover_rows],
+                                     minlength=len(items)).astype('int64')
+    kept_leftover = leftover_rows[previous_leftovers[layout_items[leftover_rows]]
+                                  == leftovers[layout_items[leftover_rows]]]
+    if len(kept_full) == 0 and len(kept_leftover) == 0:
+        return None
+
+    # Новые коробки сначала занимают освободившиеся номера
+    kept_boxes = set(layout_boxes[kept_full].tolist()) | set(layout_boxes[kept_leftover].tolist())
+    free_ids = sorted(set(layout_boxes.tolist()) - kept_boxes)
+    new_ids = itertools.chain(free_ids, itertools.count(int(layout_boxes.max()) + 1))
+
+    missing_full = full_boxes - np.bincount(layout_items[kept_full], minlength=len(items))
+    new_full_items = np.repeat(np.arange(len(items)), missing_full)
+    new_full_ids = np.fromiter((next(new_ids) for _ in new_full_items), dtype='int64', count=len(new_full_items))
+    full_items = np.concatenate([layout_items[kept_full], new_full_items])
+    full_box_ids = np.concatenate([layout_boxes[kept_full], new_full_ids])[np.argsort(full_items, kind='stable')]
+
+    # Свободный объем прежних коробок с остатками
+    capacity = BoxCapacity(multiplicities[leftovers > 0])
+    kept_items = layout_items[kept_leftover]
+    volumes = pd.Series(multiplicities[kept_items]).map(capacity.volumes) * layout_quantities[kept_leftover]
+    fill = volumes.groupby(layout_boxes[kept_leftover]).sum()
+
+    kept_mask = np.zeros(len(items), dtype=bool)
+    kept_mask[kept_items] = True
+    to_place = np.flatnonzero((leftovers > 0) & ~kept_mask)
+
+    # Остаток меньше полной коробки, поэтому новых коробок не больше, чем товаров к раскладке
+    index = FreeSpaceIndex([capacity.box_volume - volume for volume in fill.tolist()]
+                           + [capacity.box_volume] * len(to_place))
+    slot_ids = fill.index.tolist() + [None] * len(to_place)
+    placed_items = kept_items.tolist()
+    placed_quantities = layout_quantities[kept_leftover].tolist()
+    placed_boxes = layout_boxes[kept_leftover].tolist()
+    for item in to_place.tolist():
+        left, multiplicity = int(leftovers[item]), int(multiplicities[item])
+        volume = capacity.volume(multiplicity)
+        while left > 0:
+            slot = index.first_fit(volume)
+            if slot_ids[slot] is None:
+                slot_ids[slot] = next(new_ids)
+            items_to_place = min(left, capacity.fits(index[slot], multiplicity))
+            index[slot] = index[slot] - items_to_place * volume
+            placed_items.append(item)
+            placed_quantities.append(items_to_place)
+            placed_boxes.append(slot_ids[slot])
+            left -= items_to_place
+
+    # Убираем пропуски в нумерации, перенося последние коробки на свободные номера
+    leftover_boxes = np.array(placed_boxes, dtype='int64')
+    used_ids = np.unique(np.concatenate([full_box_ids, leftover_boxes]))
+    total_boxes = len(used_ids)
+    renumber = np.arange(int(used_ids.max(initial=0)) + 1)
+    renumber[used_ids[used_ids >= total_boxes]] = np.setdiff1d(np.arange(total_boxes), used_ids)
+
+    return Packing(items, full_boxes, (placed_items, placed_quantities, renumber[leftover_boxes].tolist()),
+                   total_boxes - int(full_boxes.sum()), full_box_ids=renumber[full_box_ids])
+
+
+def frame_digest(*dataframes: pd.DataFrame) -> str:
+    """Хэш содержимого таблиц. Названия столбцов и индекс не учитываются."""
+    digest = hashlib.blake2b(digest_size=16)
+    for df in dataframes:
+        digest.update(str(df.shape).encode())
+        digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def get_packing(box_capacity_df, items_to_ship_df, layout: Optional[pd.DataFrame] = None) -> Union[Packing, str]:
+    # Ключ считаем до plan_packing, так как она переименовывает столбцы исходных таблиц
+    tables = frame_digest(box_capacity_df, items_to_ship_df)
+    key = (tables, OPTIMIZE_PACKING, None if layout is None else frame_digest(layout))
+    packing = packing_cache.get(key)
+    cache_event('packing', 'miss' if packing is None else 'hit')
+    if packing is None:
+        with stage('pack'):
+            packing = plan_packing(box_capacity_df, items_to_ship_df, optimize=OPTIMIZE_PACKING, layout=layout)
+        packing_cache.put(key, packing)
+        if isinstance(packing, Packing):
+            # Подсчет сохраняет полученную раскладку, и отчет передает уже ее. При тех же таблицах
+            # repack от нее раскладывает товары по тем же коробкам, поэтому план доступен и по ее ключу
+            packing_cache.put((tables, OPTIMIZE_PACKING, frame_digest(packing.to_layout())), packing)
+    return packing
 
-    # Создание DataFrame для коробок
-    boxes = pd.DataFrame({'box_number': range(1, total_boxes + 1), 'volume': box_volume})
 
-    result_rows = []
+def count_boxes(box_capacity_df, items_to_ship_df):
+    # Для подсчета достаточно плана упаковки, строки результата не строятся
+    packing = get_packing(box_capacity_df, items_to_ship_df)
 
-    for index, row in merged_df.iterrows():
-        while row['leftovers'] > 0:
-            current_box = boxes.loc[boxes['volume'] >= row['volume']].iloc[0]
-            max_items_in_box = current_box['volume'] // row['volume']
-            items_to_place = min(row['leftovers'], max_items_in_box)
+    # Если результат - строка, значит возникла ошибка
+    if isinstance(packing, str):
+        print(packing)
+        return packing
 
-            # Уменьшаем остатки товара и объем коробки
-            row['leftovers'] -= items_to_place
-            current_box_index = current_box.name
-            boxes.at[current_box_index, 'volume'] -= items_to_place * row['volume']
+    return packing.total_boxes
 
-            # Добавляем информацию в result_df
-            result_row = {
-                'barcode': row['barcode'],
-                'quantity': items_to_place,
-                'box_id': current_box_index,
-                'expiration_date': '',
-                'seller_art': row['seller_art'],
-                'size': row['size']
-            }
-            result_rows.append(result_row)
 
-            # Переход к следующей коробке, если текущая заполнена
-            if boxes.at[current_box_index, 'volume'] <= 0:
-                boxes.drop(current_box_index, inplace=True)
+def summarize_packing(box_capacity_df, items_to_ship_df,
+                      layout: Optional[pd.DataFrame] = None) -> Union[Tuple[int, int, pd.DataFrame], str]:
+    """
+    Итоги упаковки для сообщения пользователю.
 
-    # Создаем DataFrame из накопленных результатов
-    result_df = pd.DataFrame(result_rows)
+    :param layout: Прошлая раскладка пользователя (см. plan_packing).
+    :return: (число коробок, сколько коробок сэкономил оптимизатор, новая раскладка) или текст ошибки.
+    """
+    packing = get_packing(box_capacity_df, items_to_ship_df, layout)
+    if isinstance(packing, str):
+        print(packing)
+        return packing
 
-    return result_df
+    return packing.total_boxes, packing.saved_boxes, packing.to_layout()
 
 
-def count_boxes(box_capacity_df, items_to_ship_df):
-    # Вызов функции pack_boxes для упаковки товаров в коробки
-    result_df = pack_boxes(box_capacity_df, items_to_ship_df)
-
-    # Если результат функции pack_boxes - строка, значит возникла ошибка
-    if isinstance(result_df, str):
-        print(result_df)
-        return result_df
-
-    # Подсчет количества уникальных номеров коробок в результате
-    total_boxes = result_df['box_id'].nunique()
-    return total_boxes
-
-
-def apply_table_styles(sheet: Worksheet,
-                       dataframe: pd.DataFrame,
-                       start_row: int,
-                       list_with_widths: Optional[List[int]] = None,
-                       table_border: str = 'thin',
-                       header_border: str = 'thin',
-                       table_alignment: Optional[Union[str, List[str]]] = None,
-                       header_alignment: Optional[str] = None,
-                       wrap_text_table: bool = False,
-                       wrap_text_header: bool = False,
-                       cell_colors: Optional[Dict[str, List[str]]] = None,
-                       range_colors: Optional[Dict[str, List[str]]] = None,
-                       condition: Optional[callable] = None) -> None:
-    # Set column widths
-    if list_with_widths:
-        for i, width in enumerate(list_with_widths, start=1):
-            sheet.column_dimensions[chr(64 + i)].width = width
-
-    # Set borders, alignment to table
-    table_range = sheet[f"A{start_row + 1}:{chr(65 + len(dataframe.columns) - 1)}{start_row + len(dataframe)}"]
-    table_border_style = Border(top=Side(border_style=table_border),
-                                right=Side(border_style=table_border),
-                                bottom=Side(border_style=table_border),
-                                left=Side(border_style=table_border))
-    if table_alignment:
-        if isinstance(table_alignment, str):
-            table_alignment_style = [Alignment(horizontal=table_alignment, vertical='center', wrap_text=wrap_text_table)
-                                     for _ in
-                                     range(dataframe.shape[1])]
-        else:
-            table_alignment_style = [Alignment(horizontal=t, vertical='center', wrap_text=wrap_text_table) for t in
-                                     table_alignment]
-    else:
-        table_alignment_style = []  # Пустой список, если table_alignment не определено
-
-    for row in table_range:
-        for i, cell in enumerate(row):
-            cell.border = table_border_style
-            if table_alignment and i < len(table_alignment_style):
-                cell.alignment = table_alignment_style[i]
-
-    # Set borders, alignment to header
-    header_range = sheet[f"A{start_row}:{chr(65 + len(dataframe.columns) - 1)}{start_row}"]
-    header_border_style = Border(
-        top=Side(border_style=header_border),
-        right=Side(border_style=header_border),
-        bottom=Side(border_style=header_border),
-        left=Side(border_style=header_border)
-    )
-    header_alignment_style = Alignment(horizontal=header_alignment, vertical='center', wrap_text=wrap_text_header)
-
-    for row in header_range:
-        for cell in row:
-            cell.border = header_border_style
-            if header_alignment:
-                cell.alignment = header_alignment_style
-
-    if cell_colors and condition:
-        for cell_coordinate, colors in cell_colors.items():
-            cell = sheet[cell_coordinate]
-            if condition(cell.value):
-                cell.fill = PatternFill(start_color=colors[0], end_color=colors[0], fill_type="solid")
-            else:
-                cell.fill = PatternFill(start_color=colors[1], end_color=colors[1], fill_type="solid")
-    elif cell_colors:
-        for cell_coordinate, colors in cell_colors.items():
-            cell = sheet[cell_coordinate]
-            cell.fill = PatternFill(start_color=colors[0], end_color=colors[0], fill_type="solid")
-    if range_colors and condition:
-        for cell_range, colors in range_colors.items():
-            cells = sheet[cell_range]
-            for row in cells:
-                for cell in row:
-                    if condition(cell.value):
-                        cell.fill = PatternFill(start_color=colors[0], end_color=colors[0], fill_type="solid")
-                    else:
-                        cell.fill = PatternFill(start_color=colors[1], end_color=colors[1], fill_type="solid")
-    elif range_colors:
-        for cell_range, colors in range_colors.items():
-            cells = sheet[cell_range]
-            for row in cells:
-                for cell in row:
-                    cell.fill = PatternFill(start_color=colors[0], end_color=colors[0], fill_type="solid")
-
-
-def generate_report(box_capacity_df, items_to_ship_df, boxes_id_df):
-    packed_boxes = pack_boxes(box_capacity_df, items_to_ship_df)
-
-    if isinstance(packed_boxes, str):
-        return packed_boxes
+def generate_report(box_capacity_df, items_to_ship_df, boxes_id_df, layout: Optional[pd.DataFrame] = None):
+    # План упаковки обычно уже посчитан при подсчете коробок
+    packing = get_packing(box_capacity_df, items_to_ship_df, layout)
+
+    if isinstance(packing, str):
+        return packing
+
+    with stage('render'):
+        return render_report(packing, boxes_id_df)
+
+
+def render_report(packing: Packing, boxes_id_df):
+    packed_boxes = packing.to_frame()
+
+    # Без сгенерированных WB названий (пакетный режим) коробки нумеруются по порядку
+    box_names = range(1, packing.total_boxes + 1) if boxes_id_df is None else boxes_id_df['шк короба']
+    if len(box_names) != packing.total_boxes:
+        return (f"Названий коробок WB ({len(box_names)}) не столько, сколько коробок в расчете "
+                f"({packing.total_boxes}). Посчитайте коробки заново и загрузите новые названия.")
 
     # Создание словаря для сопоставления box_id с "шк короба"
-    box_id_to_name = dict(zip(packed_boxes['box_id'].unique(), boxes_id_df['шк короба']))
+    box_id_to_name = dict(zip(np.sort(packed_boxes['box_id'].unique()), box_names))
 
     # Обновление box_id в packed_boxes с использованием словаря
     packed_boxes['box_id'] = packed_boxes['box_id'].map(box_id_to_name)
@@ -294,28 +876,110 @@ def generate_report(box_capacity_df, items_to_ship_df, boxes_id_df):
     result_file_name1 = f'\\Раскладка коробок_{current_date}.xlsx'
     output1 = write_dfs_to_xlsx(df_1, 'Sheet1')
 
-    # Создание и сохранение второго файла
+    # Создание и сохранение второго файла, оформление пишется сразу, без повторного открытия
     result_file_name2 = f'\\Инструкция для склада_{current_date}.xlsx'
-    output2 = write_dfs_to_xlsx(df_2, 'Инструкция для склада')
-
-    wb = load_workbook(filename=output2)
-
-    apply_table_styles(
-        wb['Инструкция для склада'], df_2, 1, [20] * 6,
-        table_border='thin', header_border='thick', wrap_text_header=True,
+    output2 = write_dfs_to_xlsx(
+        df_2, 'Инструкция для склада', [20] * 6,
+        table_border='thin', header_border='thick',
         table_alignment=['left', 'right']
     )
-    output2.seek(0)
-    wb.save(output2)
-    output2.seek(0)
 
     return (output1, result_file_name1), (output2, result_file_name2)
 
 
-def write_dfs_to_xlsx(total: pd.DataFrame, sheet_name) -> io.BytesIO:
+def generate_batch_report(box_capacity_df, shipment_name: str, items_to_ship_df):
+    """Отчет по одной отгрузке пакета. Возвращает (название, число коробок, файлы отчета) или строку с ошибкой."""
+    packing = get_packing(box_capacity_df, items_to_ship_df)
+    if isinstance(packing, str):
+        return f"{shipment_name}: {packing}"
+
+    with stage('render'):
+        return shipment_name, packing.total_boxes, render_report(packing, None)
+
+
+def build_report_bundle(reports: List[Tuple[str, int, tuple]]) -> Tuple[io.BytesIO, str]:
+    """Собирает отчеты нескольких отгрузок в один ZIP: папка на отгрузку и общая сводка."""
+    current_date = datetime.now().strftime("%Y-%m-%d")
     output = io.BytesIO()
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED) as z:
+        used_names = set()
+        for shipment_name, _, files in reports:
+            folder = safe_file_name(shipment_name)
+            while folder in used_names:
+                folder += '_'
+            used_names.add(folder)
+            for content, file_name in files:
+                # Имена файлов отчета начинаются с обратного слеша, в архиве он не нужен
+                file_name = file_name.lstrip('\\')
+                z.writestr(f"{folder}/{file_name}", content.getvalue())
+
+        summary = pd.DataFrame([(name, total_boxes) for name, total_boxes, _ in reports],
+                               columns=['Отгрузка', 'Всего коробок'])
+        z.writestr('Сводка.xlsx', write_dfs_to_xlsx(summary, 'Сводка', [40, 15]).getvalue())
+    output.seek(0)
+    return output, f'Раскладка по отгрузкам_{current_date}.zip'
+
+
+def safe_file_name(name: str) -> str:
+    cleaned = ''.join('_' if char in '\\/:*?"<>|' else char for char in str(name)).strip(' .')
+    return cleaned or 'Отгрузка'
 
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        total.to_excel(writer, sheet_name=sheet_name, index=False, header=True)
+
+def _border(border_style: Optional[str]) -> Border:
+    side = Side(border_style=border_style)
+    return Border(top=side, right=side, bottom=side, left=side)
+
+
+def write_dfs_to_xlsx(total: pd.DataFrame,
+                      sheet_name: str,
+                      list_with_widths: Optional[List[int]] = None,
+                      table_border: Optional[str] = None,
+                      header_border: str = 'thin',
+                      table_alignment: Optional[List[str]] = None) -> io.BytesIO:
+    """
+    Записывает таблицу в .xlsx за один проход в режиме write_only.
+
+    Оформление задается именованными стилями книги (по одному на вид ячейки), а не
+    отдельными объектами для каждой ячейки. Заголовок оформлен так же, как у DataFrame.to_excel.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_name)
+
+    workbook.add_named_style(NamedStyle('table_header', font=Font(bold=True), border=_border(header_border),
+                                        alignment=Alignment(horizontal='center', vertical='top')))
+
+    # Стиль каждого столбца таблицы: рамка и, если задано, выравнивание
+    column_styles = []
+    if table_border or table_alignment:
+        for i in range(total.shape[1]):
+            horizontal = table_alignment[i] if table_alignment and i < len(table_alignment) else None
+            style_name = f'table_cell_{horizontal or "general"}'
+            if style_name not in workbook.style_names:
+                alignment = Alignment(horizontal=horizontal, vertical='center') if horizontal else Alignment()
+                workbook.add_named_style(NamedStyle(style_name, border=_border(table_border), alignment=alignment))
+            column_styles.append(style_name)
+
+    if list_with_widths:
+        for i, width in enumerate(list_with_widths, start=1):
+            sheet.column_dimensions[get_column_letter(i)].width = width
+
+    sheet.append([_styled_cell(sheet, column, 'table_header') for column in total.columns])
+
+    # Как и DataFrame.to_excel, пустые значения записываем пустой строкой
+    columns = [total[column].astype(object).where(total[column].notna(), '').tolist() for column in total.columns]
+    for values in zip(*columns):
+        if column_styles:
+            sheet.append([_styled_cell(sheet, value, style) for value, style in zip(values, column_styles)])
+        else:
+            sheet.append(values)
+
+    output = io.BytesIO()
+    workbook.save(output)
     output.seek(0)
     return output
+
+
+def _styled_cell(sheet, value, style_name: str) -> WriteOnlyCell:
+    cell = WriteOnlyCell(sheet, value=value)
+    cell.style = style_name
+    return cell
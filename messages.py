@@ -31,3 +31,27 @@ def exceeded_limit_message(user_data):
 
 def reset_success_message(first_name: str) -> str:
     return f"🗑️✅ {first_name}, все ранее загруженные файлы сброшены."
+
+
+def box_count_message(total_boxes, saved_boxes) -> str:
+    if saved_boxes > 0:
+        return f"Всего коробок: {total_boxes}\n♻️ Оптимизация раскладки сэкономила коробок: {saved_boxes}"
+    return f"Всего коробок: {total_boxes}"
+
+
+def gc_report_message(report) -> str:
+    megabytes = (report['file_bytes'] + report['database_bytes']) / 2 ** 20
+    return (f"🧹 Очистка загрузок завершена.\n"
+            f"Удалено таблиц: {report['tables_dropped']}, файлов: {report['files_deleted']}.\n"
+            f"Освобождено: {megabytes:.1f} МБ")
+
+
+def batch_detected_message(shipment_names) -> str:
+    names = "\n".join(f"🚚 {name}" for name in shipment_names)
+    return (f"В файле найдено отгрузок: {len(shipment_names)}.\n{names}\n\n"
+            f"Нажмите «{m.BATCH_REPORT_TEXT}», чтобы получить раскладку по всем отгрузкам одним архивом.")
+
+
+def batch_success_message(new_limit, summary) -> str:
+    lines = "\n".join(f"🚚 {name}: {total_boxes} кор." for name, total_boxes in summary)
+    return f"📦 Раскладка по отгрузкам готова!\n{lines}\nОсталось попыток: {new_limit}"
@@ -0,0 +1,174 @@
+import logging
+import math
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм, как в Prometheus (le — «меньше или равно»)
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, math.inf)
+SIZE_BUCKETS = (10, 100, 1_000, 10_000, 100_000, 1_000_000, math.inf)
+
+# Время этапов и события кэшей внутри текущей задачи процесса пула (см. collect)
+_collector: Optional[Dict[str, float]] = None
+_cache_events: Optional[Dict[Tuple[str, str], int]] = None
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными корзинами для экспорта и окном последних значений для квантилей.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...], window: int = 1000) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def quantile(self, q: float) -> float:
+        if not self.recent:
+            return math.nan
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Metrics:
+    """
+    Время этапов обработчиков бота и размеры входных данных.
+
+    Метки: handler (docs, count, report) и stage (download, parse, classify, db_write, pack,
+    render, send и т.д.) для времени; handler и kind (rows, skus, boxes) для размеров;
+    cache (packing) и event (hit, miss) для счетчиков кэшей.
+    """
+
+    def __init__(self) -> None:
+        self.stage_seconds: Dict[Tuple[str, str], Histogram] = {}
+        self.input_sizes: Dict[Tuple[str, str], Histogram] = {}
+        self.cache_events: Dict[Tuple[str, str], int] = {}
+        # Время этапов запуска (import, database, ready, warm_up, first_request), секунды
+        self.startup: Dict[str, float] = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def _histogram(histograms: Dict, key: Tuple[str, str], buckets: Tuple[float, ...]) -> Histogram:
+        if key not in histograms:
+            histograms[key] = Histogram(buckets)
+        return histograms[key]
+
+    def observe_stage(self, handler: str, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._histogram(self.stage_seconds, (handler, stage), SECONDS_BUCKETS).observe(seconds)
+
+    def observe_size(self, handler: str, kind: str, value: int) -> None:
+        with self._lock:
+            self._histogram(self.input_sizes, (handler, kind), SIZE_BUCKETS).observe(value)
+
+    def observe_cache(self, cache: str, event: str, count: int = 1) -> None:
+        with self._lock:
+            self.cache_events[(cache, event)] = self.cache_events.get((cache, event), 0) + count
+
+    def observe_startup(self, phase: str, seconds: float) -> None:
+        with self._lock:
+            self.startup[phase] = seconds
+
+    @contextmanager
+    def timer(self, handler: str, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(handler, stage, time.perf_counter() - start)
+
+    def render_prometheus(self) -> str:
+        """Текстовый формат экспозиции Prometheus."""
+        lines = []
+        for name, help_text, histograms, label in (
+                ("bot_stage_seconds", "Time spent in a handler stage", self.stage_seconds, "stage"),
+                ("bot_input_size", "Input size seen by a handler", self.input_sizes, "kind")):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            with self._lock:
+                items = sorted(histograms.items())
+                for (handler, value), histogram in items:
+                    labels = f'handler="{handler}",{label}="{value}"'
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == math.inf else f"{bound:g}"
+                        lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+                    lines.append(f"{name}_sum{{{labels}}} {histogram.sum:.6f}")
+                    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+        lines.append("# HELP bot_cache_events_total Cache lookups by result")
+        lines.append("# TYPE bot_cache_events_total counter")
+        with self._lock:
+            for (cache, event), count in sorted(self.cache_events.items()):
+                lines.append(f'bot_cache_events_total{{cache="{cache}",event="{event}"}} {count}')
+        lines.append("# HELP bot_startup_seconds Time spent in a startup phase")
+        lines.append("# TYPE bot_startup_seconds gauge")
+        with self._lock:
+            for phase, seconds in self.startup.items():
+                lines.append(f'bot_startup_seconds{{phase="{phase}"}} {seconds:.6f}')
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """p50/p95 по этапам и размерам входных данных в читаемом виде."""
+        lines = []
+        with self._lock:
+            for phase, seconds in self.startup.items():
+                lines.append(f"startup.{phase}: {seconds * 1000:.0f} мс")
+            for (handler, stage), histogram in sorted(self.stage_seconds.items()):
+                lines.append(f"{handler}.{stage}: p50={histogram.quantile(0.5) * 1000:.0f} мс, "
+                             f"p95={histogram.quantile(0.95) * 1000:.0f} мс, n={histogram.count}")
+            for (handler, kind), histogram in sorted(self.input_sizes.items()):
+                lines.append(f"{handler}.{kind}: p50={histogram.quantile(0.5):.0f}, "
+                             f"p95={histogram.quantile(0.95):.0f}, max={max(histogram.recent):.0f}")
+        for cache in sorted({cache for cache, _ in self.cache_events}):
+            hits = self.cache_events.get((cache, "hit"), 0)
+            misses = self.cache_events.get((cache, "miss"), 0)
+            lines.append(f"cache.{cache}: попаданий {hits / (hits + misses):.0%}, hits={hits}, misses={misses}")
+        return "\n".join(lines) if lines else "Пока нет данных."
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def stage(name: str):
+    """Засекает время этапа внутри задачи, запущенной через collect. Вне collect ничего не делает."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if _collector is not None:
+            _collector[name] = _collector.get(name, 0.0) + time.perf_counter() - start
+
+
+def cache_event(cache: str, event: str) -> None:
+    """Отмечает попадание (hit) или промах (miss) кэша внутри задачи collect. Вне collect ничего не делает."""
+    if _cache_events is not None:
+        _cache_events[(cache, event)] = _cache_events.get((cache, event), 0) + 1
+
+
+def collect(function: Callable, *args):
+    """
+    Выполняет function(*args) и возвращает (результат, время этапов, отмеченных stage, события кэшей).
+
+    Кэши процессов пула живут в самих процессах, поэтому их счетчики передаются в бот вместе с результатом.
+    """
+    global _collector, _cache_events
+    _collector, _cache_events = {}, {}
+    try:
+        return function(*args), _collector, _cache_events
+    finally:
+        _collector, _cache_events = None, None
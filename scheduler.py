@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Collection, Deque, Dict, Iterator, Optional, Set
+
+from aiogram import Bot
+from aiogram.utils.exceptions import TelegramAPIError
+
+from metrics import metrics
+from settings import JOB_QUEUE_LIMIT, JOB_MAX_ROWS, JOB_MAX_BOXES, JOB_ACTIVE_ROWS
+
+logger = logging.getLogger(__name__)
+
+QUEUE_FULL_MESSAGE = "Сейчас бот обрабатывает слишком много задач. Попробуйте через несколько минут."
+TOO_MANY_ROWS_MESSAGE = "В таблице количества {rows} строк, бот обрабатывает не больше {limit}. Разделите отгрузку."
+TOO_MANY_BOXES_MESSAGE = "В раскладке {boxes} коробок, бот обрабатывает не больше {limit}. Разделите отгрузку."
+ALREADY_QUEUED_MESSAGE = "Эта задача уже в очереди. Дождитесь результата."
+QUEUED_MESSAGE = "⏳ Задача в очереди, перед ней задач: {ahead}."
+RUNNING_MESSAGE = "⚙️ Задача выполняется..."
+
+# Через сколько секунд сообщить о задаче, запущенной без ожидания в очереди
+RUNNING_DELAY = 1.0
+
+
+class StatusMessage:
+    """
+    Сообщение о ходе задачи: создается при первом обновлении, затем редактируется.
+
+    Обновления применяются по одному; если за время отправки пришло более новое,
+    промежуточное пропускается.
+    """
+
+    def __init__(self, bot: Bot, chat_id: int) -> None:
+        self.bot = bot
+        self.chat_id = chat_id
+        self._message = None
+        self._text: Optional[str] = None
+        self._shown: Optional[str] = None
+        self._closed = False
+        self._lock = asyncio.Lock()
+
+    async def update(self, text: str) -> None:
+        self._text = text
+        async with self._lock:
+            if self._closed or self._text != text or self._shown == text:
+                return
+            try:
+                if self._message is None:
+                    self._message = await self.bot.send_message(self.chat_id, text)
+                else:
+                    await self._message.edit_text(text)
+                self._shown = text
+            except TelegramAPIError as e:
+                logger.warning("Failed to update status message in chat %s: %s", self.chat_id, e)
+
+    async def close(self) -> None:
+        """Удаляет сообщение: результат задачи пользователь получает отдельными сообщениями."""
+        async with self._lock:
+            self._closed = True
+            if self._message is None:
+                return
+            try:
+                await self._message.delete()
+            except TelegramAPIError as e:
+                logger.warning("Failed to delete status message in chat %s: %s", self.chat_id, e)
+
+
+class Job:
+    def __init__(self, user_id: int, name: str, run: Callable[[], Awaitable], rows: int,
+                 status: Optional[StatusMessage]) -> None:
+        self.user_id = user_id
+        self.name = name
+        self.run = run
+        self.rows = rows
+        self.status = status
+        self.queued_at = time.perf_counter()
+        self.ahead: Optional[int] = None
+        self.task: Optional[asyncio.Task] = None
+
+
+class JobScheduler:
+    """
+    Очередь тяжелых задач (подсчет коробок, отчеты) перед пулом процессов.
+
+    Одновременно выполняется не больше concurrency задач и не больше одной задачи пользователя;
+    следующая задача выбирается по кругу среди пользователей, поэтому пользователь с десятком
+    задач не задерживает остальных. Задачи больше max_rows строк или max_boxes коробок не
+    принимаются, в очереди не больше limit задач. Суммарный размер выполняющихся задач
+    ограничен active_rows строк (одна задача запускается всегда), чтобы всплеск больших
+    загрузок не исчерпал память.
+
+    Задача — корутина, которая сама отправляет результат пользователю: обработчик сообщения
+    не ждет ее и не задерживает другие сообщения чата, включая сброс (cancel).
+    """
+
+    def __init__(self, concurrency: int, limit: int = JOB_QUEUE_LIMIT, max_rows: int = JOB_MAX_ROWS,
+                 max_boxes: int = JOB_MAX_BOXES, active_rows: int = JOB_ACTIVE_ROWS) -> None:
+        self.concurrency = max(1, concurrency)
+        self.limit = limit
+        self.max_rows = max_rows
+        self.max_boxes = max_boxes
+        self.active_rows = active_rows
+        self._queues: Dict[int, Deque[Job]] = {}
+        # Пользователи с задачами в очереди в порядке обслуживания
+        self._order: Deque[int] = deque()
+        self._running: Dict[int, Job] = {}
+        self._notifications: Set[asyncio.Task] = set()
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(jobs) for jobs in self._queues.values())
+
+    def submit(self, user_id: int, name: str, run: Callable[[], Awaitable], rows: int = 0, boxes: int = 0,
+               status: Optional[StatusMessage] = None) -> Optional[str]:
+        """
+        Ставит задачу в очередь.
+
+        :return: None, если задача принята, иначе сообщение для пользователя о причине отказа.
+        """
+        if rows > self.max_rows:
+            return TOO_MANY_ROWS_MESSAGE.format(rows=rows, limit=self.max_rows)
+        if boxes > self.max_boxes:
+            return TOO_MANY_BOXES_MESSAGE.format(boxes=boxes, limit=self.max_boxes)
+        if any(job.name == name for job in self._queues.get(user_id, ())):
+            return ALREADY_QUEUED_MESSAGE
+        if self.waiting >= self.limit:
+            return QUEUE_FULL_MESSAGE
+
+        if user_id not in self._queues:
+            self._queues[user_id] = deque()
+            self._order.append(user_id)
+        self._queues[user_id].append(Job(user_id, name, run, rows, status))
+        self._dispatch()
+        return None
+
+    def cancel(self, user_id: int, names: Optional[Collection[str]] = None) -> int:
+        """
+        Отменяет задачи пользователя в очереди и выполняющуюся. Возвращает число отмененных задач.
+
+        :param names: Отменить только задачи с этими названиями, по умолчанию — все.
+        """
+        queue = self._queues.get(user_id, deque())
+        queued = [job for job in queue if names is None or job.name in names]
+        kept = deque(job for job in queue if job not in queued)
+        if queued:
+            if kept:
+                self._queues[user_id] = kept
+            else:
+                del self._queues[user_id]
+                self._order.remove(user_id)
+        for job in queued:
+            self._notify(job, None)
+        cancelled = len(queued)
+        job = self._running.get(user_id)
+        if job is not None and job.task is not None and (names is None or job.name in names):
+            job.task.cancel()
+            cancelled += 1
+        self._update_positions()
+        return cancelled
+
+    def _planned(self) -> Iterator[Job]:
+        """Задачи очереди в порядке, в котором они будут запущены (по кругу среди пользователей)."""
+        queues = [list(self._queues[user_id]) for user_id in self._order]
+        for index in range(max((len(jobs) for jobs in queues), default=0)):
+            for jobs in queues:
+                if index < len(jobs):
+                    yield jobs[index]
+
+    def _dispatch(self) -> None:
+        active_rows = sum(job.rows for job in self._running.values())
+        for _ in range(len(self._order)):
+            if not self._order or len(self._running) >= self.concurrency:
+                break
+            user_id = self._order[0]
+            self._order.rotate(-1)
+            job = self._queues[user_id][0]
+            if user_id in self._running or (self._running and active_rows + job.rows > self.active_rows):
+                continue
+            self._queues[user_id].popleft()
+            if not self._queues[user_id]:
+                del self._queues[user_id]
+                self._order.remove(user_id)
+            active_rows += job.rows
+            self._running[user_id] = job
+            job.task = asyncio.create_task(self._execute(job))
+            job.task.add_done_callback(lambda task, job=job: self._finished(job, task))
+        self._update_positions()
+
+    def _update_positions(self) -> None:
+        for ahead, job in enumerate(self._planned(), start=len(self._running)):
+            if job.ahead != ahead:
+                job.ahead = ahead
+                self._notify(job, QUEUED_MESSAGE.format(ahead=ahead))
+
+    def _notify(self, job: Job, text: Optional[str]) -> None:
+        """Обновляет или, если text = None, удаляет сообщение о ходе задачи, не дожидаясь Telegram."""
+        if job.status is None:
+            return
+        task = asyncio.create_task(job.status.update(text) if text is not None else job.status.close())
+        self._notifications.add(task)
+        task.add_done_callback(self._notifications.discard)
+
+    async def _execute(self, job: Job) -> None:
+        metrics.observe_stage(job.name, 'queue', time.perf_counter() - job.queued_at)
+        if job.ahead is not None:
+            self._notify(job, RUNNING_MESSAGE)
+        else:
+            # Задача запустилась без очереди: о быстрых задачах сообщение не отправляется
+            asyncio.get_running_loop().call_later(RUNNING_DELAY, self._notify_running, job)
+        await job.run()
+
+    def _notify_running(self, job: Job) -> None:
+        if not job.task.done():
+            self._notify(job, RUNNING_MESSAGE)
+
+    def _finished(self, job: Job, task: asyncio.Task) -> None:
+        # Задача, отмененная до первого шага, не выполняет свой код, поэтому итоги подводятся здесь
+        if task.cancelled():
+            logger.info("Job %s of user %s cancelled", job.name, job.user_id)
+        elif task.exception() is not None:
+            logger.error("Job %s of user %s failed", job.name, job.user_id, exc_info=task.exception())
+        self._notify(job, None)
+        self._running.pop(job.user_id, None)
+        if job.user_id in self._order:
+            # Следующая задача этого пользователя — после задач тех, кто ждал, пока выполнялась эта
+            self._order.remove(job.user_id)
+            self._order.append(job.user_id)
+        self._dispatch()
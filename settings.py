@@ -0,0 +1,98 @@
+import os
+
+# Все значения можно переопределить переменными окружения с тем же именем
+
+# Сколько результатов упаковки (пар таблиц) держать в памяти
+PACKING_CACHE_SIZE = int(os.getenv("PACKING_CACHE_SIZE", 64))
+
+# Число процессов для разбора файлов, упаковки и построения отчетов
+WORKERS = int(os.getenv("WORKERS", os.cpu_count() or 1))
+
+# Предельное время выполнения одной задачи в процессе, секунды
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", 120))
+
+# Число потоков для чтения из базы данных
+DB_READERS = int(os.getenv("DB_READERS", 4))
+
+# Каталог, в котором хранятся загруженные пользователями таблицы
+UPLOADS_DIR = os.getenv("UPLOADS_DIR", "uploads")
+
+# Порт локального эндпоинта /metrics в формате Prometheus (0 — выключен)
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+
+# Как часто писать сводку метрик в лог, секунды (0 — не писать)
+METRICS_LOG_INTERVAL = float(os.getenv("METRICS_LOG_INTERVAL", 3600))
+
+# Искать раскладку остатков с меньшим числом коробок, чем у жадного алгоритма (1 — да)
+OPTIMIZE_PACKING = os.getenv("OPTIMIZE_PACKING", "0") == "1"
+
+# Сколько секунд оптимизатор улучшает раскладку локальным поиском
+OPTIMIZE_TIME_BUDGET = float(os.getenv("OPTIMIZE_TIME_BUDGET", 1.0))
+
+# Кэш загруженных таблиц пользователей: число пользователей, время жизни (секунды) и объем памяти (МБ)
+FRAME_CACHE_SIZE = int(os.getenv("FRAME_CACHE_SIZE", 256))
+FRAME_CACHE_TTL = float(os.getenv("FRAME_CACHE_TTL", 1800))
+FRAME_CACHE_MAX_MB = float(os.getenv("FRAME_CACHE_MAX_MB", 256))
+
+# Сколько строк пользователей (users, files) держать в памяти
+ROW_CACHE_SIZE = int(os.getenv("ROW_CACHE_SIZE", 4096))
+
+# Резервные копии базы: каталог, период (секунды, 0 — только перед миграциями схемы),
+# размер порции online backup (страницы) и пауза между порциями (секунды)
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_INTERVAL = float(os.getenv("BACKUP_INTERVAL", 3600))
+BACKUP_PAGES = int(os.getenv("BACKUP_PAGES", 256))
+BACKUP_SLEEP = float(os.getenv("BACKUP_SLEEP", 0.05))
+
+# Сколько снимков хранить: последние по часам, по дням и по неделям
+BACKUP_KEEP_HOURLY = int(os.getenv("BACKUP_KEEP_HOURLY", 24))
+BACKUP_KEEP_DAILY = int(os.getenv("BACKUP_KEEP_DAILY", 7))
+BACKUP_KEEP_WEEKLY = int(os.getenv("BACKUP_KEEP_WEEKLY", 4))
+
+# Сборка мусора загрузок: период (секунды, 0 — только командой /gc), таблиц в одной транзакции,
+# сколько файл должен пробыть без ссылок, прежде чем удалится (секунды), пауза между порциями (секунды)
+# и страниц базы за один шаг инкрементального VACUUM
+GC_INTERVAL = float(os.getenv("GC_INTERVAL", 24 * 3600))
+GC_BATCH = int(os.getenv("GC_BATCH", 50))
+GC_GRACE = float(os.getenv("GC_GRACE", 3600))
+GC_PAUSE = float(os.getenv("GC_PAUSE", 0.05))
+GC_VACUUM_PAGES = int(os.getenv("GC_VACUUM_PAGES", 512))
+
+# Очередь тяжелых задач (подсчет коробок, отчеты): сколько выполнять одновременно (0 — по числу WORKERS),
+# сколько держать в очереди, предельный размер задачи (строк в таблице количества, коробок)
+# и сколько строк могут обрабатывать все выполняющиеся задачи вместе
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", 0))
+JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", 200))
+JOB_MAX_ROWS = int(os.getenv("JOB_MAX_ROWS", 200_000))
+JOB_MAX_BOXES = int(os.getenv("JOB_MAX_BOXES", 20_000))
+JOB_ACTIVE_ROWS = int(os.getenv("JOB_ACTIVE_ROWS", 500_000))
+
+# Загрузка документов: предельный размер файла (МБ; Bot API отдает ботам файлы до 20 МБ) и каталог
+# временных файлов (пусто — системный). Для архивов и книг .xlsx — предельный объем после распаковки (МБ)
+# и степень сжатия, выше которой файл считается ZIP-бомбой
+MAX_UPLOAD_MB = float(os.getenv("MAX_UPLOAD_MB", 20))
+DOWNLOAD_DIR = os.getenv("DOWNLOAD_DIR", "")
+MAX_UNPACKED_MB = float(os.getenv("MAX_UNPACKED_MB", 200))
+MAX_COMPRESSION_RATIO = float(os.getenv("MAX_COMPRESSION_RATIO", 200))
+
+# Режим получения обновлений: polling или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+
+# Вебхук: публичный адрес за TLS-прокси (пусто — вебхук уже настроен), путь, адрес и порт,
+# на которых слушает бот, и секрет из заголовка X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+# Число процессов бота в режиме вебхука. Если больше 1, этот процесс только принимает вебхук и передает
+# обновления процессам по user_id (shards.py); процесс i слушает 127.0.0.1:WEBHOOK_PORT + 1 + i
+BOT_SHARDS = int(os.getenv("BOT_SHARDS", 1))
+
+# Сколько обновлений обрабатывать одновременно и сколько держать в очереди в режиме вебхука
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", 16))
+UPDATE_QUEUE_LIMIT = int(os.getenv("UPDATE_QUEUE_LIMIT", 1000))
+
+# Адрес Bot API (пусто — api.telegram.org), например локальная заглушка fake_telegram.py
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import os
+import signal
+import subprocess
+import sys
+from typing import Any, Dict, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiohttp import ClientConnectionError, ClientSession, ClientTimeout, web
+
+from settings import (WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET, UPDATE_CONCURRENCY, WORKERS,
+                      METRICS_PORT)
+from webhook import SECRET_HEADER, set_webhook
+
+logger = logging.getLogger(__name__)
+
+# Telegram принимает не больше 100 одновременных соединений с вебхуком
+MAX_WEBHOOK_CONNECTIONS = 100
+
+
+def user_of(update: Dict[str, Any]) -> Optional[int]:
+    """user_id автора обновления (JSON от Telegram), для обновлений без автора — id чата."""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        if isinstance(value.get("from"), dict):
+            return value["from"]["id"]
+        if isinstance(value.get("chat"), dict):
+            return value["chat"]["id"]
+    return None
+
+
+class Shard:
+    """
+    Процесс бота, который обрабатывает обновления своей доли пользователей.
+
+    Это обычный tg_bot.py в режиме вебхука на порту port локального интерфейса: вебхук
+    в Telegram он не регистрирует, фоновые задачи (резервные копии, сборка мусора)
+    выполняет только процесс с индексом 0.
+    """
+
+    def __init__(self, index: int, shards: int, script: str) -> None:
+        self.index = index
+        self.port = WEBHOOK_PORT + 1 + index
+        self.script = script
+        self.url = f"http://127.0.0.1:{self.port}{WEBHOOK_PATH}"
+        self.env = {
+            **os.environ,
+            "BOT_MODE": "webhook",
+            "BOT_SHARDS": "1",
+            "WEBHOOK_URL": "",
+            "WEBHOOK_HOST": "127.0.0.1",
+            "WEBHOOK_PORT": str(self.port),
+            # Процессы обработки делятся между процессами бота
+            "WORKERS": str(max(1, WORKERS // shards)),
+            "METRICS_PORT": str(METRICS_PORT + 1 + index if METRICS_PORT else 0),
+        }
+        if index > 0:
+            self.env.update(BACKUP_INTERVAL="0", GC_INTERVAL="0")
+        self.process: Optional[subprocess.Popen] = None
+
+    def start(self) -> None:
+        # Отдельная сессия: Ctrl+C в терминале получает только маршрутизатор, он и останавливает процессы
+        self.process = subprocess.Popen([sys.executable, self.script], env=self.env, start_new_session=True)
+        logger.info("Shard %d started (pid %d, port %d)", self.index, self.process.pid, self.port)
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    async def wait_ready(self, session: ClientSession, timeout: float = 60) -> None:
+        """Ждет, пока процесс начнет принимать соединения (ответ на GET не важен)."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while loop.time() < deadline and self.alive():
+            try:
+                async with session.get(self.url):
+                    return
+            except ClientConnectionError:
+                await asyncio.sleep(0.1)
+        logger.warning("Shard %d is not ready after %.0f s", self.index, timeout)
+
+    async def stop(self, timeout: float = 30) -> None:
+        """Останавливает процесс как по Ctrl+C: принятые обновления дообрабатываются."""
+        if not self.alive():
+            return
+        self.process.send_signal(signal.SIGINT)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.process.wait, timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning("Shard %d did not stop in %.0f s, killing it", self.index, timeout)
+            self.process.kill()
+
+
+class ShardRouter:
+    """
+    Принимает вебхук Telegram и передает каждое обновление процессу Shard по user_id.
+
+    Все обновления пользователя попадают в один процесс и обрабатываются там по порядку,
+    поэтому кэши строк и таблиц пользователя остаются в памяти одного процесса. Общая база
+    SQLite в режиме WAL; изменения других процессов сбрасывают кэши (Database._sync_caches).
+    Если процесс недоступен (например, перезапускается), Telegram получает 503 и повторит доставку.
+    """
+
+    def __init__(self, shards: List[Shard]) -> None:
+        self.shards = shards
+        self.session: Optional[ClientSession] = None
+
+    def shard_of(self, update: Dict[str, Any]) -> Shard:
+        user_id = user_of(update)
+        return self.shards[(user_id or 0) % len(self.shards)]
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and request.headers.get(SECRET_HEADER) != WEBHOOK_SECRET:
+            return web.Response(status=403)
+        body = await request.read()
+        shard = self.shard_of(await request.json())
+        headers = {SECRET_HEADER: WEBHOOK_SECRET} if WEBHOOK_SECRET else {}
+        headers["Content-Type"] = "application/json"
+        try:
+            async with self.session.post(shard.url, data=body, headers=headers) as response:
+                return web.Response(status=response.status)
+        except (ClientConnectionError, asyncio.TimeoutError):
+            return web.Response(status=503)
+
+    async def supervise(self, interval: float = 1) -> None:
+        """Перезапускает упавшие процессы."""
+        while True:
+            await asyncio.sleep(interval)
+            for shard in self.shards:
+                if not shard.alive():
+                    logger.warning("Shard %d exited with code %s, restarting", shard.index,
+                                   shard.process.returncode if shard.process else None)
+                    shard.start()
+
+
+def run_sharded(dispatcher: Dispatcher, script: str, shards: int) -> None:
+    """
+    Запускает shards процессов script и маршрутизатор вебхука на WEBHOOK_HOST:WEBHOOK_PORT.
+
+    Процесс i слушает 127.0.0.1:WEBHOOK_PORT + 1 + i. Схема базы должна быть уже обновлена.
+    """
+    router = ShardRouter([Shard(index, shards, script) for index in range(shards)])
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, router.handle_update)
+    tasks = []
+
+    async def startup(_: web.Application) -> None:
+        router.session = ClientSession(timeout=ClientTimeout(total=30))
+        for shard in router.shards:
+            shard.start()
+        await asyncio.gather(*(shard.wait_ready(router.session) for shard in router.shards))
+        tasks.append(asyncio.create_task(router.supervise()))
+        Bot.set_current(dispatcher.bot)
+        await set_webhook(dispatcher.bot, min(UPDATE_CONCURRENCY * shards, MAX_WEBHOOK_CONNECTIONS))
+
+    async def shutdown(_: web.Application) -> None:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*(shard.stop() for shard in router.shards))
+        await router.session.close()
+        await (await dispatcher.bot.get_session()).close()
+
+    app.on_startup.append(startup)
+    app.on_shutdown.append(shutdown)
+    web.run_app(app, host=WEBHOOK_HOST, port=WEBHOOK_PORT)
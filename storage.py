@@ -0,0 +1,72 @@
+import os
+import uuid
+from typing import Union, TYPE_CHECKING
+
+# pandas и pyarrow загружаются при первом обращении к хранилищу, чтобы бот запускался быстрее
+if TYPE_CHECKING:
+    import pandas as pd
+    import pyarrow as pa
+
+
+class UploadStore:
+    """
+    Хранилище загруженных пользователями таблиц в виде сжатых Parquet-файлов.
+
+    Каждая загрузка пишется в новый файл uploads/<user_id>/<тип>_<uuid>.parquet,
+    путь к нему хранится в таблице files. Типы столбцов (например, баркоды как int64)
+    сохраняются, чтение идет через memory map.
+    """
+
+    SUFFIX = ".parquet"
+
+    def __init__(self, root: str, compression: str = "zstd") -> None:
+        self.root = root
+        self.compression = compression
+
+    def is_stored(self, reference: Union[str, None]) -> bool:
+        """Является ли ссылка из таблицы files путем к файлу хранилища (а не именем таблицы SQLite)."""
+        return bool(reference) and reference.endswith(self.SUFFIX)
+
+    def save(self, user_id: int, table_name: str, df: "pd.DataFrame") -> str:
+        user_dir = os.path.join(self.root, str(user_id))
+        os.makedirs(user_dir, exist_ok=True)
+        path = os.path.join(user_dir, f"{table_name}_{uuid.uuid4().hex}{self.SUFFIX}")
+
+        # Пишем во временный файл, чтобы читатели никогда не видели недописанный файл
+        temp_path = path + ".tmp"
+        import pyarrow.parquet as pq
+        pq.write_table(self._to_arrow(df), temp_path, compression=self.compression)
+        os.replace(temp_path, path)
+        return path
+
+    @staticmethod
+    def load(path: str) -> "pd.DataFrame":
+        import pyarrow.parquet as pq
+        return pq.read_table(path, memory_map=True).to_pandas()
+
+    @staticmethod
+    def count_rows(path: str) -> int:
+        """Число строк по метаданным файла, без чтения данных."""
+        import pyarrow.parquet as pq
+        return pq.read_metadata(path).num_rows
+
+    @staticmethod
+    def delete(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _to_arrow(df: "pd.DataFrame") -> "pa.Table":
+        import pyarrow as pa
+
+        columns = {}
+        for name in df.columns:
+            column = df[name]
+            try:
+                columns[str(name)] = pa.array(column, from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                # Столбцы со смешанными типами (например, размер 42 и "XL") храним как строки
+                columns[str(name)] = pa.array(column.where(column.isna(), column.astype(str)), from_pandas=True)
+        return pa.table(columns)
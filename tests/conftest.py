@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+# Модули бота лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = Database(str(tmp_path / "database.db"), str(tmp_path / "uploads"))
+    database.initialize_database()
+    return database
+
+
+def add_user(database: Database, user_id: int, **values) -> None:
+    database.insert_into_table("users", {"user_id": user_id, "username": f"user{user_id}", "password": "secret",
+                                         "usage_limit": 3, **values})
+    database.insert_into_table("files", {"user_id": user_id})
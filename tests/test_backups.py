@@ -0,0 +1,92 @@
+import gzip
+import shutil
+import sqlite3
+from datetime import datetime, timedelta
+
+from backups import BackupManager, keep_by_retention
+
+
+def restore(backup_path, path):
+    with gzip.open(backup_path, 'rb') as compressed, open(path, 'wb') as restored:
+        shutil.copyfileobj(compressed, restored)
+    return sqlite3.connect(path)
+
+
+def tables(connection):
+    return {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+
+
+def make_database(path):
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE users (user_id INTEGER PRIMARY KEY, username TEXT);
+        CREATE TABLE "42box_capacity_id" ("Баркод" TEXT, "Кратность" INTEGER);
+        INSERT INTO users VALUES (42, 'user42');
+        INSERT INTO "42box_capacity_id" VALUES ('1000', 6);
+    """)
+    connection.close()
+
+
+def test_hourly_snapshots_keep_newest_of_each_hour():
+    start = datetime(2024, 1, 1, 10)
+    timestamps = [start + timedelta(minutes=20 * i) for i in range(9)]  # 10:00 ... 12:40
+
+    kept = keep_by_retention(timestamps, hourly=2, daily=0, weekly=0)
+
+    assert kept == {datetime(2024, 1, 1, 12, 40), datetime(2024, 1, 1, 11, 40)}
+
+
+def test_daily_and_weekly_snapshots_keep_newest_of_each_period():
+    # Снимок каждый день в 03:00 в течение трех недель, 2024-01-01 — понедельник
+    timestamps = [datetime(2024, 1, 1, 3) + timedelta(days=i) for i in range(21)]
+
+    daily = keep_by_retention(timestamps, hourly=0, daily=3, weekly=0)
+    weekly = keep_by_retention(timestamps, hourly=0, daily=0, weekly=2)
+
+    assert daily == {datetime(2024, 1, day, 3) for day in (19, 20, 21)}
+    # Последний снимок недели — воскресенье
+    assert weekly == {datetime(2024, 1, 21, 3), datetime(2024, 1, 14, 3)}
+
+
+def test_retention_combines_periods():
+    timestamps = [datetime(2024, 1, 1, 3) + timedelta(hours=6 * i) for i in range(4 * 14)]
+
+    kept = keep_by_retention(timestamps, hourly=1, daily=2, weekly=2)
+
+    newest = max(timestamps)
+    assert kept == {newest, newest - timedelta(days=1), datetime(2024, 1, 7, 21)}
+
+
+def test_apply_retention_removes_old_files(tmp_path):
+    manager = BackupManager(str(tmp_path / "database.db"), str(tmp_path / "backups"))
+    (tmp_path / "backups").mkdir()
+    for day in range(1, 6):
+        (tmp_path / "backups" / f"database_2024-01-0{day}_03-00-00.db.gz").write_bytes(b"")
+    (tmp_path / "backups" / "other_2024-01-01_03-00-00.db.gz").write_bytes(b"")
+
+    removed = manager.apply_retention(hourly=0, daily=2, weekly=0)
+
+    assert len(removed) == 3
+    assert sorted(path.name for path in (tmp_path / "backups").iterdir()) == [
+        "database_2024-01-04_03-00-00.db.gz", "database_2024-01-05_03-00-00.db.gz",
+        "other_2024-01-01_03-00-00.db.gz"]
+
+
+def test_routine_backup_restores_without_upload_tables(tmp_path):
+    make_database(str(tmp_path / "database.db"))
+    manager = BackupManager(str(tmp_path / "database.db"), str(tmp_path / "backups"))
+
+    restored = restore(manager.create_backup(), str(tmp_path / "restored.db"))
+
+    assert tables(restored) == {"users"}
+    assert restored.execute("SELECT username FROM users WHERE user_id = 42").fetchone() == ("user42",)
+
+
+def test_migration_backup_keeps_upload_tables(tmp_path):
+    make_database(str(tmp_path / "database.db"))
+    manager = BackupManager(str(tmp_path / "database.db"), str(tmp_path / "backups"))
+
+    restored = restore(manager.create_backup(keep_uploads=True), str(tmp_path / "restored.db"))
+
+    assert tables(restored) == {"users", "42box_capacity_id"}
+    assert restored.execute('SELECT * FROM "42box_capacity_id"').fetchall() == [("1000", 6)]
@@ -0,0 +1,59 @@
+from fractions import Fraction
+
+import pandas as pd
+
+import main
+
+
+def shipment(multiplicities, quantities):
+    capacity = pd.DataFrame({
+        'Артикул продавца': [f"art{i}" for i in range(len(multiplicities))],
+        'Размер': ['M'] * len(multiplicities),
+        'Баркод': [str(1000 + i) for i in range(len(multiplicities))],
+        'Кратность': multiplicities,
+    })
+    items = pd.DataFrame({'Баркод': capacity['Баркод'], 'Количество': quantities})
+    return capacity, items
+
+
+def test_box_capacity_uses_integer_volumes_of_shipped_items():
+    capacity = main.BoxCapacity([4, 6, 6])
+
+    assert capacity.box_volume == 12
+    assert capacity.volume(4) == 3
+    assert capacity.fits(12 - 3, 6) == 4
+
+
+def test_box_capacity_falls_back_to_fractions_when_lcm_overflows():
+    primes = [1_000_003, 1_000_033, 1_000_037, 1_000_039]
+    capacity = main.BoxCapacity(primes)
+
+    assert capacity.box_volume == 1
+    assert capacity.volume(primes[0]) == Fraction(1, primes[0])
+    # Ровно полная коробка из одного товара, без ошибки округления
+    assert capacity.fits(capacity.box_volume, primes[0]) == primes[0]
+
+
+def test_leftovers_of_coprime_multiplicities_share_boxes_exactly():
+    capacity, items = shipment([2, 3, 6], [1, 1, 1])
+    packing = main.plan_packing(capacity, items)
+
+    # 1/2 + 1/3 + 1/6 — ровно одна коробка
+    assert packing.total_boxes == 1
+
+
+def test_count_matches_report_rows():
+    capacity, items = shipment([5, 7, 12, 1], [23, 50, 11, 3])
+    total_boxes = main.count_boxes(capacity.copy(), items.copy())
+    packed = main.pack_boxes(capacity.copy(), items.copy())
+
+    assert total_boxes == packed['box_id'].nunique()
+    assert packed.groupby('barcode')['quantity'].sum().to_dict() == {'1000': 23, '1001': 50, '1002': 11,
+                                                                    '1003': 3}
+
+
+def test_missing_multiplicity_is_reported():
+    capacity, items = shipment([5], [3])
+    items.loc[len(items)] = ['unknown', 1]
+
+    assert isinstance(main.count_boxes(capacity, items), str)
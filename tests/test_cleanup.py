@@ -0,0 +1,95 @@
+import os
+import sqlite3
+import time
+
+import pandas as pd
+
+from cleanup import UploadCollector
+from conftest import add_user
+
+
+def upload(database, user_id, table_name='box_capacity_id'):
+    df = pd.DataFrame({'Баркод': ['1000'], 'Кратность': [2]})
+    database.save_dataframe(user_id, table_name, df)
+    return database.get_row_as_dict({"user_id": user_id}, "files")[table_name]
+
+
+def orphan_file(database, user_id):
+    path = database.uploads.save(user_id, 'box_capacity_id', pd.DataFrame({'Баркод': ['1000']}))
+    # Файл записан давно: удалять его или нет, решает только время без ссылок
+    os.utime(path, (time.time() - 10 ** 6, time.time() - 10 ** 6))
+    return path
+
+
+def collector(database, grace):
+    return UploadCollector(database.db_file, database.uploads.root, grace=grace, pause=0)
+
+
+def test_referenced_uploads_survive_collection(database):
+    add_user(database, 1)
+    path = upload(database, 1)
+    database.connection.execute('CREATE TABLE "1items_to_ship_id" ("Баркод" TEXT)')
+    database.update_table("files", {"items_to_ship_id": "1items_to_ship_id"}, {"user_id": 1})
+
+    report = collector(database, grace=0).collect()
+
+    assert report["files_deleted"] == 0 and report["tables_dropped"] == 0
+    assert os.path.exists(path)
+    tables = {row[0] for row in database.connection.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    assert "1items_to_ship_id" in tables
+
+
+def test_unreferenced_uploads_are_removed(database):
+    add_user(database, 1)
+    path = orphan_file(database, 1)
+    with database.connection:
+        database.connection.execute('CREATE TABLE "1boxes_id" ("ШК короба" TEXT)')
+
+    report = collector(database, grace=0).collect()
+
+    assert report["files_deleted"] == 1 and report["tables_dropped"] == 1
+    assert not os.path.exists(path)
+    tables = {row[0] for row in database.connection.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    assert "1boxes_id" not in tables
+
+
+def test_grace_period_counts_from_losing_the_reference(database):
+    add_user(database, 1)
+    path = upload(database, 1)
+    os.utime(path, (time.time() - 10 ** 6, time.time() - 10 ** 6))
+    gc = collector(database, grace=0.2)
+
+    # Старый файл только что потерял ссылку: первая сборка его не трогает
+    database.reset_file_ids(1)
+    assert gc.collect()["files_deleted"] == 0
+    assert os.path.exists(path)
+
+    time.sleep(0.3)
+    assert gc.collect()["files_deleted"] == 1
+    assert not os.path.exists(path)
+
+
+def test_file_referenced_again_is_kept(database):
+    add_user(database, 1)
+    path = orphan_file(database, 1)
+    gc = collector(database, grace=0.1)
+    gc.collect()
+
+    database.update_table("files", {"box_capacity_id": path}, {"user_id": 1})
+    time.sleep(0.2)
+
+    assert gc.collect()["files_deleted"] == 0
+    assert os.path.exists(path)
+
+
+def test_collection_returns_free_pages_without_full_vacuum(database):
+    connection = sqlite3.connect(database.db_file)
+    assert connection.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    with connection:
+        connection.execute('CREATE TABLE "1box_capacity_id" (data BLOB)')
+        connection.executemany('INSERT INTO "1box_capacity_id" VALUES (?)', [(b'x' * 4096,) for _ in range(200)])
+    connection.close()
+
+    report = collector(database, grace=0).collect()
+
+    assert report["tables_dropped"] == 1 and report["database_bytes"] > 0
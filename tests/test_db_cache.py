@@ -0,0 +1,71 @@
+import sqlite3
+
+import pandas as pd
+
+from conftest import add_user
+from db import user_key
+
+
+def test_user_key_normalizes_user_id():
+    assert user_key({"user_id": "42"}) == 42
+    assert user_key({"user_id": 42}) == 42
+    assert user_key({"user_id": "not a number"}) is None
+    assert user_key({"user_id": 42, "username": "user42"}) is None
+
+
+def test_new_password_is_visible_by_str_user_id(database):
+    add_user(database, 42)
+    # Кнопки администратора передают user_id строкой из callback_data
+    assert database.get_row_as_dict({"user_id": "42"})["password"] == "secret"
+
+    user_data = database.update_user(42)
+
+    assert user_data["password"] != "secret"
+    assert database.get_row_as_dict({"user_id": "42"})["password"] == user_data["password"]
+    assert database.get_row_as_dict({"user_id": 42})["password"] == user_data["password"]
+
+
+def capacity(multiplicity):
+    return pd.DataFrame({"Баркод": ["1000"], "Кратность": [multiplicity]})
+
+
+def cached_capacity(database, user_id):
+    box_capacity_df = database.get_data_from_db(user_id)[0]
+    assert ("frames", user_id) in database.frames
+    return box_capacity_df["Кратность"].tolist()
+
+
+def test_upload_invalidates_cached_frames(database):
+    add_user(database, 1)
+    database.save_dataframe(1, "box_capacity_id", capacity(2))
+    assert cached_capacity(database, 1) == [2]
+
+    database.save_dataframe(1, "box_capacity_id", capacity(6))
+
+    assert cached_capacity(database, 1) == [6]
+
+
+def test_clear_shipments_invalidates_cached_frames(database):
+    add_user(database, 1)
+    database.save_dataframe(1, "box_capacity_id", capacity(2))
+    cached_capacity(database, 1)
+
+    database.clear_shipments(1)
+
+    assert ("frames", 1) not in database.frames
+
+
+def test_commit_of_another_connection_invalidates_caches(database):
+    add_user(database, 1)
+    database.save_dataframe(1, "box_capacity_id", capacity(2))
+    assert cached_capacity(database, 1) == [2]
+    path = database.uploads.save(1, "box_capacity_id", capacity(6))
+
+    # Другой процесс бота (shards.py) меняет ссылку на загрузку в обход кэшей этого
+    connection = sqlite3.connect(database.db_file)
+    with connection:
+        connection.execute("UPDATE files SET box_capacity_id = ? WHERE user_id = 1", (path,))
+    connection.close()
+
+    assert database.get_row_as_dict({"user_id": 1}, "files")["box_capacity_id"] == path
+    assert cached_capacity(database, 1) == [6]
@@ -0,0 +1,92 @@
+import asyncio
+import io
+import os
+import zipfile
+
+import pytest
+from aiogram import Bot, types
+from aiogram.bot.api import TelegramAPIServer
+from aiohttp import web
+
+import main
+from downloads import UploadTooLargeError, download_document
+
+PAYLOAD = os.urandom(3 * 2 ** 20)
+
+
+async def file_method(request):
+    return web.json_response({"ok": True, "result": {"file_id": "f", "file_unique_id": "u",
+                                                     "file_path": "documents/upload.xlsx"}})
+
+
+async def file_content(request):
+    # Без Content-Length: размер становится известен только по полученным байтам
+    response = web.StreamResponse()
+    await response.prepare(request)
+    for start in range(0, len(PAYLOAD), 64 * 1024):
+        await response.write(PAYLOAD[start:start + 64 * 1024])
+    await response.write_eof()
+    return response
+
+
+def download(directory, max_bytes, file_size=None):
+    async def run():
+        app = web.Application()
+        app.router.add_route('*', '/bot{token}/{method}', file_method)
+        app.router.add_get('/file/bot{token}/{path:.*}', file_content)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        host, port = runner.addresses[0][:2]
+        bot = Bot('1:TOKEN', server=TelegramAPIServer.from_base(f'http://{host}:{port}'))
+        document = types.Document(file_id='f', file_unique_id='u', file_name='upload.xlsx', file_size=file_size)
+        try:
+            return await download_document(bot, document, max_bytes=max_bytes, directory=str(directory))
+        finally:
+            await (await bot.get_session()).close()
+            await runner.cleanup()
+
+    return asyncio.run(run())
+
+
+def test_document_is_streamed_to_temporary_file(tmp_path):
+    path = download(tmp_path, max_bytes=len(PAYLOAD))
+
+    with open(path, 'rb') as file:
+        assert file.read() == PAYLOAD
+    assert os.listdir(tmp_path) == [os.path.basename(path)]
+
+
+def test_oversized_stream_is_rejected_and_removed(tmp_path):
+    with pytest.raises(UploadTooLargeError):
+        download(tmp_path, max_bytes=2 ** 20)
+
+    assert os.listdir(tmp_path) == []
+
+
+def test_declared_size_is_rejected_before_download(tmp_path):
+    with pytest.raises(UploadTooLargeError):
+        download(tmp_path, max_bytes=2 ** 20, file_size=5 * 2 ** 20)
+
+    assert os.listdir(tmp_path) == []
+
+
+def test_highly_compressed_archive_is_rejected():
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('items.csv', b'0' * 16 * 2 ** 20)
+
+    with zipfile.ZipFile(output) as z:
+        with pytest.raises(main.UnsafeArchiveError):
+            main.check_archive(z)
+    assert isinstance(main.open_excel(output.getvalue()), str)
+
+
+def test_ordinary_archive_passes_check():
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('items.bin', os.urandom(2 * 2 ** 20))
+
+    with zipfile.ZipFile(output) as z:
+        main.check_archive(z)
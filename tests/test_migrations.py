@@ -0,0 +1,123 @@
+import gzip
+import sqlite3
+
+import pytest
+
+from db import Database
+
+
+def columns(connection: sqlite3.Connection, table: str):
+    return [row[1] for row in connection.execute(f"PRAGMA table_info({table})")]
+
+
+@pytest.fixture
+def baseline_db(tmp_path, monkeypatch):
+    """База в том виде, в котором ее создавала версия бота до версионирования схемы."""
+    # Резервная копия перед миграцией пишется в каталог backups относительно рабочего каталога
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / "database.db")
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE users (user_id INTEGER PRIMARY KEY, first_name TEXT, last_name TEXT, username TEXT,
+                            password TEXT, usage_limit INTEGER, is_authorized INTEGER DEFAULT 0,
+                            registration_date TEXT, amount_of_boxes INTEGER DEFAULT 0);
+        CREATE TABLE files (user_id INTEGER PRIMARY KEY, box_capacity_id TEXT, items_to_ship_id TEXT,
+                            boxes_id TEXT);
+        CREATE TABLE generations (generation_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER,
+                                  generation_date TEXT);
+        CREATE TABLE "42box_capacity_id" ("Баркод" TEXT, "Кратность" INTEGER);
+        INSERT INTO users (user_id, username, password, usage_limit, amount_of_boxes)
+            VALUES (42, 'user42', 'secret', 2, 7);
+        INSERT INTO files (user_id, box_capacity_id) VALUES (42, '42box_capacity_id');
+        INSERT INTO generations (user_id, generation_date) VALUES (42, '2024-01-01 00:00:00');
+    """)
+    connection.close()
+    return path
+
+
+def test_baseline_database_is_migrated_with_data(baseline_db, tmp_path):
+    database = Database(baseline_db, str(tmp_path / "uploads"))
+    database.initialize_database()
+
+    connection = database.connection
+    assert connection.execute("PRAGMA user_version").fetchone()[0] == Database.SCHEMA_VERSION
+    for table, definition in Database.TABLE_DEFINITIONS.items():
+        assert columns(connection, table) == [name for name, _ in definition]
+    user = database.get_row_as_dict({"user_id": 42})
+    assert (user["password"], user["usage_limit"], user["amount_of_boxes"]) == ("secret", 2, 7)
+    assert user["box_capacity_id"] == "42box_capacity_id" and user["packing_id"] is None
+    assert connection.execute("SELECT COUNT(*) FROM generations").fetchone()[0] == 1
+    # Старые загрузки в таблицах SQLite остаются доступны
+    assert connection.execute('SELECT COUNT(*) FROM "42box_capacity_id"').fetchone()[0] == 0
+    assert list((tmp_path / "backups").iterdir())
+
+
+def test_new_database_gets_latest_schema(tmp_path):
+    database = Database(str(tmp_path / "database.db"), str(tmp_path / "uploads"))
+    database.initialize_database()
+
+    connection = database.connection
+    assert connection.execute("PRAGMA user_version").fetchone()[0] == Database.SCHEMA_VERSION
+    # Миграции и TABLE_DEFINITIONS описывают одну и ту же схему
+    for table, definition in Database.TABLE_DEFINITIONS.items():
+        assert columns(connection, table) == [name for name, _ in definition]
+    assert connection.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+
+def test_versioned_database_applies_only_missing_migrations(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / "database.db")
+    connection = sqlite3.connect(path)
+    for statement in Database.MIGRATIONS[0]:
+        connection.execute(statement)
+    connection.execute("INSERT INTO users (user_id, password) VALUES (1, 'secret')")
+    connection.execute("PRAGMA user_version = 1")
+    connection.commit()
+    connection.close()
+
+    database = Database(path, str(tmp_path / "uploads"))
+    database.initialize_database()
+
+    assert database.connection.execute("PRAGMA user_version").fetchone()[0] == Database.SCHEMA_VERSION
+    assert "packing_id" in columns(database.connection, "files")
+    assert database.get_row_as_dict({"user_id": 1}, "users")["password"] == "secret"
+
+
+def test_up_to_date_database_is_not_backed_up(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / "database.db")
+    Database(path, str(tmp_path / "uploads")).initialize_database()
+
+    Database(path, str(tmp_path / "uploads")).initialize_database()
+
+    assert not (tmp_path / "backups").exists()
+
+
+def test_migration_switches_existing_database_to_incremental_vacuum(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / "database.db")
+    connection = sqlite3.connect(path)
+    for statements in Database.MIGRATIONS[:3]:
+        for statement in statements:
+            connection.execute(statement)
+    connection.execute("PRAGMA user_version = 3")
+    connection.commit()
+    assert connection.execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+    connection.close()
+
+    database = Database(path, str(tmp_path / "uploads"))
+    database.initialize_database()
+
+    assert database.connection.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    assert list((tmp_path / "backups").iterdir())
+
+
+def test_migration_backup_keeps_legacy_upload_tables(baseline_db, tmp_path):
+    Database(baseline_db, str(tmp_path / "uploads")).initialize_database()
+
+    (backup,) = (tmp_path / "backups").iterdir()
+    with gzip.open(backup, 'rb') as compressed:
+        (tmp_path / "restored.db").write_bytes(compressed.read())
+    connection = sqlite3.connect(str(tmp_path / "restored.db"))
+    assert connection.execute('SELECT COUNT(*) FROM "42box_capacity_id"').fetchone()[0] == 0
+    assert connection.execute("PRAGMA user_version").fetchone()[0] == 0
@@ -0,0 +1,59 @@
+from fractions import Fraction
+
+import pytest
+
+import main
+from benchmarks import generators
+from test_capacity import shipment
+
+
+def check_packing(packing: main.Packing, items) -> None:
+    """Все единицы товара разложены, коробки не переполнены, номера коробок идут подряд с 0."""
+    packed = packing.to_frame()
+    expected = items.iloc[:, 1].groupby(items.iloc[:, 0].astype(str)).sum()
+    assert packed.groupby('barcode')['quantity'].sum().to_dict() == expected[expected > 0].to_dict()
+
+    multiplicities = dict(zip(packing.items['barcode'], packing.items['multiplicity']))
+    fill = {}
+    for barcode, quantity, box_id in zip(packed['barcode'], packed['quantity'], packed['box_id']):
+        fill[box_id] = fill.get(box_id, 0) + Fraction(int(quantity), int(multiplicities[barcode]))
+    assert max(fill.values()) <= 1
+    assert sorted(fill) == list(range(packing.total_boxes))
+
+
+@pytest.mark.parametrize('distribution', generators.DISTRIBUTIONS)
+@pytest.mark.parametrize('optimize', [False, True])
+def test_packing_invariants(distribution, optimize):
+    capacity, items = generators.shipment(300, distribution, seed=3)
+    packing = main.plan_packing(capacity.copy(), items.copy(), optimize=optimize)
+
+    check_packing(packing, items)
+
+
+@pytest.mark.parametrize('distribution', generators.DISTRIBUTIONS)
+def test_optimizer_is_never_worse_than_greedy(distribution):
+    capacity, items = generators.shipment(300, distribution, seed=4)
+    greedy = main.plan_packing(capacity.copy(), items.copy())
+    optimized = main.plan_packing(capacity.copy(), items.copy(), optimize=True)
+
+    assert optimized.total_boxes == greedy.total_boxes - optimized.saved_boxes
+    assert optimized.saved_boxes >= 0
+
+
+def test_optimizer_saves_a_box_over_greedy():
+    # 4/5 + 4/6 + 2/4 коробки: жадная раскладка открывает три коробки, хватает двух
+    capacity, items = shipment([5, 6, 4], [4, 4, 2])
+    greedy = main.plan_packing(capacity.copy(), items.copy())
+    optimized = main.plan_packing(capacity.copy(), items.copy(), optimize=True)
+
+    assert (greedy.total_boxes, optimized.total_boxes, optimized.saved_boxes) == (3, 2, 1)
+    check_packing(optimized, items)
+
+
+def test_full_boxes_hold_one_item():
+    capacity, items = shipment([4, 10], [9, 30])
+    packed = main.plan_packing(capacity.copy(), items.copy()).to_frame()
+
+    full = packed[packed['quantity'] == packed['barcode'].map({'1000': 4, '1001': 10})]
+    assert full['box_id'].is_unique
+    assert len(full) == 2 + 3
@@ -0,0 +1,114 @@
+import codecs
+import io
+import zipfile
+
+import pandas as pd
+import pytest
+
+import main
+
+CAPACITY = pd.DataFrame({'Артикул продавца': ['art0', 'art1'], 'Размер': ['M', 'L'],
+                         'Баркод': ['1000', '1001'], 'Кратность': [6, 4]})
+ITEMS = pd.DataFrame({'Баркод': ['1000', '1001'], 'Количество': [13, 5]})
+
+
+def to_xlsx(sheets):
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        for name, df in sheets.items():
+            df.to_excel(writer, sheet_name=name, index=False)
+    return output.getvalue()
+
+
+def to_zip(files):
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as z:
+        for name, data in files.items():
+            z.writestr(name, data)
+    return output.getvalue()
+
+
+def sheets_by_name(result):
+    return {sheet['name']: sheet['df'] for sheet in result}
+
+
+def test_xlsx_with_unrelated_sheets_loads_only_known_tables():
+    junk = pd.DataFrame({f'Показатель {i}': range(3) for i in range(5)})
+    data = to_xlsx({'Вместимость': CAPACITY, 'Сводка': junk, 'Отгрузка': ITEMS})
+
+    sheets = sheets_by_name(main.open_excel(data))
+
+    assert list(sheets) == ['Вместимость', 'Сводка', 'Отгрузка']
+    assert main.is_box_capacity(sheets['Вместимость']) is True
+    assert main.is_items_to_ship(sheets['Отгрузка']) is True
+    assert sheets['Отгрузка']['количество'].tolist() == [13, 5]
+    # Посторонний лист не читается целиком и не распознается
+    assert sheets['Сводка'].empty
+    assert main.is_box_capacity(sheets['Сводка']) is False and main.is_items_to_ship(sheets['Сводка']) is False
+
+
+@pytest.mark.parametrize('encoding, prefix', [('cp1251', b''), ('utf-8', codecs.BOM_UTF8)])
+def test_csv_encodings(encoding, prefix):
+    data = prefix + CAPACITY.to_csv(index=False, sep=';').encode(encoding)
+
+    (sheet,) = main.open_excel(data)
+
+    assert sheet['name'] == 'CSV'
+    assert list(sheet['df'].columns) == list(CAPACITY.columns)
+    assert sheet['df']['Артикул продавца'].tolist() == ['art0', 'art1']
+    assert main.is_box_capacity(sheet['df']) is True
+
+
+def test_csv_dialect_detection():
+    assert main.detect_csv_dialect('Баркод;Количество\n1000;13\n'.encode('cp1251')) == ('cp1251', ';')
+    assert main.detect_csv_dialect('Баркод,Количество\n1000,13\n'.encode('utf-8')) == ('utf-8', ',')
+    assert main.detect_csv_dialect(b'barcode\tquantity\n1000\t13\n') == ('utf-8', '\t')
+
+
+def test_parquet_input(tmp_path):
+    path = tmp_path / 'items.parquet'
+    ITEMS.to_parquet(path, index=False)
+
+    (sheet,) = main.open_excel(str(path))
+
+    assert sheet['name'] == 'Parquet'
+    assert sheet['df'].equals(ITEMS)
+
+
+def test_zip_with_tables_and_other_files():
+    data = to_zip({'capacity.csv': CAPACITY.to_csv(index=False), 'readme.txt': 'не таблица',
+                   'items.xlsx': to_xlsx({'Отгрузка': ITEMS})})
+
+    sheets = sheets_by_name(main.open_excel(data))
+
+    assert list(sheets) == ['capacity.csv | CSV', 'items.xlsx | Отгрузка']
+    assert main.is_items_to_ship(sheets['items.xlsx | Отгрузка']) is True
+
+
+def test_binary_file_is_rejected():
+    png = b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR' + bytes(64)
+
+    with pytest.raises(ValueError):
+        main.detect_csv_dialect(png)
+    with pytest.raises(ValueError):
+        main.read_tables(io.BytesIO(png))
+    assert main.read_source(io.BytesIO(png)) is None
+    assert main.open_excel(png) is None
+
+
+def test_zip_without_tables_is_rejected():
+    data = to_zip({'readme.txt': 'не таблица', 'photo.jpg': b'\xff\xd8\xff'})
+
+    assert main.open_excel(data) is None
+
+
+def test_xlsx_reader_rejects_other_formats():
+    with pytest.raises(zipfile.BadZipFile):
+        main.read_xlsx_sheets(io.BytesIO(ITEMS.to_csv(index=False).encode()))
+
+
+def test_empty_file_is_rejected(tmp_path):
+    path = tmp_path / 'empty.xlsx'
+    path.write_bytes(b'')
+
+    assert main.open_excel(str(path)) is None
@@ -0,0 +1,68 @@
+import pandas as pd
+import pytest
+
+import main
+from benchmarks import generators
+from metrics import collect
+from storage import UploadStore
+from test_capacity import shipment
+from test_packing import check_packing
+
+
+def boxes(layout):
+    """Содержимое коробок раскладки без учета порядка строк."""
+    return layout.sort_values(['box_id', 'barcode', 'full']).reset_index(drop=True)
+
+
+@pytest.fixture(autouse=True)
+def empty_packing_cache():
+    main.packing_cache.clear()
+
+
+@pytest.mark.parametrize('distribution', generators.DISTRIBUTIONS)
+def test_repack_of_unchanged_shipment_keeps_every_box(distribution):
+    capacity, items = generators.shipment(500, distribution, seed=5)
+    layout = main.plan_packing(capacity.copy(), items.copy()).to_layout()
+
+    repacked = main.plan_packing(capacity.copy(), items.copy(), layout=layout)
+
+    assert boxes(repacked.to_layout()).equals(boxes(layout))
+
+
+@pytest.mark.parametrize('distribution', generators.DISTRIBUTIONS)
+def test_repack_after_small_change_keeps_most_boxes(distribution):
+    capacity, items = generators.shipment(500, distribution, seed=6)
+    layout = main.plan_packing(capacity.copy(), items.copy()).to_layout()
+    changed = generators.changed_items(items, share=0.02, seed=6)
+
+    repacked = main.plan_packing(capacity.copy(), changed.copy(), layout=layout)
+
+    check_packing(repacked, changed)
+    kept = boxes(layout).merge(boxes(repacked.to_layout()), how='inner')
+    assert len(kept) >= 0.9 * len(layout)
+
+
+def test_report_reuses_plan_of_count_after_layout_is_saved(tmp_path):
+    capacity, items = generators.shipment(200, seed=7)
+    store = UploadStore(str(tmp_path))
+
+    (total_boxes, _, layout), _, count_events = collect(main.summarize_packing, capacity.copy(), items.copy(), None)
+    # Раскладка проходит через хранилище, как между подсчетом и отчетом в боте
+    layout = store.load(store.save(1, 'packing', layout))
+    packing, _, report_events = collect(main.get_packing, capacity.copy(), items.copy(), layout)
+
+    assert count_events == {('packing', 'miss'): 1}
+    assert report_events == {('packing', 'hit'): 1}
+    assert packing.total_boxes == total_boxes
+
+
+def test_fresh_plan_wins_when_repack_needs_more_boxes():
+    capacity, items = shipment([2, 2], [1, 1])
+    # Прошлая раскладка держит остатки в разных коробках, хотя они помещаются в одну
+    layout = pd.DataFrame({'barcode': ['1000', '1001'], 'multiplicity': [2, 2], 'quantity': [1, 1],
+                           'box_id': [0, 1], 'full': [False, False]})
+
+    packing = main.plan_packing(capacity.copy(), items.copy(), layout=layout)
+
+    check_packing(packing, items)
+    assert packing.total_boxes == 1
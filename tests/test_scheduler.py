@@ -0,0 +1,146 @@
+import asyncio
+
+import scheduler as scheduler_module
+from scheduler import JobScheduler
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def settle():
+    """Дает выполниться запущенным задачам и обратным вызовам их завершения."""
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+class Jobs:
+    """Задачи, которые записывают порядок запуска и завершаются по команде."""
+
+    def __init__(self) -> None:
+        self.started = []
+        self.release = {}
+
+    def job(self, name: str):
+        async def run_job():
+            self.started.append(name)
+            self.release[name] = asyncio.Event()
+            await self.release[name].wait()
+        return run_job
+
+    async def finish(self, name: str) -> None:
+        self.release[name].set()
+        await settle()
+
+    async def finish_all(self) -> None:
+        """Завершает все задачи, в том числе запущенные после завершения других."""
+        while not all(event.is_set() for event in self.release.values()):
+            for event in self.release.values():
+                event.set()
+            await settle()
+
+
+def test_jobs_of_different_users_alternate():
+    async def scenario():
+        jobs = Jobs()
+        queue = JobScheduler(concurrency=1)
+        for name in ("a1", "a2", "a3"):
+            assert queue.submit(1, name, jobs.job(name)) is None
+        for name in ("b1", "b2"):
+            assert queue.submit(2, name, jobs.job(name)) is None
+        await settle()
+        while len(jobs.started) < 5:
+            await jobs.finish(jobs.started[-1])
+        await jobs.finish_all()
+        return jobs.started
+
+    assert run(scenario()) == ["a1", "b1", "a2", "b2", "a3"]
+
+
+def test_user_runs_one_job_at_a_time():
+    async def scenario():
+        jobs = Jobs()
+        queue = JobScheduler(concurrency=4)
+        queue.submit(1, "count", jobs.job("count"))
+        queue.submit(1, "report", jobs.job("report"))
+        queue.submit(2, "count", jobs.job("other"))
+        await settle()
+        started = list(jobs.started)
+        await jobs.finish("count")
+        await jobs.finish_all()
+        return started, jobs.started
+
+    started, after = run(scenario())
+    assert started == ["count", "other"]
+    assert after == ["count", "other", "report"]
+
+
+def test_duplicate_job_is_rejected_while_queued():
+    async def scenario():
+        jobs = Jobs()
+        queue = JobScheduler(concurrency=1)
+        queue.submit(1, "count", jobs.job("running"))
+        await settle()
+        # Такая же задача, пока первая выполняется, ставится в очередь, а третья — уже нет
+        results = queue.submit(1, "count", jobs.job("queued")), queue.submit(1, "count", jobs.job("duplicate"))
+        await jobs.finish_all()
+        return results
+
+    assert run(scenario()) == (None, scheduler_module.ALREADY_QUEUED_MESSAGE)
+
+
+def test_admission_limits():
+    async def scenario():
+        jobs = Jobs()
+        queue = JobScheduler(concurrency=1, limit=2, max_rows=100, max_boxes=10)
+        rejections = [
+            queue.submit(1, "count", jobs.job("rows"), rows=101),
+            queue.submit(1, "report", jobs.job("boxes"), rows=10, boxes=11),
+        ]
+        for user_id in (2, 3, 4):
+            queue.submit(user_id, "count", jobs.job(f"user{user_id}"))
+        await settle()
+        rejections.append(queue.submit(5, "count", jobs.job("user5")))
+        await jobs.finish_all()
+        return rejections
+
+    rows, boxes, full = run(scenario())
+    assert rows == scheduler_module.TOO_MANY_ROWS_MESSAGE.format(rows=101, limit=100)
+    assert boxes == scheduler_module.TOO_MANY_BOXES_MESSAGE.format(boxes=11, limit=10)
+    assert full == scheduler_module.QUEUE_FULL_MESSAGE
+
+
+def test_active_rows_budget_delays_large_jobs():
+    async def scenario():
+        jobs = Jobs()
+        queue = JobScheduler(concurrency=4, active_rows=100)
+        queue.submit(1, "count", jobs.job("big"), rows=80)
+        queue.submit(2, "count", jobs.job("second big"), rows=80)
+        queue.submit(3, "count", jobs.job("small"), rows=20)
+        await settle()
+        started = list(jobs.started)
+        await jobs.finish("big")
+        await jobs.finish_all()
+        return started, jobs.started
+
+    started, after = run(scenario())
+    assert started == ["big", "small"]
+    assert after == ["big", "small", "second big"]
+
+
+def test_cancel_selected_jobs():
+    async def scenario():
+        jobs = Jobs()
+        queue = JobScheduler(concurrency=1)
+        queue.submit(1, "count", jobs.job("count"))
+        queue.submit(1, "report", jobs.job("report"))
+        queue.submit(1, "batch", jobs.job("batch"))
+        await settle()
+        cancelled = queue.cancel(1, ("count", "report"))
+        await settle()
+        await jobs.finish_all()
+        return cancelled, jobs.started
+
+    cancelled, started = run(scenario())
+    assert cancelled == 2
+    assert started == ["count", "batch"]
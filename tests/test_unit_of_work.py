@@ -0,0 +1,74 @@
+import pandas as pd
+import pytest
+
+from conftest import add_user
+from db import UnitOfWork
+
+
+def frame(barcode):
+    return pd.DataFrame({'Баркод': [barcode], 'Количество': [1]})
+
+
+def test_failed_upload_rolls_back_whole_unit(database, monkeypatch):
+    add_user(database, 1, amount_of_boxes=5)
+    save = database.uploads.save
+
+    def fail_on_items(user_id, table_name, df):
+        if table_name == 'items_to_ship_id':
+            raise OSError("disk full")
+        return save(user_id, table_name, df)
+
+    monkeypatch.setattr(database.uploads, 'save', fail_on_items)
+    unit = UnitOfWork()
+    unit.save_dataframe(1, 'box_capacity_id', frame('1000'))
+    unit.reset_amount_of_boxes(1)
+    unit.save_dataframe(1, 'items_to_ship_id', frame('1000'))
+
+    with pytest.raises(OSError):
+        database.commit(unit)
+
+    assert database.get_row_as_dict({"user_id": 1})["box_capacity_id"] is None
+    assert database.get_row_as_dict({"user_id": 1})["amount_of_boxes"] == 5
+
+
+def test_failed_upload_outside_unit_returns_false(database, monkeypatch):
+    add_user(database, 1)
+
+    def fail(user_id, table_name, df):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(database.uploads, 'save', fail)
+
+    assert database.save_dataframe(1, 'box_capacity_id', frame('1000')) is False
+
+
+def upload_batch(database, user_id):
+    unit = UnitOfWork()
+    unit.save_dataframe(user_id, 'box_capacity_id', pd.DataFrame({'Баркод': ['1000'], 'Кратность': [2]}))
+    unit.save_shipments(user_id, [('Коледино', frame('1000')), ('Электросталь', frame('1000'))])
+    database.commit(unit)
+    assert len(database.get_shipments(user_id)) == 2
+
+
+def test_reset_after_batch_upload_clears_shipments(database):
+    add_user(database, 1)
+    upload_batch(database, 1)
+
+    # Сброс, как в /reset
+    unit = UnitOfWork()
+    unit.reset_file_ids(1)
+    unit.clear_shipments(1)
+    database.commit(unit)
+
+    assert database.get_shipments(1) == []
+    assert database.get_data_from_db(1) == [None, None, None]
+
+
+def test_new_password_resets_batch_upload(database):
+    add_user(database, 1)
+    upload_batch(database, 1)
+
+    database.update_user(1)
+
+    assert database.get_shipments(1) == []
+    assert database.get_row_as_dict({"user_id": 1})["items_to_ship_id"] is None
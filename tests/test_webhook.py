@@ -0,0 +1,93 @@
+import asyncio
+
+from aiogram import Bot, Dispatcher, types
+
+from webhook import UpdateQueue, chat_key
+
+
+def message_update(update_id, chat_id):
+    return types.Update(update_id=update_id, message={
+        'message_id': update_id, 'date': 0, 'text': str(update_id),
+        'chat': {'id': chat_id, 'type': 'private'}, 'from': {'id': chat_id, 'is_bot': False, 'first_name': 'user'},
+    })
+
+
+class RecordingDispatcher(Dispatcher):
+    """Диспетчер, который вместо обработчиков вызывает handler(update)."""
+
+    def __init__(self, handler) -> None:
+        super().__init__(Bot('1:TOKEN'))
+        self.handler = handler
+
+    async def process_update(self, update: types.Update):
+        return await self.handler(update)
+
+
+def test_chat_key_groups_updates_by_chat():
+    assert chat_key(message_update(1, 42)) == chat_key(message_update(2, 42)) == 42
+    assert chat_key(types.Update(update_id=3)) == ("update", 3)
+
+
+def test_updates_of_one_chat_are_processed_in_order():
+    processed = []
+
+    async def handler(update):
+        # Первые обновления обрабатываются дольше: порядок держит очередь, а не время
+        await asyncio.sleep(0.01 * (5 - update.update_id))
+        processed.append(update.update_id)
+
+    async def run():
+        updates = UpdateQueue(RecordingDispatcher(handler), concurrency=4)
+        for update_id in range(5):
+            updates.put(message_update(update_id, 42))
+        await updates.close()
+        return updates
+
+    updates = asyncio.run(run())
+
+    assert processed == [0, 1, 2, 3, 4]
+    assert updates.pending == 0
+
+
+def test_different_chats_are_processed_concurrently():
+    second_chat_started = None
+    processed = []
+
+    async def handler(update):
+        if update.message.chat.id == 1:
+            # Обработка первого чата ждет второй чат: последовательная очередь здесь зависла бы
+            await asyncio.wait_for(second_chat_started.wait(), timeout=5)
+        else:
+            second_chat_started.set()
+        processed.append(update.update_id)
+
+    async def run():
+        nonlocal second_chat_started
+        second_chat_started = asyncio.Event()
+        updates = UpdateQueue(RecordingDispatcher(handler), concurrency=2)
+        updates.put(message_update(1, 1))
+        updates.put(message_update(2, 2))
+        await updates.close()
+
+    asyncio.run(run())
+
+    assert processed == [2, 1]
+
+
+def test_failed_update_does_not_stop_chat():
+    processed = []
+
+    async def handler(update):
+        if update.update_id == 1:
+            raise RuntimeError("handler failed")
+        processed.append(update.update_id)
+
+    async def run():
+        updates = UpdateQueue(RecordingDispatcher(handler))
+        for update_id in range(3):
+            updates.put(message_update(update_id, 42))
+        await updates.close()
+
+    asyncio.run(run())
+
+    assert processed == [0, 2]
@@ -0,0 +1,47 @@
+import asyncio
+import os
+import time
+
+from workers import CRASH_MESSAGE, TIMEOUT_MESSAGE, WorkerPool
+
+
+def run_jobs(pool, *jobs):
+    """Выполняет задачи (key, function, *args) по очереди и возвращает их результаты."""
+    async def run():
+        try:
+            return [await pool.run(key, function, *args) for key, function, *args in jobs]
+        finally:
+            pool.shutdown()
+
+    return asyncio.run(run())
+
+
+def test_user_always_gets_the_same_slot():
+    pool = WorkerPool(workers=3, timeout=10)
+
+    assert [pool._slot(user_id) for user_id in (1, 2, 3, 4, 1, 4)] == [1, 2, 0, 1, 1, 1]
+    assert pool._slot("batch") == pool._slot("batch")
+
+    first, second, other = run_jobs(pool, (1, os.getpid), (4, os.getpid), (2, os.getpid))
+    # Пользователи 1 и 4 делят слот и процесс, а значит и его кэши
+    assert first == second != other
+
+
+def test_timed_out_slot_is_restarted():
+    pool = WorkerPool(workers=2, timeout=0.5)
+
+    before, result, after, other = run_jobs(pool, (1, os.getpid), (1, time.sleep, 5), (1, os.getpid),
+                                            (2, os.getpid))
+
+    assert result == TIMEOUT_MESSAGE
+    assert isinstance(after, int) and after != before
+    assert other not in (before, after)
+
+
+def test_crashed_slot_is_restarted():
+    pool = WorkerPool(workers=2, timeout=10)
+
+    before, result, after = run_jobs(pool, (1, os.getpid), (1, os._exit, 1), (1, os.getpid))
+
+    assert result == CRASH_MESSAGE
+    assert isinstance(after, int) and after != before
@@ -1,37 +1,127 @@
+import time
+
+# Отсчет времени запуска до остальных импортов
+STARTED = time.perf_counter()
+
 from aiogram import Bot, Dispatcher, types
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
+from aiogram.dispatcher.middlewares import BaseMiddleware
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils import executor
 from auth_data import bot_token, admins
-from db import Database
+from db import Database, AsyncDatabase, UnitOfWork
+from downloads import download_document, UploadTooLargeError
 import logging
+import os
 import messages as msg
 import markups
-import main
 from aiogram.types import InputFile
+import asyncio
+import functools
+import importlib
+from typing import Optional
+from aiohttp import web
+from metrics import metrics, collect
+from settings import (WORKERS, JOB_TIMEOUT, DB_READERS, METRICS_PORT, METRICS_LOG_INTERVAL, BACKUP_INTERVAL,
+                      GC_INTERVAL, BOT_MODE, BOT_SHARDS, TELEGRAM_API_URL, JOB_CONCURRENCY)
+from backups import BackupManager
+from cleanup import UploadCollector
+from scheduler import JobScheduler, StatusMessage
+from workers import WorkerPool
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-bot = Bot(token=bot_token)
-dp = Dispatcher(bot)
-db = Database("database.db")
-db.initialize_database()
+# Создаются в create_dispatcher только в основном процессе: процессы пула (spawn) заново
+# импортируют этот модуль, и им не нужны ни бот, ни соединения с базой, ни свой пул
+bot: Optional[Bot] = None
+db: Optional[AsyncDatabase] = None
+pool: Optional[WorkerPool] = None
+scheduler: Optional[JobScheduler] = None
+collector: Optional[UploadCollector] = None
+
+
+_processing = None
+
+
+async def processing():
+    """
+    Модуль обработки main (pandas, openpyxl).
+
+    Загружается в фоне при старте (warm_up) или при первом обращении, в отдельном потоке:
+    бот принимает сообщения сразу, а обработчики ждут загрузки, не блокируя цикл событий.
+    """
+    global _processing
+    if _processing is None:
+        _processing = asyncio.get_running_loop().run_in_executor(None, importlib.import_module, 'main')
+    return await _processing
+
+
+class FirstRequestTimer(BaseMiddleware):
+    """Записывает время обработки первого сообщения после запуска и выводит отчет о запуске."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.done = False
+
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        data['received_at'] = time.perf_counter()
+
+    async def on_post_process_message(self, message: types.Message, results, data: dict):
+        if self.done or 'received_at' not in data:
+            return
+        self.done = True
+        metrics.observe_startup('first_request', time.perf_counter() - data['received_at'])
+        report = "\n".join(f"{phase}: {seconds * 1000:.0f} ms" for phase, seconds in metrics.startup.items())
+        logger.info("Startup report:\n%s", report)
+
+
+async def run_job(handler: str, key, function, *args, stage: str = 'worker'):
+    """
+    Выполняет функцию в пуле процессов и записывает время всей задачи и этапов внутри нее,
+    а также попадания в кэши процесса.
+
+    Задачи с одинаковым key (обычно user_id) выполняются в одном процессе пула.
+    """
+    with metrics.timer(handler, stage):
+        result = await pool.run(key, collect, function, *args)
+    if isinstance(result, str):
+        return result
+    result, stages, cache_events = result
+    for stage_name, seconds in stages.items():
+        metrics.observe_stage(handler, stage_name, seconds)
+    for (cache, event), count in cache_events.items():
+        metrics.observe_cache(cache, event, count)
+    return result
 
 
 # Обработчик команды /start
-@dp.message_handler(commands=['start'])
 async def start(message: types.Message):
-    user_data = db.create_user(message)
+    user_data = await db.create_user(message)
     await message.answer(msg.start_message(user_data), reply_markup=markups.main_keyboard)
 
 
-@dp.message_handler(content_types=types.ContentType.DOCUMENT)
 async def handle_docs(message: types.Message):
     file_name = message.document.file_name
     user_id = message.from_user.id
-    user_data = db.get_row_as_dict({'user_id': user_id})
-    bytes_file = (await bot.download_file_by_id(message.document.file_id)).read()
-    dfs = main.open_excel(bytes_file)
+    user_data = await db.get_row_as_dict({'user_id': user_id})
+    try:
+        with metrics.timer('docs', 'download'):
+            path = await download_document(bot, message.document)
+    except UploadTooLargeError as e:
+        await message.reply(f"Не удалось обработать файл '{file_name}': {e}")
+        return
+    try:
+        metrics.observe_size('docs', 'bytes', os.path.getsize(path))
+        main = await processing()
+        # Процесс пула читает файл по пути через memory map, содержимое не копируется между процессами
+        dfs = await run_job('docs', user_id, main.open_excel, path, stage='parse')
+    finally:
+        os.remove(path)
+
+    if isinstance(dfs, str):
+        await message.reply(f"Не удалось обработать файл '{file_name}': {dfs}")
+        return
 
     if dfs is None or not dfs:
         await message.reply(f"Не удалось обработать файл '{file_name}'. Проверьте формат файла.")
@@ -50,31 +140,64 @@ async def handle_docs(message: types.Message):
             (main.is_items_to_ship, 'items_to_ship_id', "таблица с количеством товаров"),
         ]
 
+    shipments = []  # все листы с количеством товаров: для пакетного режима
+    # Изменения всех листов записываются одной транзакцией, ответы отправляются после нее
+    unit = UnitOfWork()
+    replaced = set()
+    replies = []
     for data in dfs:
         sheet_name = data['name']
         df = data['df']
         for check_function, table_name, description in file_type_functions:
-            result = check_function(df, user_data)
+            with metrics.timer('docs', 'classify'):
+                result = check_function(df, user_data)
             if result:
-                db.save_dataframe(user_id, table_name, df)
+                metrics.observe_size('docs', 'rows', len(df))
+                if table_name == 'items_to_ship_id':
+                    # Листы с количеством сохраняются после разбора всего файла, каждый один раз
+                    shipments.append((sheet_name, df))
+                else:
+                    unit.save_dataframe(user_id, table_name, df)
+                replaced.add(table_name)
                 if table_name != 'boxes_id':
-                    db.reset_amount_of_boxes(user_id)
-                    db.reset_file_ids(user_id, ['boxes_id'])
-                await message.reply(
-                    f"Лист '{sheet_name}' в файле '{file_name}' успешно загружен как {description}.")
+                    unit.reset_amount_of_boxes(user_id)
+                    unit.reset_file_ids(user_id, ['boxes_id'])
+                replies.append(f"Лист '{sheet_name}' в файле '{file_name}' успешно загружен как {description}.")
                 break
             elif isinstance(result, str):  # Если функция возвращает строку, значит обнаружена ошибка
-                await message.reply(f"Ошибка в листе '{sheet_name}' файла '{file_name}': {result}")
+                replies.append(f"Ошибка в листе '{sheet_name}' файла '{file_name}': {result}")
                 break
         else:
-            await message.reply(f"Лист '{sheet_name}' в файле '{file_name}' не удалось идентифицировать.")
+            replies.append(f"Лист '{sheet_name}' в файле '{file_name}' не удалось идентифицировать.")
+
+    # Несколько листов с количеством товаров — отгрузки на разные склады для пакетного режима
+    if len(shipments) > 1:
+        unit.save_shipments(user_id, shipments)
+        replies.append(msg.batch_detected_message([name for name, _ in shipments]))
+    elif shipments:
+        unit.save_dataframe(user_id, 'items_to_ship_id', shipments[0][1])
+        unit.clear_shipments(user_id)
+
+    if any(table_name != 'boxes_id' for table_name in replaced):
+        # Подсчет, отчет и пакетный отчет по прежним таблицам больше не нужны,
+        # а подсчет записал бы устаревшее число коробок
+        scheduler.cancel(user_id, ('count', 'report', 'batch'))
+    with metrics.timer('docs', 'db_write'):
+        try:
+            await db.commit(unit)
+        except Exception:
+            logger.exception("Failed to save uploads of user %s", user_id)
+            await message.reply(f"Не удалось сохранить файл '{file_name}'. Попробуйте загрузить его еще раз.")
+            return
+    with metrics.timer('docs', 'send'):
+        for reply in replies:
+            await message.reply(reply)
 
 
-@dp.message_handler(lambda message: message.text == markups.COUNT_BOXES_TEXT)
 async def handle_count_boxes(message: types.Message):
     user_id = message.from_user.id
     await message.delete()
-    user_data = db.get_row_as_dict({'user_id': user_id})
+    user_data = await db.get_row_as_dict({'user_id': user_id})
 
     missing_steps = []
     if not user_data.get('box_capacity_id'):
@@ -91,25 +214,55 @@ async def handle_count_boxes(message: types.Message):
         response_message = "Для продолжения выполните следующие шаги:\n" + "\n".join(missing_steps)
         await message.answer(response_message)
     else:
-        # Получаем данные из базы данных
-        box_capacity_df, items_to_ship_df, _ = db.get_data_from_db(user_id)
+        # Расчет выполняется в очереди задач, обработчик не ждет его
+        rows = await db.get_upload_rows(user_id)
+        rejection = scheduler.submit(user_id, 'count', functools.partial(count_boxes, message), rows=rows,
+                                     status=StatusMessage(bot, message.chat.id))
+        if rejection:
+            await message.answer(rejection)
 
-        # Выполняем расчет количества коробок
-        box_count_result = main.count_boxes(box_capacity_df, items_to_ship_df)
 
-        if isinstance(box_count_result, str):
-            # Если функция вернула строку, значит произошла ошибка
-            await message.answer(box_count_result)
-        else:
-            db.update_table('users', {'amount_of_boxes': box_count_result}, {'user_id': user_id})
-            await message.answer(f"Всего коробок: {box_count_result}")
+async def count_boxes(message: types.Message):
+    user_id = message.from_user.id
+    # Получаем данные из базы данных
+    with metrics.timer('count', 'db_read'):
+        # Ссылки на таблицы читаются первыми: результат сохраняется, только если их не заменили
+        files = await db.get_row_as_dict({'user_id': user_id}, 'files') or {}
+        box_capacity_df, items_to_ship_df, _ = await db.get_data_from_db(user_id)
+        layout = await db.get_packing_layout(user_id)
+    if box_capacity_df is None or items_to_ship_df is None:
+        # Загрузки сбросили, пока задача ждала в очереди
+        return
+    metrics.observe_size('count', 'rows', len(items_to_ship_df))
+    metrics.observe_size('count', 'skus', items_to_ship_df.iloc[:, 0].nunique())
+
+    # Выполняем расчет количества коробок
+    # Прошлая раскладка позволяет переупаковать только изменившиеся товары и сохранить номера коробок
+    main = await processing()
+    box_count_result = await run_job('count', user_id, main.summarize_packing, box_capacity_df, items_to_ship_df,
+                                     layout)
+
+    if isinstance(box_count_result, str):
+        # Если функция вернула строку, значит произошла ошибка
+        await message.answer(box_count_result)
+    else:
+        total_boxes, saved_boxes, layout = box_count_result
+        metrics.observe_size('count', 'boxes', total_boxes)
+        uploads = {column: files.get(column) for column in ('box_capacity_id', 'items_to_ship_id')}
+        with metrics.timer('count', 'db_write'):
+            saved = await db.save_box_count(user_id, total_boxes, layout, uploads)
+        if not saved:
+            # Пока шел подсчет, пользователь загрузил новые таблицы: результат относится к старым
+            logger.info("Discarding stale box count of user %s", user_id)
+            return
+        with metrics.timer('count', 'send'):
+            await message.answer(msg.box_count_message(total_boxes, saved_boxes))
 
 
-@dp.message_handler(lambda message: message.text == markups.GENERATE_REPORT_TEXT)
 async def handle_generate_report(message: types.Message):
     user_id = message.from_user.id
     await message.delete()
-    user_data = db.get_row_as_dict({'user_id': user_id})
+    user_data = await db.get_row_as_dict({'user_id': user_id})
     new_limit = user_data['usage_limit']
     # Проверка на авторизацию и оставшиеся попытки
     if user_data['is_authorized'] or new_limit > 0:
@@ -128,53 +281,178 @@ async def handle_generate_report(message: types.Message):
             response_message = "Для продолжения выполните следующие шаги:\n" + "\n".join(missing_steps)
             await message.answer(response_message)
         else:
-            # Получаем данные из базы данных
-            box_capacity_df, items_to_ship_df, boxes_id_df = db.get_data_from_db(user_id)
-
-            # Выполняем генерацию отчета
-            result = main.generate_report(box_capacity_df, items_to_ship_df, boxes_id_df)
-
-            if isinstance(result, str):
-                # Если функция вернула строку, значит произошла ошибка
-                await message.answer(result)
-            else:
-                if not user_data['is_authorized']:
-                    new_limit = db.decrease_usage_limit(user_id)
-                db.create_generation(user_id)
-
-                result_wb, result_storage = result
-
-                # Отправка файла для Wildberries
-                await bot.send_document(user_id,
-                                        InputFile(result_wb[0], filename=result_wb[1]),
-                                        caption=msg.success_message_for_wildberries(new_limit))
-
-                # Отправка инструкции для склада
-                await bot.send_document(user_id, InputFile(result_storage[0], filename=result_storage[1]),
-                                        caption=msg.instruction_for_warehouse_message(new_limit))
+            rows = await db.get_upload_rows(user_id)
+            rejection = scheduler.submit(user_id, 'report', functools.partial(generate_report, message),
+                                         rows=rows, boxes=user_data['amount_of_boxes'],
+                                         status=StatusMessage(bot, message.chat.id))
+            if rejection:
+                await message.answer(rejection)
     else:
         # Если пользователь не авторизован и у него нет попыток
         await message.answer(msg.exceeded_limit_message(user_data))
 
 
-@dp.message_handler(lambda message: message.text == markups.RESET_TEXT)
+async def generate_report(message: types.Message):
+    user_id = message.from_user.id
+    # Пока задача ждала в очереди, попытки могли закончиться из-за предыдущего отчета
+    user_data = await db.get_row_as_dict({'user_id': user_id})
+    if not (user_data['is_authorized'] or user_data['usage_limit'] > 0):
+        await message.answer(msg.exceeded_limit_message(user_data))
+        return
+
+    # Получаем данные из базы данных
+    with metrics.timer('report', 'db_read'):
+        box_capacity_df, items_to_ship_df, boxes_id_df = await db.get_data_from_db(user_id)
+        layout = await db.get_packing_layout(user_id)
+    if box_capacity_df is None or items_to_ship_df is None or boxes_id_df is None:
+        return
+    metrics.observe_size('report', 'rows', len(items_to_ship_df))
+    metrics.observe_size('report', 'boxes', user_data['amount_of_boxes'])
+
+    # Выполняем генерацию отчета
+    main = await processing()
+    result = await run_job('report', user_id, main.generate_report,
+                           box_capacity_df, items_to_ship_df, boxes_id_df, layout)
+
+    if isinstance(result, str):
+        # Если функция вернула строку, значит произошла ошибка
+        await message.answer(result)
+    else:
+        # Готовый отчет доставляется и списывает попытку, даже если задачу отменили во время отправки
+        await asyncio.shield(deliver_report(user_id, user_data, result))
+
+
+async def deliver_report(user_id: int, user_data: dict, result):
+    new_limit = user_data['usage_limit']
+    if not user_data['is_authorized']:
+        new_limit = await db.decrease_usage_limit(user_id)
+    await db.create_generation(user_id)
+
+    result_wb, result_storage = result
+
+    with metrics.timer('report', 'send'):
+        # Отправка файла для Wildberries
+        await bot.send_document(user_id,
+                                InputFile(result_wb[0], filename=result_wb[1]),
+                                caption=msg.success_message_for_wildberries(new_limit))
+
+        # Отправка инструкции для склада
+        await bot.send_document(user_id, InputFile(result_storage[0], filename=result_storage[1]),
+                                caption=msg.instruction_for_warehouse_message(new_limit))
+
+
+async def handle_batch_report(message: types.Message):
+    user_id = message.from_user.id
+    await message.delete()
+    user_data = await db.get_row_as_dict({'user_id': user_id})
+    new_limit = user_data['usage_limit']
+    if not (user_data['is_authorized'] or new_limit > 0):
+        await message.answer(msg.exceeded_limit_message(user_data))
+        return
+
+    rows = await db.get_upload_rows(user_id, shipments=True)
+
+    missing_steps = []
+    if not user_data.get('box_capacity_id'):
+        missing_steps.append(
+            " * Загрузите таблицу с вместимостью товаров в коробку (2 столбца: 'Баркод' и 'Кратность').")
+    if not rows:
+        missing_steps.append(" ** Загрузите файл, в котором на каждый склад свой лист с количеством товаров.")
+    if missing_steps:
+        await message.answer("Для продолжения выполните следующие шаги:\n" + "\n".join(missing_steps))
+        return
+
+    rejection = scheduler.submit(user_id, 'batch', functools.partial(batch_report, message), rows=rows,
+                                 status=StatusMessage(bot, message.chat.id))
+    if rejection:
+        await message.answer(rejection)
+
+
+async def batch_report(message: types.Message):
+    user_id = message.from_user.id
+    user_data = await db.get_row_as_dict({'user_id': user_id})
+    if not (user_data['is_authorized'] or user_data['usage_limit'] > 0):
+        await message.answer(msg.exceeded_limit_message(user_data))
+        return
+
+    with metrics.timer('batch', 'db_read'):
+        box_capacity_df, _, _ = await db.get_data_from_db(user_id)
+        shipments = await db.get_shipments(user_id)
+    if box_capacity_df is None or not shipments:
+        # Загрузки сбросили, пока задача ждала в очереди
+        return
+
+    metrics.observe_size('batch', 'rows', sum(len(df) for _, df in shipments))
+
+    # Отгрузки раскладываются параллельно: у каждой свой ключ, а значит и свой процесс пула
+    main = await processing()
+    results = await asyncio.gather(*[
+        run_job('batch', (user_id, name), main.generate_batch_report, box_capacity_df, name, df)
+        for name, df in shipments
+    ])
+    errors = [result for result in results if isinstance(result, str)]
+    if errors:
+        await message.answer("\n".join(errors))
+        return
+
+    bundle = await run_job('batch', user_id, main.build_report_bundle, results, stage='bundle')
+    if isinstance(bundle, str):
+        await message.answer(bundle)
+        return
+
+    await asyncio.shield(deliver_batch_report(user_id, user_data, results, bundle))
+
+
+async def deliver_batch_report(user_id: int, user_data: dict, results, bundle):
+    new_limit = user_data['usage_limit']
+    if not user_data['is_authorized']:
+        new_limit = await db.decrease_usage_limit(user_id)
+    await db.create_generation(user_id)
+
+    summary = [(name, total_boxes) for name, total_boxes, _ in results]
+    metrics.observe_size('batch', 'boxes', sum(total_boxes for _, total_boxes in summary))
+    with metrics.timer('batch', 'send'):
+        await bot.send_document(user_id, InputFile(bundle[0], filename=bundle[1]),
+                                caption=msg.batch_success_message(new_limit, summary))
+
+
 async def reset_command(message: types.Message):
     user_id = message.from_user.id
-    db.reset_file_ids(user_id)
+    # Задачи по сбрасываемым загрузкам больше не нужны
+    scheduler.cancel(user_id)
+    # Таблицы и отгрузки пакетного режима сбрасываются одной транзакцией
+    unit = UnitOfWork()
+    unit.reset_file_ids(user_id)
+    unit.clear_shipments(user_id)
+    await db.commit(unit)
 
     await message.delete()
     await message.answer(msg.reset_success_message(message.from_user.first_name), reply_markup=markups.main_keyboard)
 
 
-@dp.message_handler(content_types=['text'])
+async def stats_command(message: types.Message):
+    # Статистика по этапам обработки доступна только администраторам
+    if message.from_user.username not in admins:
+        return
+    await message.answer(metrics.summary())
+
+
+async def gc_command(message: types.Message):
+    # Внеплановая очистка загрузок без ссылок, только для администраторов
+    if message.from_user.username not in admins:
+        return
+    report = await asyncio.get_running_loop().run_in_executor(None, collector.collect)
+    await message.answer(msg.gc_report_message(report))
+
+
 async def handle_text(message: types.Message):
     user_id = message.from_user.id
-    user_data = db.get_row_as_dict({'user_id': user_id})
+    user_data = await db.get_row_as_dict({'user_id': user_id})
 
     # Проверка на пересланное сообщение и статус администратора
     if 'forward_from' in message and user_data["username"] in admins:
         forwarded_user_id = message.forward_from.id
-        forwarded_user_data = db.get_row_as_dict({"user_id": forwarded_user_id}, "users")
+        forwarded_user_data = await db.get_row_as_dict({"user_id": forwarded_user_id}, "users")
         if forwarded_user_data:
             info = f"UserID: {forwarded_user_data['user_id']}\nUsername: @{forwarded_user_data['username']}\n" \
                    f"Attempts: {forwarded_user_data['usage_limit']}\n" \
@@ -194,7 +472,7 @@ async def handle_text(message: types.Message):
     input_text = message.text
     if user_data and input_text == user_data['password']:
         # Пароль верный, производим авторизацию
-        db.toggle_authorization(user_id, authorize=True)
+        await db.toggle_authorization(user_id, authorize=True)
         await message.answer("Вы успешно авторизованы.")
     else:
         # Пароль неверный
@@ -202,23 +480,121 @@ async def handle_text(message: types.Message):
 
 
 # Обработчики для callback данных кнопок
-@dp.callback_query_handler(lambda call: call.data.startswith("give_password:"))
 async def handle_give_password(call: types.CallbackQuery):
-    user_id = call.data.split(':')[1]
-    user_data = db.get_row_as_dict({"user_id": user_id})
+    user_id = int(call.data.split(':')[1])
+    user_data = await db.get_row_as_dict({"user_id": user_id})
     password = user_data["password"]
     await bot.send_message(chat_id=call.from_user.id, text=password)
     await call.answer()
 
 
-@dp.callback_query_handler(lambda call: call.data.startswith("generate_password:"))
 async def handle_generate_password(call: types.CallbackQuery):
     user_id = int(call.data.split(':')[1])  # Получаем user_id из callback данных
-    user_data = db.update_user(user_id)
+    user_data = await db.update_user(user_id)
     password = user_data["password"]
     await bot.send_message(chat_id=call.from_user.id, text=password)
     await call.answer()
 
 
+def create_dispatcher() -> Dispatcher:
+    """Создает бота, базу, пул процессов и очередь задач и регистрирует обработчики."""
+    global bot, db, pool, scheduler, collector
+    bot = Bot(token=bot_token,
+              server=TelegramAPIServer.from_base(TELEGRAM_API_URL) if TELEGRAM_API_URL else TELEGRAM_PRODUCTION)
+    db = AsyncDatabase(Database("database.db"), DB_READERS)
+    pool = WorkerPool(WORKERS, JOB_TIMEOUT, preload=('main',))
+    scheduler = JobScheduler(JOB_CONCURRENCY or WORKERS)
+    collector = UploadCollector(db.database.db_file, db.database.uploads.root)
+
+    dp = Dispatcher(bot)
+    dp.middleware.setup(FirstRequestTimer())
+    # Порядок важен: handle_text принимает любой текст, поэтому регистрируется после кнопок и команд
+    dp.register_message_handler(start, commands=['start'])
+    dp.register_message_handler(handle_docs, content_types=types.ContentType.DOCUMENT)
+    dp.register_message_handler(handle_count_boxes, lambda message: message.text == markups.COUNT_BOXES_TEXT)
+    dp.register_message_handler(handle_generate_report,
+                                lambda message: message.text == markups.GENERATE_REPORT_TEXT)
+    dp.register_message_handler(handle_batch_report, lambda message: message.text == markups.BATCH_REPORT_TEXT)
+    dp.register_message_handler(reset_command, lambda message: message.text == markups.RESET_TEXT)
+    dp.register_message_handler(stats_command, commands=['stats'])
+    dp.register_message_handler(gc_command, commands=['gc'])
+    dp.register_message_handler(handle_text, content_types=['text'])
+    dp.register_callback_query_handler(handle_give_password, lambda call: call.data.startswith("give_password:"))
+    dp.register_callback_query_handler(handle_generate_password,
+                                       lambda call: call.data.startswith("generate_password:"))
+    return dp
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=metrics.render_prometheus(), content_type="text/plain")
+
+
+async def dump_metrics_periodically(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        logger.info("Stage metrics:\n%s", metrics.summary())
+
+
+async def backup_periodically(interval: float):
+    backups = BackupManager(db.database.db_file)
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        # Снимок делается порциями в отдельном потоке и не мешает обработке сообщений
+        await loop.run_in_executor(None, backups.run)
+
+
+async def collect_garbage_periodically(interval: float):
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await loop.run_in_executor(None, collector.collect)
+        except Exception:
+            logger.exception("Upload GC failed")
+
+
+async def warm_up():
+    """Загружает модули обработки в боте и процессах пула, пока бот уже принимает сообщения."""
+    start = time.perf_counter()
+    await asyncio.gather(processing(), pool.warm_up())
+    metrics.observe_startup('warm_up', time.perf_counter() - start)
+
+
+async def on_startup(dispatcher: Dispatcher):
+    metrics.observe_startup('ready', time.perf_counter() - STARTED)
+    asyncio.create_task(warm_up())
+    if METRICS_PORT:
+        # Эндпоинт только на localhost: снаружи его должен забирать локальный агент мониторинга
+        app = web.Application()
+        app.router.add_get("/metrics", handle_metrics)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", METRICS_PORT).start()
+    if METRICS_LOG_INTERVAL:
+        asyncio.create_task(dump_metrics_periodically(METRICS_LOG_INTERVAL))
+    if BACKUP_INTERVAL:
+        asyncio.create_task(backup_periodically(BACKUP_INTERVAL))
+    if GC_INTERVAL:
+        asyncio.create_task(collect_garbage_periodically(GC_INTERVAL))
+
+
+async def on_shutdown(dispatcher: Dispatcher):
+    pool.shutdown()
+    db.close()
+
+
 if __name__ == "__main__":
-    executor.start_polling(dp, skip_updates=True)
+    metrics.observe_startup('import', time.perf_counter() - STARTED)
+    dp = create_dispatcher()
+    database_start = time.perf_counter()
+    db.database.initialize_database()
+    metrics.observe_startup('database', time.perf_counter() - database_start)
+    if BOT_MODE == "webhook" and BOT_SHARDS > 1:
+        from shards import run_sharded
+        run_sharded(dp, os.path.abspath(__file__), BOT_SHARDS)
+    elif BOT_MODE == "webhook":
+        from webhook import run_webhook
+        run_webhook(dp, on_startup=on_startup, on_shutdown=on_shutdown)
+    else:
+        executor.start_polling(dp, skip_updates=True, on_startup=on_startup, on_shutdown=on_shutdown)
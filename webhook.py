@@ -0,0 +1,134 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Hashable, Set
+
+from aiogram import Bot, Dispatcher, types
+from aiohttp import web
+
+from settings import (WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET, UPDATE_CONCURRENCY,
+                      UPDATE_QUEUE_LIMIT)
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def chat_key(update: types.Update) -> Hashable:
+    """Чат, к которому относится обновление. Обновления без чата обрабатываются независимо."""
+    message = update.message or update.edited_message
+    if message is not None:
+        return message.chat.id
+    if update.callback_query is not None:
+        query = update.callback_query
+        return query.message.chat.id if query.message is not None else query.from_user.id
+    return "update", update.update_id
+
+
+class UpdateQueue:
+    """
+    Очередь обновлений, полученных вебхуком.
+
+    Обновления разных чатов обрабатываются параллельно, но не более concurrency одновременно,
+    обновления одного чата — строго по порядку поступления. Для каждого чата с необработанными
+    обновлениями работает своя задача, она завершается, когда обновления чата заканчиваются.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, concurrency: int = UPDATE_CONCURRENCY,
+                 limit: int = UPDATE_QUEUE_LIMIT) -> None:
+        self.dispatcher = dispatcher
+        self.limit = limit
+        self.pending = 0
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._chats: Dict[Hashable, Deque[types.Update]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def full(self) -> bool:
+        return self.pending >= self.limit
+
+    def put(self, update: types.Update) -> None:
+        key = chat_key(update)
+        updates = self._chats.get(key)
+        if updates is None:
+            updates = self._chats[key] = deque()
+            task = asyncio.create_task(self._process_chat(key, updates))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        updates.append(update)
+        self.pending += 1
+
+    async def _process_chat(self, key: Hashable, updates: Deque[types.Update]) -> None:
+        # Обработчики берут бота и диспетчер из контекста, как при polling
+        Bot.set_current(self.dispatcher.bot)
+        Dispatcher.set_current(self.dispatcher)
+        try:
+            while updates:
+                update = updates.popleft()
+                try:
+                    async with self._semaphore:
+                        await self.dispatcher.process_update(update)
+                except Exception:
+                    logger.exception("Error while processing update %s", update.update_id)
+                finally:
+                    self.pending -= 1
+        finally:
+            self._chats.pop(key, None)
+
+    async def close(self) -> None:
+        """Дожидается обработки уже принятых обновлений."""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+def create_app(dispatcher: Dispatcher, updates: UpdateQueue, path: str = WEBHOOK_PATH,
+               secret: str = WEBHOOK_SECRET) -> web.Application:
+    """Приложение aiohttp с обработчиком вебхука. Ответ Telegram отправляется сразу после постановки в очередь."""
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if secret and request.headers.get(SECRET_HEADER) != secret:
+            return web.Response(status=403)
+        if updates.full():
+            # Telegram повторит доставку позже
+            return web.Response(status=503)
+        updates.put(types.Update(**(await request.json())))
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    return app
+
+
+async def set_webhook(bot: Bot, max_connections: int = UPDATE_CONCURRENCY) -> None:
+    """Регистрирует WEBHOOK_URL + WEBHOOK_PATH в Telegram. Пустой WEBHOOK_URL — вебхук уже настроен."""
+    if WEBHOOK_URL:
+        await bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None,
+                              max_connections=max_connections, drop_pending_updates=False)
+
+
+def run_webhook(dispatcher: Dispatcher, on_startup: Callable[[Dispatcher], Awaitable],
+                on_shutdown: Callable[[Dispatcher], Awaitable]) -> None:
+    """
+    Запускает бота в режиме вебхука на WEBHOOK_HOST:WEBHOOK_PORT.
+
+    TLS завершается на прокси, который передает запросы с WEBHOOK_URL + WEBHOOK_PATH.
+    Обновления, накопившиеся за время простоя, не сбрасываются.
+    """
+    updates = UpdateQueue(dispatcher)
+    app = create_app(dispatcher, updates)
+
+    async def startup(_: web.Application) -> None:
+        Bot.set_current(dispatcher.bot)
+        Dispatcher.set_current(dispatcher)
+        await set_webhook(dispatcher.bot)
+        await on_startup(dispatcher)
+
+    async def shutdown(_: web.Application) -> None:
+        await updates.close()
+        await on_shutdown(dispatcher)
+        await dispatcher.storage.close()
+        await dispatcher.storage.wait_closed()
+        await (await dispatcher.bot.get_session()).close()
+
+    app.on_startup.append(startup)
+    app.on_shutdown.append(shutdown)
+    web.run_app(app, host=WEBHOOK_HOST, port=WEBHOOK_PORT)
@@ -0,0 +1,107 @@
+import asyncio
+import functools
+import importlib
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Hashable, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT_MESSAGE = "Обработка заняла слишком много времени и была остановлена. Попробуйте файл меньшего размера."
+CRASH_MESSAGE = "Во время обработки произошла внутренняя ошибка. Попробуйте еще раз."
+
+
+def _init_worker(preload: Sequence[str]) -> None:
+    logging.basicConfig(level=logging.INFO)
+    # Модули обработки загружаются при запуске процесса, а не в первой задаче
+    for module in preload:
+        importlib.import_module(module)
+
+
+def _ready() -> bool:
+    return True
+
+
+class WorkerPool:
+    """
+    Пул процессов для тяжелых операций (разбор Excel, упаковка, построение отчета).
+
+    Каждый слот — отдельный процесс. Задачи одного ключа (user_id) всегда попадают в один
+    слот, поэтому кэши внутри процесса (например, main.packing_cache) переиспользуются между
+    подсчетом коробок и отчетом. В слоте одновременно выполняется одна задача; если она
+    превысила таймаут или процесс упал, процесс слота перезапускается, остальные слоты
+    продолжают работу.
+
+    preload — модули, которые импортируются при запуске процесса слота; warm_up запускает
+    процессы всех слотов заранее, перезапущенный слот сразу запускается снова.
+    """
+
+    def __init__(self, workers: int, timeout: float, preload: Sequence[str] = ()) -> None:
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.preload = tuple(preload)
+        self._context = multiprocessing.get_context("spawn")
+        self._executors: List[Optional[ProcessPoolExecutor]] = [None] * self.workers
+        self._locks = [asyncio.Lock() for _ in range(self.workers)]
+
+    def _slot(self, key: Hashable) -> int:
+        return (key if isinstance(key, int) else hash(key)) % self.workers
+
+    def _executor(self, slot: int) -> ProcessPoolExecutor:
+        if self._executors[slot] is None:
+            self._executors[slot] = ProcessPoolExecutor(max_workers=1, mp_context=self._context,
+                                                        initializer=_init_worker, initargs=(self.preload,))
+        return self._executors[slot]
+
+    def _restart(self, slot: int) -> None:
+        executor = self._executors[slot]
+        self._executors[slot] = None
+        if executor is None:
+            return
+        # У ProcessPoolExecutor нет публичного способа прервать выполняющуюся задачу
+        for process in list((getattr(executor, "_processes", None) or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+        # Новый процесс запускается и загружает модули до следующей задачи слота
+        self._executor(slot).submit(_ready)
+
+    async def warm_up(self) -> None:
+        """Запускает процессы всех слотов, чтобы первые задачи не ждали запуска и импорта модулей."""
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._executor(slot), _ready) for slot in range(self.workers)),
+                             return_exceptions=True)
+
+    async def run(self, key: Hashable, function: Callable, *args, timeout: Optional[float] = None) -> Any:
+        """
+        Выполняет function(*args) в процессе слота, соответствующего key.
+
+        При превышении таймаута или падении процесса возвращает строку с описанием ошибки,
+        как это принято для функций обработки в main. Исключения самой функции пробрасываются.
+        """
+        slot = self._slot(key)
+        async with self._locks[slot]:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._executor(slot), functools.partial(function, *args))
+            try:
+                return await asyncio.wait_for(future, timeout or self.timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Job %s timed out in worker slot %s, restarting it", function.__name__, slot)
+                self._restart(slot)
+                return TIMEOUT_MESSAGE
+            except BrokenProcessPool:
+                logger.error("Worker slot %s crashed while running %s, restarting it", slot, function.__name__)
+                self._restart(slot)
+                return CRASH_MESSAGE
+            except asyncio.CancelledError:
+                # Задачу отменили (например, сбросом): процесс слота останавливается, чтобы не считать впустую
+                logger.info("Job %s cancelled in worker slot %s, restarting it", function.__name__, slot)
+                self._restart(slot)
+                raise
+
+    def shutdown(self) -> None:
+        for slot, executor in enumerate(self._executors):
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._executors[slot] = None